@@ -4,18 +4,567 @@
 """
 __module__ = "track_analyzer"
 
+import concurrent.futures
+import copy
+import csv
 import datetime
+import glob
+import gzip
+import hashlib
+import io
+import json
 import logging
+import lzma
 import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
 import unittest
+import unittest.mock
+import uuid
+import zipfile
+from xml.etree import ElementTree
 
 import argparse
+import bz2
+import calendar
+import collections
+import functools
+import inspect
 import os
 import re
 import numpy as np
 import pandas as pd
 
 import gpxpy
+import gpxpy.geo
+import gpxpy.gpx
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd compressed tracks can't be read
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # tracks can't be exported to arrow or parquet
+
+try:
+    import geographiclib.geodesic
+except ImportError:
+    geographiclib = None  # no "karney" distance model
+
+
+class WindowCriterion:
+    """
+    A condition on a window of the track, held as data rather than code so
+    build_distance_list() can evaluate it with array operations.  Criteria
+    combine with And(), Or(), & and |.
+    """
+
+    def dnf(self):
+        """
+        the criterion as a list of alternatives, each a list of comparisons
+        which must all hold
+        """
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+
+class Comparison(WindowCriterion):
+    """
+    a WindowQuantity compared with a value, e.g. Distance >= 5000
+    """
+
+    OPS = (">=", ">", "<=", "<")
+
+    def __init__(self, quantity, op, value):
+        if op not in Comparison.OPS:
+            raise ValueError(f"unknown comparison {op}")
+        self.quantity = quantity
+        self.op = op
+        self.value = value
+
+    def dnf(self):
+        return [[self]]
+
+    def __eq__(self, other):
+        return isinstance(other, Comparison) and (
+            (self.quantity, self.op, self.value)
+            == (other.quantity, other.op, other.value)
+        )
+
+    def __hash__(self):
+        return hash((self.quantity, self.op, self.value))
+
+    def __repr__(self):
+        return f"{self.quantity} {self.op} {self.value:g}"
+
+
+class CombinedCriterion(WindowCriterion):
+    """
+    the common parts of And() and Or()
+    """
+
+    def __init__(self, *criteria):
+        self.criteria = criteria
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.criteria == other.criteria
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.criteria))
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.criteria}"
+
+
+class And(CombinedCriterion):
+    """
+    every one of the criteria holds
+    """
+
+    def dnf(self):
+        terms = [[]]
+        for criterion in self.criteria:
+            terms = [
+                term + alternative for term in terms for alternative in criterion.dnf()
+            ]
+        return terms
+
+
+class Or(CombinedCriterion):
+    """
+    at least one of the criteria holds
+    """
+
+    def dnf(self):
+        return [term for criterion in self.criteria for term in criterion.dnf()]
+
+
+class WindowQuantity:
+    """
+    Something which accumulates over a window of the track.  Comparing it
+    with a value makes a criterion, either as Distance >= 5000 or as
+    Distance(">=", 5000).  Times may be given as seconds, a timedelta or a
+    string like "27:44".
+    """
+
+    def __init__(self, name, is_time=False):
+        self.name = name
+        self.is_time = is_time
+
+    def normalise(self, value):
+        """
+        the value as a plain float, in metres or seconds
+        """
+        if not self.is_time:
+            return float(value)
+        if isinstance(value, str):
+            seconds = 0.0
+            for part in value.split(":"):
+                seconds = seconds * 60 + float(part)
+            return seconds
+        if isinstance(value, datetime.timedelta):
+            return value.total_seconds()
+        return float(value)
+
+    def __call__(self, op, value):
+        return Comparison(self.name, op, self.normalise(value))
+
+    def __ge__(self, value):
+        return self(">=", value)
+
+    def __gt__(self, value):
+        return self(">", value)
+
+    def __le__(self, value):
+        return self("<=", value)
+
+    def __lt__(self, value):
+        return self("<", value)
+
+
+Distance = WindowQuantity("distance")
+MovingTime = WindowQuantity("moving_time", is_time=True)
+ElapsedTime = WindowQuantity("elapsed_time", is_time=True)
+Elevation = WindowQuantity("ascent")
+
+# the likelihood, between 0 and 1, of each activity given the moving speed
+# (m/s) or distance (m) of a segment, used by guess_activity_type().  Each is
+# a ramp through a few knots, so takes a single value or an array of them.
+
+
+def ramp(values, knots, heights):
+    """
+    linear interpolation between (knot, height) pairs, holding the end
+    heights beyond the knots, and 0 where a value is missing (NaN)
+    """
+    return np.nan_to_num(np.interp(values, knots, heights), nan=0.0)
+
+
+def walk_likelihood(speed):
+    """
+    rises from 0 at 0 m/s to 1 at 9:19 pace (4mph),
+    then back down to 0 at 6:19 pace (10 min mile)
+    In m/s these thresholds are 0, 1.788, 2.867
+    """
+    return ramp(speed, [0, 1.788, 2.867], [0, 1, 0])
+
+
+def run_likelihood(speed):
+    """
+    rises from 0 at 9:19 pace to 1 at 6:19 pace
+    1 from 6:19 thru 4:22
+    falls to 0 from 4:22 thru 3:45
+    in m/s these thresholds are 1.788, 2.867, 3.810, 4.444
+    """
+    return ramp(speed, [1.788, 2.867, 3.810, 4.444], [0, 1, 1, 0])
+
+
+def cycle_likelihood(speed):
+    """
+    rises from 0 at slow-run pace to 1 at slow cycle pace
+    stays at 1 from slow cycle to long distance cycle pace
+    then drops back to 0 at twice that
+    in m/s these thresholds are 2.687, 4.444, 5.010, 10
+    """
+    return ramp(speed, [2.687, 4.444, 5.010, 10], [0, 1, 1, 0])
+
+
+def walk_distance_likelihood(dist):
+    """
+    Very likely from 0-5k
+    Then reduces, say, linearly to 20k
+    """
+    return ramp(dist, [5000, 20000], [1, 0])
+
+
+def run_distance_likelihood(dist):
+    """
+    Very likely from 1k - 20k
+    Reducing down to 30k
+    0 > 30k
+    """
+    return ramp(dist, [1000, 5000, 20000, 30000], [0, 1, 1, 0])
+
+
+def cycle_distance_likelihood(dist):
+    """
+    shopping trips tend to be ~ 3k
+    20-50k almost certainly cylcling
+    50-120k reducing likelihood
+    """
+    return ramp(dist, [0, 20000, 50000, 120000], [0, 1, 1, 0])
+
+
+def as_pace(secs_per_km):
+    """
+    seconds per km (a number or an array or Series of them) as Timedelta
+    pace, for display
+    """
+    return pd.to_timedelta(secs_per_km, unit="s")
+
+
+def with_paces(frame):
+    """
+    a copy of frame for display, with a Timedelta pace column added after
+    each column of seconds per km (secs_per_km -> pace,
+    gap_secs_per_km -> gap_pace)
+    """
+    frame = frame.copy()
+    for column in list(frame.columns):
+        if isinstance(column, str) and column.endswith("secs_per_km"):
+            pace = column[: -len("secs_per_km")] + "pace"
+            frame.insert(
+                frame.columns.get_loc(column) + 1, pace, as_pace(frame[column])
+            )
+    return frame
+
+
+# slower than this (m/s) from the previous point counts as stopped
+STOPPED_SPEED = 3000 / 3600
+
+
+def stopped(delta_dist, secs):
+    """
+    whether each point (or a single one) was reached from its predecessor
+    slower than STOPPED_SPEED, so its time doesn't count as moving.  This is
+    the rule TrackData.zero_tdiff_of_slow_point(), ChunkedTrack and
+    track_live.LiveTrack all share.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.asarray(delta_dist, dtype=float) / secs <= STOPPED_SPEED
+
+
+# activity -> (likelihood from speed, likelihood from distance)
+ACTIVITY_LIKELIHOODS = {
+    "walk": (walk_likelihood, walk_distance_likelihood),
+    "run": (run_likelihood, run_distance_likelihood),
+    "cycle": (cycle_likelihood, cycle_distance_likelihood),
+}
+
+
+def pick_activity(walk, run, cycle):
+    """
+    the activity with the highest total likelihood, or "undetermined" if
+    there isn't a clear winner
+    """
+    if walk > run:
+        if walk > cycle:
+            return "walk"
+
+    if run > cycle:
+        if run > walk:
+            return "run"
+
+    if cycle > walk:
+        if cycle > run:
+            return "cycle"
+
+    return "undetermined"
+
+
+class AnalysisCache:
+    """
+    A bounded, least recently used, store of analysis results.  Keys are
+    built by memoized() from the track's identity, the versions of the
+    frames the result depends on, and the arguments of the call.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.results = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        return (True, result) if the key is cached, otherwise (False, None)
+        """
+        try:
+            result = self.results[key]
+        except KeyError:
+            self.misses += 1
+            return (False, None)
+        self.results.move_to_end(key)
+        self.hits += 1
+        return (True, result)
+
+    def put(self, key, result):
+        """
+        cache a result, evicting the least recently used beyond maxsize
+        """
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def forget(self, cache_id, frames=None):
+        """
+        forget the results of the track with cache_id which depend on any of
+        the named frames, or all of its results if frames is None
+        """
+        for key in list(self.results):
+            if key[0] == cache_id and (
+                frames is None or any(frame in frames for (frame, _) in key[2])
+            ):
+                del self.results[key]
+
+    def usage(self, cache_id):
+        """
+        the memory, in bytes, held by the cached results of the track with
+        cache_id, see result_size()
+        """
+        return sum(
+            result_size(result)
+            for (key, result) in self.results.items()
+            if key[0] == cache_id
+        )
+
+    def clear(self):
+        """
+        forget everything
+        """
+        self.results.clear()
+
+
+def result_size(result):
+    """
+    roughly the memory, in bytes, held by an analysis result: DataFrames and
+    arrays are measured deeply, containers by adding up their items
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return int(np.sum(result.memory_usage(deep=True)))
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sys.getsizeof(result) + sum(
+            result_size(item) for item in result.values()
+        )
+    if isinstance(result, (list, tuple)):
+        return sys.getsizeof(result) + sum(result_size(item) for item in result)
+    return sys.getsizeof(result)
+
+
+ANALYSIS_CACHE = AnalysisCache()
+
+
+def memoized(*frames):
+    """
+    decorate a TrackData method whose result depends only on its arguments and
+    on the named frames, so that repeating a call returns the cached result.
+    Calls are matched after filling in default arguments, so
+    build_distance_list() and build_distance_list(Distance >= 5000) share a
+    result.  Calls with arguments which can't be hashed aren't cached.
+    DataFrames, dicts and lists are handed out as deep copies so the cached
+    result can't be altered by the caller.
+    """
+
+    def freeze(value):
+        if isinstance(value, dict):
+            return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(item) for item in value)
+        return value
+
+    def decorate(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            call = signature.bind(self, *args, **kwargs)
+            call.apply_defaults()
+            key = (
+                self.cache_id,
+                method.__name__,
+                tuple((frame, self.frame_versions[frame]) for frame in frames),
+                freeze(list(call.arguments.items())[1:]),
+            )
+            try:
+                (found, result) = ANALYSIS_CACHE.get(key)
+            except TypeError:
+                return method(self, *args, **kwargs)  # unhashable arguments
+            if not found:
+                result = method(self, *args, **kwargs)
+                ANALYSIS_CACHE.put(key, result)
+            if isinstance(result, pd.DataFrame):
+                return result.copy()
+            if isinstance(result, (dict, list)):
+                return copy.deepcopy(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+class LogHistogram:
+    """
+    A mergeable sketch of a distribution of positive values, for percentiles
+    over more points than can be held in memory.  Values are counted into
+    fixed, logarithmically spaced bins between low and high (with one bin
+    either side for values outside), so percentiles are good to about
+    1 / bins_per_decade relative error and sketches with the same bins are
+    merged by adding their counts.
+    """
+
+    def __init__(self, low, high, bins_per_decade=200):
+        self.low = float(low)
+        self.high = float(high)
+        self.bins_per_decade = int(bins_per_decade)
+        self.bins = int(np.ceil(np.log10(self.high / self.low) * self.bins_per_decade))
+        # [below low, the bins, at or above high]
+        self.counts = np.zeros(self.bins + 2, dtype=np.int64)
+
+    def edges(self):
+        """
+        the boundaries of the bins between low and high
+        """
+        return self.low * 10 ** (np.arange(self.bins + 1) / self.bins_per_decade)
+
+    def add(self, values):
+        """
+        count an array of values, ignoring any which aren't finite
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[np.isfinite(values)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            index = np.floor(np.log10(values / self.low) * self.bins_per_decade) + 1
+        index = np.clip(np.nan_to_num(index, nan=0, neginf=0), 0, self.bins + 1)
+        self.counts += np.bincount(index.astype(int), minlength=self.bins + 2)
+        return self
+
+    def merge(self, other):
+        """
+        add another sketch's counts into this one
+        """
+        if (other.low, other.high, other.bins_per_decade) != (
+            self.low,
+            self.high,
+            self.bins_per_decade,
+        ):
+            raise ValueError("can only merge sketches with the same bins")
+        self.counts += other.counts
+        return self
+
+    def count(self):
+        """
+        the number of values counted
+        """
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        """
+        the value below which q percent of the values lie, interpolated
+        geometrically within its bin, or None if the sketch is empty
+        """
+        total = self.count()
+        if total == 0:
+            return None
+        target = q / 100 * total
+        cumulative = self.counts.cumsum()
+        index = min(int(np.searchsorted(cumulative, target, "left")), self.bins + 1)
+        if index == 0:
+            return self.low
+        if index == self.bins + 1:
+            return self.high
+        below = cumulative[index - 1]
+        fraction = (target - below) / self.counts[index] if self.counts[index] else 0
+        lower = self.low * 10 ** ((index - 1) / self.bins_per_decade)
+        return float(lower * 10 ** (fraction / self.bins_per_decade))
+
+    def to_dict(self):
+        """
+        a json friendly form, only holding the bins which were counted into
+        """
+        used = np.flatnonzero(self.counts)
+        return {
+            "low": self.low,
+            "high": self.high,
+            "bins_per_decade": self.bins_per_decade,
+            "counts": dict(zip(used.tolist(), self.counts[used].tolist())),
+        }
+
+    @classmethod
+    def from_dict(cls, sketch):
+        """
+        rebuild a sketch from to_dict()
+        """
+        histogram = cls(sketch["low"], sketch["high"], sketch["bins_per_decade"])
+        for index, count in sketch["counts"].items():
+            histogram.counts[int(index)] = count
+        return histogram
 
 
 class TrackData:
@@ -23,6 +572,9 @@ class TrackData:
     The track is held in this object as a pandas DataFrame
     """
 
+    # how elevation_profile() smooths altitudes unless told otherwise
+    ELEVATION_SMOOTHING = {"method": "hysteresis", "window": 5, "threshold": 3.0}
+
     def __init__(self):
         """
         build the internal data structure
@@ -36,16 +588,137 @@ class TrackData:
         self.north_bound = None
         self.south_bound = None
         self.centre = None
+        self.elevation_data = pd.DataFrame()
+        self.elevation_version = None  # of track_data elevation_data was built from
+        self.track_names = []
+        self.slurp_peak_memory = None  # bytes, if slurp() traced it
+        # identify this track and the state of its frames to memoized()
+        self.cache_id = uuid.uuid4().hex
+        self.frame_versions = dict.fromkeys(TrackData.FRAMES, 0)
         self.logger = logging.getLogger(__name__)
 
-    def slurp(self, filename):
+    FRAMES = ("track_data", "processed_track_data", "segment_data")
+
+    # the attributes of a gpx <bounds> element
+    BOUNDS_ATTRS = ("minlat", "minlon", "maxlat", "maxlon")
+
+    def memory_usage(self):
+        """
+        the deep memory usage, in bytes, of each of the track's frames (so
+        including the python objects in object columns) and their total
+        """
+        usage = {
+            frame: int(getattr(self, frame).memory_usage(deep=True).sum())
+            for frame in TrackData.FRAMES + ("elevation_data",)
+            if isinstance(getattr(self, frame), pd.DataFrame)
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+    # point columns which are fine at single precision, and the integer ones
+    # which fit in 32 bits.  Positions and distances stay double precision,
+    # since they are summed along the track.
+    DOWNCAST_FLOATS = ("Altitude", "GPS Speed", "DOP", "gpxpy_speed", "seg_speed")
+    DOWNCAST_INTS = ("TrackNo", "SegNo", "PointNo")
+
+    def downcast(self):
+        """
+        shrink the point frames in place by narrowing the DOWNCAST_ columns.
+        Heart Rate is left alone, as are the columns summed along the track.
+        returns : the number of bytes saved
+        """
+        before = self.memory_usage()["total"]
+        for frame in ("track_data", "processed_track_data"):
+            data = getattr(self, frame)
+            narrowed = {
+                column: pd.to_numeric(data[column]).astype(np.float32)
+                for column in TrackData.DOWNCAST_FLOATS
+                if column in data
+            }
+            narrowed.update(
+                {
+                    column: data[column].astype(np.int32)
+                    for column in TrackData.DOWNCAST_INTS
+                    if column in data
+                }
+            )
+            setattr(self, frame, data.assign(**narrowed))
+        self.invalidate("track_data", "processed_track_data")
+        return before - self.memory_usage()["total"]
+
+    def invalidate(self, *frames):
+        """
+        forget the cached results which depend on the named frames (all of
+        them if none are named).  Call this after changing a frame in place.
+        """
+        frames = frames or TrackData.FRAMES
+        for frame in frames:
+            self.frame_versions[frame] += 1
+        ANALYSIS_CACHE.forget(self.cache_id, frames)
+
+    def slurp(self, filename, trace_memory=False, distance_model=None, three_d=False):
         """
-        parse a gpx file into an object
+        parse a gpx file into an object.  filename may also be an open binary
+        file, and gzip, bz2, xz or zstd compressed files are decompressed as
+        they are read.  With trace_memory, the peak memory allocated while
+        slurping is traced (which slows it down) into slurp_peak_memory.
+        distance_model: one of the DISTANCE_MODELS to measure the distance
+        between points by, see remeasure(), rather than gpxpy's
         """
         self.logger.debug(f"slurp() {filename}")
-        with open(filename, "rb") as gpx_file:
-            self.process(gpx_file)
+        if trace_memory:
+            already_tracing = tracemalloc.is_tracing()
+            if not already_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            with open_track_file(filename) as gpx_file:
+                self.process(gpx_file)
+            if distance_model is not None or three_d:
+                self.remeasure(distance_model or "gpxpy", three_d)
+            self.post_process()
+        finally:
+            if trace_memory:
+                self.slurp_peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+                if not already_tracing:
+                    tracemalloc.stop()
+
+    def remeasure(self, model="vincenty", three_d=False):
+        """
+        recompute the delta_dist between each point and the one before with
+        one of the DISTANCE_MODELS (see geodesic_distance()), counting the
+        climb too with three_d.  processed_track_data is rebuilt to match if
+        the track has been post processed.  segment_data keeps gpxpy's
+        distances.
+        """
+        points = self.track_data
+        if points.empty:
+            return
+        lat = points["Latitude"].to_numpy(dtype=float)
+        lon = points["Longitude"].to_numpy(dtype=float)
+        altitude = (None, None)
+        if three_d:
+            alt = pd.to_numeric(points["Altitude"]).to_numpy(dtype=float)
+            altitude = (np.concatenate(([alt[0]], alt[:-1])), alt)
+        delta_dist = geodesic_distance(
+            np.concatenate(([lat[0]], lat[:-1])),
+            np.concatenate(([lon[0]], lon[:-1])),
+            lat,
+            lon,
+            model,
+            *altitude,
+        )
+        delta_dist[points["PointNo"].to_numpy() == 0] = 0
+        self.track_data["delta_dist"] = delta_dist
+        self.invalidate("track_data")
+        if not self.processed_track_data.empty:
+            self.zero_tdiff_of_slow_point()
 
+    def post_process(self):
+        """
+        run the POST_PROCESS steps over freshly extracted frames
+        """
         for processing_fn in TrackData.POST_PROCESS:
             processing_fn(self)
 
@@ -64,40 +737,63 @@ class TrackData:
         except NameError:
             return False  # Probably standard Python interpreter
 
+    # the columns of the point rows built by point_rows()
+    POINT_COLUMNS = [
+        "SegNo",
+        "PointNo",
+        "Date_time",
+        "Latitude",
+        "Longitude",
+        "Altitude",
+        "GPS Speed",
+        "DOP",
+        "gpxpy_speed",
+        "seg_speed",
+        "delta_dist",
+        "Heart Rate",
+    ]
+
     @staticmethod
-    def get_point_info(segment_number, track_segment):
+    def point_rows(segment_number, track_segment):
         """
-        extract data from points in a segment and push it into a DataFrame
+        extract data from points in a segment as a list of rows, one per
+        point, in POINT_COLUMNS order
         """
-        logging.getLogger().debug(f"get_point_info() {segment_number} {track_segment}")
-        col_names = (
-            "SegNo,PointNo,Date_time,Latitude,Longitude,Altitude,GPS Speed,DOP,"
-            "gpxpy_speed,seg_speed,delta_dist"
-        )
-        cols = list(col_names.split(","))
-        local_df = pd.DataFrame(columns=cols)
-        for point, point_no in track_segment.walk():
-            #    for pointno, point in enumerate(s.points[0:20]):
-            if point.extensions:
+        logging.getLogger().debug(f"point_rows() {segment_number} {track_segment}")
+
+        def get_speed(x):
+            """
+            parse the contents of the speed tag out of the xml
+            """
+            for xml_field in x:
+                if xml_field.tag == "speed":
+                    return xml_field.text
+            return 0
 
-                def get_speed(x):
-                    """
-                    parse the contents of the speed tag out of the xml
-                    """
-                    for xml_field in x:
-                        if xml_field.tag == "speed":
-                            return xml_field.text
-                    return 0
+        def get_heart_rate(x):
+            """
+            Garmin style files nest the heart rate in a
+            TrackPointExtension, so search the whole tree for it
+            """
+            for extension in x:
+                for xml_field in extension.iter():
+                    if xml_field.tag.rpartition("}")[2] == "hr":
+                        return xml_field.text
+            return np.nan
 
+        rows = []
+        for point, point_no in track_segment.walk():
+            if point.extensions:
                 speed = float(get_speed(point.extensions))
+                heart_rate = float(get_heart_rate(point.extensions))
             else:
                 speed = float(0)
+                heart_rate = np.nan
             if point_no != 0:
                 calc_speed = point.speed_between(track_segment.points[point_no - 1])
                 #  distance = point.distance_3d(track_segment.points[point_no - 1])
                 distance = point.distance_2d(track_segment.points[point_no - 1])
             else:
-                # print( dir(point))
                 calc_speed = float(0)
                 distance = float(0)
             try:
@@ -106,84 +802,178 @@ class TrackData:
             except TypeError:
                 seg_speed = 0
 
-            local_df.loc[point_no] = [
-                segment_number,
-                point_no,
-                point.time,
-                point.latitude,
-                point.longitude,
-                point.elevation,
-                speed,
-                point.horizontal_dilution,
-                calc_speed,
-                seg_speed,
-                distance,
-            ]
+            rows.append(
+                [
+                    segment_number,
+                    point_no,
+                    point.time,
+                    point.latitude,
+                    point.longitude,
+                    point.elevation,
+                    speed,
+                    point.horizontal_dilution,
+                    calc_speed,
+                    seg_speed,
+                    distance,
+                    heart_rate,
+                ]
+            )
+        return rows
+
+    @staticmethod
+    def point_frame(rows, columns):
+        """
+        build the point DataFrame from rows in one go, adding dt and tdiff.
+        tdiff restarts at zero with each segment (PointNo 0).
+        """
+        local_df = pd.DataFrame(rows, columns=columns)
+        if local_df.empty:
+            local_df["dt"] = pd.Series(dtype=object)
+            local_df["tdiff"] = pd.Series(dtype="timedelta64[us]")
+            return local_df
 
         # although pandas appears to process the gpxpy time into a datetime,
         # things go awry when trying to plot with that as an index, so I've
         # resorted to going via str() and strptime() to rid myself of
         # any dependency on gpxpy once I'm in the DataFrame
-        # local_df["dt"] = pd.to_datetime(local_df["Date_time"])
         # Date_time looks like: 2021-01-12 07:47:39+00:00
         local_df["dt"] = local_df["Date_time"].apply(
             lambda x: datetime.datetime.strptime(str(x), "%Y-%m-%d %H:%M:%S%z")
         )
+        # gpxpy's own tzinfo can't be compared with datetime.timezone, which
+        # breaks pandas when a row is taken across Date_time and dt
+        local_df["Date_time"] = local_df["dt"]
+        tdiff = local_df["dt"].diff(1)
+        tdiff[local_df["PointNo"] == 0] = pd.Timedelta(seconds=0)
+        local_df["tdiff"] = tdiff.fillna(pd.Timedelta(seconds=0))
+        return local_df
 
+    @staticmethod
+    def get_point_info(segment_number, track_segment):
+        """
+        extract data from points in a segment and push it into a DataFrame
+        indexed by time
+        """
+        local_df = TrackData.point_frame(
+            TrackData.point_rows(segment_number, track_segment),
+            TrackData.POINT_COLUMNS,
+        )
         local_df.index = local_df["dt"]
-        local_df["tdiff"] = (local_df["dt"].diff(1)).fillna(pd.Timedelta(seconds=0))
-
         return local_df
 
-    def process(self, input_file):
+    # files with fewer points than this are extracted without a worker pool
+    PARALLEL_POINTS = 20000
+
+    @staticmethod
+    def extract_segment(track_no, seg_no, segment):
         """
-        iterate over the tracks and their segments in the file,
-         - output some summary info
-         - use get_point_info to create a DataFrame which is then exposed
-           at the global level for use in subsequent cells
+        summarise a segment and extract its points with point_rows()
+        returns : (segment summary dict, list of point rows each starting
+        with the TrackNo, moving seconds)
         """
+        logging.getLogger(__name__).debug(
+            f"segment {track_no}.{seg_no} has {len(segment.points)} points"
+        )
+        if segment.has_elevations():
+            (up_m, down_m) = segment.get_uphill_downhill()
+        else:
+            (up_m, down_m) = (0, 0)
+
+        moving_data_dict = {"TrackNo": track_no, "SegNo": seg_no}
+        moving_data_dict.update(
+            segment.get_moving_data(stopped_speed_threshold=1)._asdict()
+        )
 
+        moving_data_dict["ascent"] = up_m
+        moving_data_dict["descent"] = down_m
+        moving_data_dict["2d length"] = segment.length_2d()
+        moving_data_dict["3d length"] = segment.length_3d()
+
+        if segment.has_times():
+            secs = segment.get_moving_data()[0]
+        else:
+            secs = 0
+
+        rows = [[track_no] + row for row in TrackData.point_rows(seg_no, segment)]
+        return (moving_data_dict, rows, secs)
+
+    def process(self, input_file, workers=None):
+        """
+        parse a gpx file (or open file) and extract() its tracks
+        """
         self.logger.debug(f"process() {input_file}")
-        gpx = gpxpy.parse(input_file)
-
-        for track in gpx.tracks:
-            all_data = pd.DataFrame()
-            moving_data = pd.DataFrame()
-            for seg_no, segment in enumerate(track.segments):
-                self.logger.debug("segment {seg_no} has {len(segment.points)}")
-                if segment.has_elevations():
-                    (up_m, down_m) = segment.get_uphill_downhill()
-                else:
-                    (up_m, down_m) = (0, 0)
+        self.extract(gpxpy.parse(input_file), workers)
+
+    def extract(self, gpx, workers=None):
+        """
+        iterate over the tracks and their segments of a parsed gpx file,
+         - build a summary row per segment into segment_data
+         - use point_rows to extract the points of every segment of every
+           track, which are exposed as track_data
+        Each row is labelled with its TrackNo and SegNo.  Files with at least
+        PARALLEL_POINTS points and more than one segment have their segments
+        extracted on a pool of workers processes (unless workers is 1).
+        The segments are collected as plain records and each DataFrame is
+        built once at the end, so the cost grows linearly with the number
+        of segments.
+        """
+        self.track_names = [track.name for track in gpx.tracks]
+        jobs = [
+            (track_no, seg_no, segment)
+            for track_no, track in enumerate(gpx.tracks)
+            for seg_no, segment in enumerate(track.segments)
+        ]
+        total_points = sum(len(segment.points) for (_, _, segment) in jobs)
 
-                moving_data_dict = segment.get_moving_data(
-                    stopped_speed_threshold=1
-                )._asdict()
+        if workers != 1 and len(jobs) > 1 and total_points >= TrackData.PARALLEL_POINTS:
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                results = list(executor.map(TrackData.extract_segment, *zip(*jobs)))
+        else:
+            results = [TrackData.extract_segment(*job) for job in jobs]
 
-                moving_data_dict["ascent"] = up_m
-                moving_data_dict["descent"] = down_m
-                moving_data_dict["2d length"] = segment.length_2d()
-                moving_data_dict["3d length"] = segment.length_3d()
+        moving_records = []
+        point_rows = []
+        moving_secs = 0
+        for moving_data_dict, rows, secs in results:
+            moving_records.append(moving_data_dict)
+            point_rows.extend(rows)
+            moving_secs += secs
+        self.duration = pd.Timedelta(seconds=moving_secs)
+        self.track_data = TrackData.point_frame(
+            point_rows, ["TrackNo"] + TrackData.POINT_COLUMNS
+        )
+        self.segment_data = pd.DataFrame.from_records(moving_records)
+        self.invalidate()
 
-                moving_data = pd.concat(
-                    (
-                        moving_data,
-                        pd.DataFrame(moving_data_dict, index=["dummy unused"]),
-                    ),
-                    ignore_index=True,
-                )
-                if segment.has_times():
-                    secs = segment.get_moving_data()[0]
-                    self.duration = pd.Timedelta(seconds=secs)
-                else:
-                    self.duration = pd.Timedelta(seconds=0)
+    def track_frames(self):
+        """
+        split processed_track_data by track, for files holding several
+        returns : a dict of TrackNo -> DataFrame
+        """
+        return dict(list(self.processed_track_data.groupby("TrackNo")))
 
-                all_data = pd.concat(
-                    (all_data, self.get_point_info(seg_no, segment)),
-                    ignore_index=True,
-                )
-            self.track_data = all_data
-            self.segment_data = moving_data
+    def track_summary(self):
+        """
+        total the segment summaries of each track in the file
+        returns : a DataFrame with a row per track
+        """
+        by_track = self.segment_data.groupby("TrackNo")
+        summary = by_track[
+            [
+                "moving_time",
+                "stopped_time",
+                "moving_distance",
+                "stopped_distance",
+                "ascent",
+                "descent",
+                "2d length",
+                "3d length",
+            ]
+        ].sum()
+        summary.insert(0, "segments", by_track["SegNo"].count())
+        summary.insert(0, "name", [self.track_names[n] for n in summary.index])
+        summary["max_speed"] = by_track["max_speed"].max()
+        return summary
 
     def segment_summary(self):
         """
@@ -204,6 +994,7 @@ class TrackData:
 
         return self.segment_data
 
+    @memoized("segment_data")
     def guess_activity_type(self):
         """
         guess what activity each segment corresponds with, can be one of
@@ -215,159 +1006,50 @@ class TrackData:
             self.segment_data["moving_distance"] / self.segment_data["moving_time"]
         )
         # pace is a Timedelta representing time for 1km,
-        self.segment_data["pace"] = self.segment_data["moving_speed"].apply(
-            lambda x: pd.Timedelta(seconds=1000 / x if x > 0 else 0)
+        speed = self.segment_data["moving_speed"].to_numpy(dtype=float)
+        self.segment_data["pace"] = as_pace(
+            np.divide(1000, speed, out=np.zeros_like(speed), where=speed > 0)
         )
 
-        def walk_likelihood(speed):
-            """
-            rises from 0 at 0 m/s to 1 at 9:19 pace (4mph),
-            then back down to 0 at 6:19 pace (10 min mile)
-            In m/s these thresholds are 0, 1.788, 2.867
-            """
-            if speed < 1.788:
-                return speed / 1.788
-            if speed < 2.867:
-                return (2.867 - speed) / (2.867 - 1.788)
-            return 0
-
-        def run_likelihood(speed):
-            """
-            rises from 0 at 9:19 pace to 1 at 6:19 pace
-            1 from 6:19 thru 4:22
-            falls to 0 from 4:22 thru 3:45
-            in m/s these thresholds are 1.788, 2.867, 3.810, 4.444
-            """
-            if speed < 1.788:
-                return 0
-            if speed < 2.867:
-                return (speed - 1.788) / (2.867 - 1.788)
-            if speed < 3.810:
-                return 1
-            if speed < 4.444:
-                return (4.444 - speed) / (4.444 - 3.810)
-            return 0
-
-        def cycle_likelihood(speed):
-            """
-            rises from 0 at slow-run pace to 1 at slow cycle pace
-            stays at 1 from slow cycle to long distance cycle pace
-            then drops back to 0 at twice that
-            in m/s these thresholds are 2.687, 4.444, 5.010, 10
-            """
-            if speed < 2.687:
-                return 0
-            if speed < 4.444:
-                return (speed - 2.687) / (4.444 - 2.687)
-            if speed < 5.010:
-                return 1
-            if speed < 10:
-                return (10 - speed) / (10 - 5.010)
-            return 0
-
-        def walking_distance(dist):
-            """
-            Very likely from 0-5k
-            Then reduces, say, linearly to 20k
-            """
-            if dist < 5000:
-                return 1
-            if dist < 20000:
-                return (20000 - dist) / (20000 - 5000)
-            return 0
-
-        def running_distance(dist):
-            """
-            Very likely from 1k - 20k
-            Reducing down to 30k
-            0 > 30k
-            """
-            if dist < 1000:
-                return 0
-            if dist < 5000:
-                return (dist - 1000) / (5000 - 1000)
-            if dist < 20000:
-                return 1
-            if dist < 30000:
-                return (30000 - dist) / (30000 - 20000)
-            return 0
-
-        def cycling_distance(dist):
-            """
-            shopping trips tend to be ~ 3k
-            20-50k almost certainly cylcling
-            50-120k reducing likelihood
-            """
-            if dist < 20000:
-                return dist / 20000
-            if dist < 50000:
-                return 1
-            if dist < 120000:
-                return (120000 - dist) / (120000 - 50000)
-            return 0
-
-        self.segment_data["P(walk) from speed"] = self.segment_data[
-            "moving_speed"
-        ].apply(walk_likelihood)
-        self.segment_data["P(run) from speed"] = self.segment_data[
-            "moving_speed"
-        ].apply(run_likelihood)
-        self.segment_data["P(cycle) from speed"] = self.segment_data[
-            "moving_speed"
-        ].apply(cycle_likelihood)
-        self.segment_data["P(walk) from distance"] = self.segment_data[
-            "moving_distance"
-        ].apply(walking_distance)
-        self.segment_data["P(run) from distance"] = self.segment_data[
-            "moving_distance"
-        ].apply(running_distance)
-        self.segment_data["P(cycle) from distance"] = self.segment_data[
-            "moving_distance"
-        ].apply(cycling_distance)
+        for activity, (from_speed, unused) in ACTIVITY_LIKELIHOODS.items():
+            self.segment_data[f"P({activity}) from speed"] = from_speed(
+                self.segment_data["moving_speed"].to_numpy(dtype=float)
+            )
+        for activity, (unused, from_distance) in ACTIVITY_LIKELIHOODS.items():
+            self.segment_data[f"P({activity}) from distance"] = from_distance(
+                self.segment_data["moving_distance"].to_numpy(dtype=float)
+            )
 
         # Having calculated these likelihoods, now lets average them and use
         # the highest as our guess.
 
-        walk_likelihood = (
+        walk_scores = (
             self.segment_data["P(walk) from distance"]
             + self.segment_data["P(walk) from speed"]
         )
-        run_likelihood = (
+        run_scores = (
             self.segment_data["P(run) from distance"]
             + self.segment_data["P(run) from speed"]
         )
-        cycle_likelihood = (
+        cycle_scores = (
             self.segment_data["P(cycle) from distance"]
             + self.segment_data["P(cycle) from speed"]
         )
 
-        walk = np.array(walk_likelihood)
-        run = np.array(run_likelihood)
-        cycle = np.array(cycle_likelihood)
+        walk = np.array(walk_scores)
+        run = np.array(run_scores)
+        cycle = np.array(cycle_scores)
         # build a matrix with rows corresponding to segments and
         # columns corrresponding with walk, run, cycle
         total_likelihood = np.vstack((walk, run, cycle)).T
         # for each row, pull out the column with highest likelihood
-        most_likely = [
-            total_likelihood[x, :].argmax() for x in range(total_likelihood.shape[0])
+        most_likely = total_likelihood.argmax(axis=1)
+        self.segment_data["activity_type"] = np.array(["walk", "run", "cycle"])[
+            most_likely
         ]
-        act_type = [["walk", "run", "cycle"][x] for x in most_likely]
-        self.segment_data["activity_type"] = act_type
 
         # however, the xxx_likelihood is a series across segments, just sum
-        if walk_likelihood.sum() > run_likelihood.sum():
-            if walk_likelihood.sum() > cycle_likelihood.sum():
-                return "walk"
-
-        if run_likelihood.sum() > cycle_likelihood.sum():
-            if run_likelihood.sum() > walk_likelihood.sum():
-                return "run"
-
-        if cycle_likelihood.sum() > walk_likelihood.sum():
-            if cycle_likelihood.sum() > run_likelihood.sum():
-                return "cycle"
-
-        return "undetermined"
+        return pick_activity(walk_scores.sum(), run_scores.sum(), cycle_scores.sum())
 
     def show_point_info(self):
         """
@@ -388,11 +1070,13 @@ class TrackData:
         """
         self.processed_track_data = self.track_data.copy()  # don't modify original
         self.processed_track_data.loc[
-            self.processed_track_data["delta_dist"]
-            / self.processed_track_data["tdiff"].apply(lambda x: x.total_seconds())
-            <= 3000 / 3600,
+            stopped(
+                self.processed_track_data["delta_dist"],
+                self.processed_track_data["tdiff"].dt.total_seconds(),
+            ),
             "tdiff",
         ] = pd.Timedelta(seconds=0)
+        self.invalidate("processed_track_data")
         return self.processed_track_data
 
     @staticmethod
@@ -402,25 +1086,119 @@ class TrackData:
         """
         return dist_so_far >= 5000
 
-    # have to use the strange __func__ referencer as the name is not entirely
-    # defined, nor boundto the class at compile time
-    def build_distance_list(self, test_after_adding_point=fastest5k.__func__):
+    def window_arrays(self):
+        """
+        the cumulative arrays over processed_track_data which window criteria
+        are evaluated against, keyed by WindowQuantity name
+        """
+        elevation = self.default_elevation()
+        (cum_dist, cum_secs) = self.distance_and_time()
+        return {
+            "distance": cum_dist,
+            "moving_time": cum_secs,
+            "elapsed_time": self.track_data["tdiff"]
+            .dt.total_seconds()
+            .to_numpy()
+            .cumsum(),
+            "ascent": elevation["cum_ascent"].to_numpy(),
+        }
+
+    def window_ends(self, criterion, arrays=None):
+        """
+        for every start point, the first later point at which the window
+        between them meets the criterion, or -1 if no such point exists.
+
+        All the window quantities only ever grow as the window is extended,
+        so each comparison holds over a contiguous run of end points which a
+        binary search of the cumulative array finds for every start point at
+        once.  And() intersects the runs and Or() takes the earliest.
+        Windows may end on the final point, which the call back path of
+        build_distance_list() has never allowed.
+        """
+        if arrays is None:
+            arrays = self.window_arrays()
+        rows = self.processed_track_data.shape[0]
+        start_rows = np.arange(rows)
+        ends = np.full(rows, rows)  # rows means no end found
+        for term in criterion.dnf():
+            first = start_rows + 1
+            last = np.full(rows, rows - 1)
+            for atom in term:
+                along = arrays[atom.quantity]
+                target = along + atom.value
+                if atom.op == ">=":
+                    first = np.maximum(first, np.searchsorted(along, target, "left"))
+                elif atom.op == ">":
+                    first = np.maximum(first, np.searchsorted(along, target, "right"))
+                elif atom.op == "<=":
+                    last = np.minimum(last, np.searchsorted(along, target, "right") - 1)
+                else:
+                    last = np.minimum(last, np.searchsorted(along, target, "left") - 1)
+            ends = np.minimum(ends, np.where(first <= last, first, rows))
+        return np.where(ends < rows, ends, -1)
+
+    @memoized("track_data", "processed_track_data")
+    def build_distance_list(self, test_after_adding_point=Distance >= 5000):
         """
         find the set of activities within the track which meet the criterion
 
-        :param test_after_adding_point(total_metres: int, time_so_far:
-        pd.TimeDelta): boolean
+        :param test_after_adding_point: a WindowCriterion such as
+        Distance >= 5000 or And(MovingTime <= "27:44", Elevation >= 100)
+        which is evaluated for every start point at once with array
+        operations.  The default returns the set of intervals which are 5k
+        runs - the minimum time of these would be the best 5k run.
 
-        a function returning true if the criterion has been met and false
-        otherwise. If no argument is provided, then the default function is
-        applied which returns the set of intervals which are 5k runs - the
-        minimum time of these would be the best 5k run.
+        Alternatively a function (total_metres: int, time_so_far:
+        pd.TimeDelta): boolean returning true if the criterion has been met
+        and false otherwise, e.g. TrackData.fastest5k.  This is called back
+        at every step, so is much slower.
 
         build_distance_list tries to meet the criteria starting from the first
         point, then the second etc, creating an entry in a DataFrame for each
-        start point for which the call back returns true."""
+        start point for which the criterion is met."""
+
+        if isinstance(test_after_adding_point, WindowCriterion):
+            arrays = self.window_arrays()
+            end_rows = self.window_ends(test_after_adding_point, arrays)
+            start_rows = np.flatnonzero(end_rows >= 0)
+            end_rows = end_rows[start_rows]
+            dt = self.processed_track_data["dt"].to_numpy()
+            cum_dist = arrays["distance"]
+            cum_secs = arrays["moving_time"]
+            distance_list = {
+                "start_row": start_rows,
+                "end_row": end_rows,
+                "start_time": dt[start_rows],
+                "cum_dist": cum_dist[end_rows] - cum_dist[start_rows],
+                "cum_time": pd.to_timedelta(
+                    cum_secs[end_rows] - cum_secs[start_rows], unit="s"
+                ),
+                "end_time": dt[end_rows],
+            }
+        else:
+            distance_list = self._callback_distance_list(test_after_adding_point)
+
+        dl_df = pd.DataFrame(distance_list)
+        # in s/km, see with_paces() for showing it as a Timedelta pace
+        dl_df["secs_per_km"] = (
+            pd.to_timedelta(dl_df["cum_time"]).dt.total_seconds().to_numpy()
+            / dl_df["cum_dist"].to_numpy(dtype=float)
+            * 1000
+        )
+        dl_df.index = dl_df["start_time"]
+        dl_df.drop(["start_time"], inplace=True, axis="columns")
+        return dl_df
+
+    def _callback_distance_list(self, test_after_adding_point):
+        """
+        the slow path of build_distance_list(), calling back into python each
+        time a point is added or removed
+        """
+        tdiffs = self.processed_track_data["tdiff"].tolist()
+        delta_dists = self.processed_track_data["delta_dist"].tolist()
+        times = self.processed_track_data["dt"].tolist()
 
-        def meets_criteria(in_df, start_at, test_after_adding_point=None):
+        def meets_criteria(start_at, test_after_adding_point=None):
             """
             Lots of tests follow the same pattern, refactor using a testing
             function
@@ -428,10 +1206,10 @@ class TrackData:
             cum_time = pd.Timedelta(seconds=0)
             cum_dist = 0
             # print(f"mo dist: {start_at}")
-            for i in range(start_at + 1, in_df.shape[0]):
+            for i in range(start_at + 1, len(tdiffs)):
                 # print(f"{cum_dist}")
-                cum_time += in_df.iloc[i]["tdiff"]
-                cum_dist += in_df.iloc[i]["delta_dist"]
+                cum_time += tdiffs[i]
+                cum_dist += delta_dists[i]
                 if test_after_adding_point is not None and test_after_adding_point(
                     cum_dist, cum_time
                 ):
@@ -441,158 +1219,2128 @@ class TrackData:
         start_row = 0
         distance_list = []
         (end_row, total_dist, total_time) = meets_criteria(
-            self.processed_track_data,
             start_row,
             test_after_adding_point=test_after_adding_point,
         )
         # print(end_row, total_dist, total_time)
-        last_row = self.processed_track_data.shape[0] - 1
+        last_row = len(tdiffs) - 1
         while end_row < last_row and start_row < last_row:
             item = {
                 "start_row": start_row,
                 "end_row": end_row,
-                "start_time": self.processed_track_data.iloc[start_row]["dt"],
+                "start_time": times[start_row],
                 "cum_dist": total_dist,
                 "cum_time": total_time,
-                "end_time": self.processed_track_data.iloc[end_row]["dt"],
+                "end_time": times[end_row],
             }
             distance_list.append(item.copy())
 
-            start_row += 1  # start at the next point
+            start_row += 1  # start at the next point
+
+            # which means removing the delta time and distance of that point
+            total_dist -= delta_dists[start_row]
+            total_time -= tdiffs[start_row]
+
+            # even though the start point has been removed, we could still be
+            # in a situation where the cumulative distance and time are with
+            # the criteria
+            if test_after_adding_point(total_dist, total_time):
+                # record and go around the loop again
+                continue
+
+            # then adding points at the end until the criteria is met again
+            while end_row < last_row:
+                end_row += 1
+                total_dist += delta_dists[end_row]
+                total_time += tdiffs[end_row]
+                if test_after_adding_point(total_dist, total_time):
+                    break
+        return distance_list
+
+    @memoized("track_data", "processed_track_data")
+    def best_effort(self, distance):
+        """
+        the quickest stretch of the track covering at least distance metres,
+        as a dict of start_time, distance and moving_time (in seconds), or None
+        if the track is shorter than that.
+        """
+        arrays = self.window_arrays()
+        end_rows = self.window_ends(Distance >= distance, arrays)
+        start_rows = np.flatnonzero(end_rows >= 0)
+        if start_rows.shape[0] == 0:
+            return None
+        cum_dist = arrays["distance"]
+        cum_secs = arrays["moving_time"]
+        times = cum_secs[end_rows[start_rows]] - cum_secs[start_rows]
+        start_row = start_rows[times.argmin()]
+        end_row = end_rows[start_row]
+        return {
+            "start_time": self.processed_track_data["dt"].iloc[start_row].isoformat(),
+            "distance": float(cum_dist[end_row] - cum_dist[start_row]),
+            "moving_time": float(cum_secs[end_row] - cum_secs[start_row]),
+        }
+
+    @staticmethod
+    def minetti_cost(grade):
+        """
+        energy cost of running (J/kg/m) on a grade, from Minetti et al. 2002.
+        The fit only holds between -45% and +45% so grades are clipped to that.
+        """
+        grade = np.clip(grade, -0.45, 0.45)
+        return (
+            155.4 * grade**5
+            - 30.4 * grade**4
+            - 43.3 * grade**3
+            + 46.3 * grade**2
+            + 19.5 * grade
+            + 3.6
+        )
+
+    @memoized("track_data", "processed_track_data")
+    def rolling_stats(self, window=60, by="time"):
+        """
+        rolling pace, speed, grade and grade adjusted pace over the window
+        ending at each point of processed_track_data.
+        window: seconds of moving time if by='time', metres if by='distance'
+
+        Each window runs back from its end point to the last point at least
+        window away, found by a binary search of the cumulative moving time
+        (or distance), so irregular sampling and the stops removed by
+        zero_tdiff_of_slow_point() are handled without a python loop.  Points
+        too near the start for a full window get NaN.
+        returns : a DataFrame indexed by the time of the window's end point
+        """
+        cum_dist = (
+            self.processed_track_data["delta_dist"].to_numpy(dtype=float).cumsum()
+        )
+        cum_secs = (
+            self.processed_track_data["tdiff"].dt.total_seconds().to_numpy().cumsum()
+        )
+        elevation = self.default_elevation()
+        altitude = elevation["smoothed_altitude"].to_numpy()
+
+        if by == "time":
+            along = cum_secs
+        elif by == "distance":
+            along = cum_dist
+        else:
+            raise ValueError(f"rolling window by {by}, expected 'time' or 'distance'")
+        start_rows = np.searchsorted(along, along - window, side="right") - 1
+        full = start_rows >= 0
+        start_rows = np.where(full, start_rows, 0)
+
+        distance = np.where(full, cum_dist - cum_dist[start_rows], np.nan)
+        moving_time = np.where(full, cum_secs - cum_secs[start_rows], np.nan)
+        rise = np.where(full, altitude - altitude[start_rows], np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = np.where(moving_time > 0, distance / moving_time, np.nan)
+            grade = np.where(distance > 0, rise / distance, np.nan)
+            secs_per_km = 1000 / speed
+            gap_speed = (
+                speed * TrackData.minetti_cost(grade) / TrackData.minetti_cost(0)
+            )
+            gap_secs_per_km = 1000 / gap_speed
+
+        return pd.DataFrame(
+            {
+                "start_row": np.where(full, start_rows, -1),
+                "distance": distance,
+                "moving_time": moving_time,
+                "speed": speed,
+                "secs_per_km": secs_per_km,
+                "grade": grade,
+                "gap_secs_per_km": gap_secs_per_km,
+            },
+            index=pd.Index(self.processed_track_data["dt"], name="end_time"),
+        )
+
+    @staticmethod
+    def interp_at(along, values, positions):
+        """
+        linearly interpolate values, given at the points of the non-decreasing
+        array along (e.g. cumulative distance), at each of positions.  The
+        bracketing points are found by binary search, and repeated values of
+        along (stops) take the value at the first of them.
+        """
+        last = along.shape[0] - 1
+        upper = np.clip(np.searchsorted(along, positions, side="left"), 1, last)
+        below = along[upper - 1]
+        above = along[upper]
+        fraction = np.divide(
+            positions - below,
+            above - below,
+            out=np.ones_like(positions, dtype=float),
+            where=above > below,
+        )
+        fraction = np.clip(fraction, 0, 1)
+        return values[upper - 1] + fraction * (values[upper] - values[upper - 1])
+
+    SPLIT_DISTANCES = {"km": 1000, "mile": 1609.344}
+
+    @memoized("track_data", "processed_track_data")
+    def splits(self, lap="km"):
+        """
+        a table of splits like a watch would give.
+        lap: 'km', 'mile', a lap distance in metres, or a list of lap
+        distances in metres for custom laps.  Whatever is left over at the end
+        of the track becomes a final, short, split.
+
+        The split boundaries are found by binary search of the cumulative
+        distance, and times, ascent and heart rate are interpolated across the
+        boundary point.
+        returns : a DataFrame with a row per split, times are in seconds
+        """
+        cum_dist = (
+            self.processed_track_data["delta_dist"].to_numpy(dtype=float).cumsum()
+        )
+        total = cum_dist[-1] if cum_dist.shape[0] else 0
+        if isinstance(lap, str):
+            lap = TrackData.SPLIT_DISTANCES[lap]
+        if np.ndim(lap) == 0:
+            bounds = np.arange(lap, total, lap)
+        else:
+            bounds = np.cumsum(lap)
+            bounds = bounds[bounds < total]
+        bounds = np.concatenate(([0], bounds, [total]))
+
+        elevation = self.default_elevation()
+        elapsed_tdiff = self.track_data["tdiff"].dt.total_seconds().to_numpy()
+        heart_rate = self.track_data["Heart Rate"].to_numpy(dtype=float)
+        timed_hr = np.where(np.isnan(heart_rate), 0, heart_rate * elapsed_tdiff)
+        hr_secs = np.where(np.isnan(heart_rate), 0, elapsed_tdiff)
+        cumulative = {
+            "moving_time": self.processed_track_data["tdiff"]
+            .dt.total_seconds()
+            .to_numpy()
+            .cumsum(),
+            "elapsed_time": elapsed_tdiff.cumsum(),
+            "ascent": elevation["cum_ascent"].to_numpy(),
+            "timed_hr": timed_hr.cumsum(),
+            "hr_secs": hr_secs.cumsum(),
+        }
+        split_data = {"distance": np.diff(bounds)}
+        for name, values in cumulative.items():
+            split_data[name] = np.diff(TrackData.interp_at(cum_dist, values, bounds))
+
+        table = pd.DataFrame(split_data)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            table["secs_per_km"] = table["moving_time"] / table["distance"] * 1000
+            table["avg_heart_rate"] = np.where(
+                table["hr_secs"] > 0, table["timed_hr"] / table["hr_secs"], np.nan
+            )
+        table.drop(["timed_hr", "hr_secs"], inplace=True, axis="columns")
+        table.index = pd.RangeIndex(1, table.shape[0] + 1, name="split")
+        return table
+
+    @memoized("processed_track_data")
+    def distance_and_time(self):
+        """
+        the cumulative distance and moving time at each point, the arrays an
+        effort is aligned by and windows are found over.  They're shared
+        with every caller, so mustn't be changed.
+        """
+        return (
+            self.processed_track_data["delta_dist"].to_numpy(dtype=float).cumsum(),
+            self.processed_track_data["tdiff"].dt.total_seconds().to_numpy().cumsum(),
+        )
+
+    def compare(self, reference):
+        """
+        race this effort against another over the same route, aligned by
+        distance from the start.  At each point (up to the shorter effort's
+        distance) the reference's moving time at the same distance is
+        interpolated, giving:
+         - gap: seconds behind the reference (negative when ahead)
+         - gained: seconds gained on the reference since the previous point
+        returns : a DataFrame with a row per point, indexed by time
+        """
+        (cum_dist, cum_secs) = self.distance_and_time()
+        (ref_dist, ref_secs) = reference.distance_and_time()
+        rows = np.searchsorted(cum_dist, min(cum_dist[-1], ref_dist[-1]), "right")
+        reference_time = TrackData.interp_at(ref_dist, ref_secs, cum_dist[:rows])
+        gap = cum_secs[:rows] - reference_time
+        comparison = pd.DataFrame(
+            {
+                "distance": cum_dist[:rows],
+                "moving_time": cum_secs[:rows],
+                "reference_time": reference_time,
+                "gap": gap,
+                "gained": -np.diff(gap, prepend=0),
+            },
+            index=self.processed_track_data["dt"].iloc[:rows],
+        )
+        return comparison
+
+    def compare_splits(self, reference, lap="km"):
+        """
+        the splits (see splits()) of this effort and another side by side,
+        with the difference in moving time of each (negative when quicker)
+        returns : a DataFrame with a row per split both efforts reached
+        """
+        mine = self.splits(lap)[["distance", "moving_time", "secs_per_km"]]
+        theirs = reference.splits(lap)[["moving_time", "secs_per_km"]]
+        table = mine.join(theirs, rsuffix="_reference", how="inner")
+        table["difference"] = table["moving_time"] - table["moving_time_reference"]
+        return table
+
+    def compare_with_history(self, history, lap="km"):
+        """
+        race this effort against any number of earlier efforts over the same
+        route at once.
+        history: a dict of name -> TrackData, or an iterable of TrackData
+        returns : a DataFrame of the gap (seconds behind, negative when ahead)
+        to each earlier effort at every lap boundary and at the end of the
+        shortest effort, a row per earlier effort
+        """
+        if not isinstance(history, dict):
+            history = dict(enumerate(history))
+        (cum_dist, cum_secs) = self.distance_and_time()
+        arrays = [track.distance_and_time() for track in history.values()]
+        finish = min([cum_dist[-1]] + [dist[-1] for (dist, unused) in arrays])
+        if isinstance(lap, str):
+            lap = TrackData.SPLIT_DISTANCES[lap]
+        marks = np.append(np.arange(lap, finish, lap), finish)
+        my_times = TrackData.interp_at(cum_dist, cum_secs, marks)
+        their_times = interp_rows(
+            [dist for (dist, unused) in arrays],
+            [secs for (unused, secs) in arrays],
+            marks,
+        )
+        return pd.DataFrame(
+            my_times - their_times,
+            index=list(history),
+            columns=pd.Index(marks, name="distance"),
+        )
+
+    @memoized("track_data", "processed_track_data")
+    def strava_stats(self):
+        """
+        return a set of stats which are similar to those shown in the summary
+        of a Strava track
+        """
+        moving_distance = self.processed_track_data["delta_dist"].sum()
+        moving_time = self.processed_track_data["tdiff"].sum()
+        pace = pd.Timedelta(
+            seconds=moving_time.total_seconds() / moving_distance * 1000
+        )
+        elapsed_time = self.track_data["tdiff"].sum()
+        stats = {
+            "moving_distance": moving_distance,
+            "moving_time": moving_time,
+            "avg_pace": pace,
+            "elapsed_time": elapsed_time,
+        }
+        return stats
+
+    def show_strava_stats(self):
+        """
+        display and return the strava_stats()
+        """
+        stats = self.strava_stats()
+        if TrackData.isnotebook():
+            display(stats)
+        else:
+            print(stats)
+        return stats
+
+    def calc_track_bounds(self):
+        """
+        set the min and max of lat and long
+        """
+        self.west_bound = min(self.track_data["Longitude"])
+        self.east_bound = max(self.track_data["Longitude"])
+        self.north_bound = max(self.track_data["Latitude"])
+        self.south_bound = min(self.track_data["Latitude"])
+        self.centre = [
+            np.mean([self.west_bound, self.east_bound]),
+            np.mean([self.north_bound, self.south_bound]),
+        ]
+
+    @staticmethod
+    def smooth_elevation(altitude, method="moving_average", window=5, threshold=3.0):
+        """
+        smooth an array of altitudes (metres) from a single segment.
+        method can be one of:
+         - 'moving_average' over window points
+         - 'savgol', a Savitzky-Golay quadratic fit over window points, which
+           keeps the height of summits better than the moving average
+         - 'hysteresis', the altitude only moves once it has changed by
+           threshold metres, which is closest to how Garmin and Strava
+           discount GPS and barometer noise
+         - 'none'
+        Missing altitudes are interpolated from their neighbours.
+        """
+        altitude = np.asarray(altitude, dtype=float)
+        known = ~np.isnan(altitude)
+        if not known.any():
+            return np.zeros_like(altitude)
+        if not known.all():
+            positions = np.arange(altitude.shape[0])
+            altitude = np.interp(positions, positions[known], altitude[known])
+
+        # an odd window, no wider than the segment
+        window = min(int(window), altitude.shape[0])
+        window -= 1 - window % 2
+        if method == "none" or (window < 3 and method != "hysteresis"):
+            return altitude
+        if method == "moving_average":
+            weights = np.full(window, 1 / window)
+        elif method == "savgol":
+            half = window // 2
+            vander = np.vander(np.arange(-half, half + 1), 3, increasing=True)
+            weights = np.linalg.pinv(vander)[0]
+        elif method == "hysteresis":
+            smoothed = np.empty_like(altitude)
+            level = altitude[0]
+            for point_no, height in enumerate(altitude.tolist()):
+                if abs(height - level) >= threshold:
+                    level = height
+                smoothed[point_no] = level
+            return smoothed
+        else:
+            raise ValueError(f"unknown elevation smoothing method {method}")
+        # odd reflection carries the slope on past the ends of the segment
+        padded = np.pad(altitude, window // 2, mode="reflect", reflect_type="odd")
+        return np.convolve(padded, weights[::-1], mode="valid")
+
+    def elevation_profile(self, **smoothing):
+        """
+        smooth the altitude of every segment and work out, for the whole track
+        in one pass, the per point grade (rise over run, so 0.05 is 5%) and the
+        cumulative ascent and descent in metres.
+        smoothing: keyword arguments for smooth_elevation(), defaulting to
+        TrackData.ELEVATION_SMOOTHING
+        returns : a DataFrame indexed like track_data.  Only the profile with
+        the default smoothing is kept, as self.elevation_data, so other
+        smoothing never changes the grades and ascents used elsewhere.
+        """
+        params = dict(TrackData.ELEVATION_SMOOTHING, **smoothing)
+        altitude = self.track_data["Altitude"].to_numpy(dtype=float, na_value=np.nan)
+        seg_no = self.track_data["SegNo"].to_numpy()
+        track_no = self.track_data["TrackNo"].to_numpy()
+        delta_dist = self.track_data["delta_dist"].to_numpy(dtype=float)
+
+        seg_starts = (
+            np.flatnonzero((np.diff(seg_no) != 0) | (np.diff(track_no) != 0)) + 1
+        )
+        smoothed = np.concatenate(
+            [
+                TrackData.smooth_elevation(seg_altitude, **params)
+                for seg_altitude in np.split(altitude, seg_starts)
+            ]
+        )
+        rise = np.diff(smoothed, prepend=smoothed[:1])
+        rise[seg_starts] = 0  # no climbing between segments
+        grade = np.divide(
+            rise, delta_dist, out=np.zeros_like(rise), where=delta_dist > 0.5
+        )
+        profile = pd.DataFrame(
+            {
+                "smoothed_altitude": smoothed,
+                "grade": grade,
+                "cum_ascent": np.clip(rise, 0, None).cumsum(),
+                # + 0.0 so no descent is 0.0, not -0.0
+                "cum_descent": -np.clip(rise, None, 0).cumsum() + 0.0,
+            },
+            index=self.track_data.index,
+        )
+        if params == TrackData.ELEVATION_SMOOTHING:
+            self.elevation_data = profile
+            self.elevation_version = self.frame_versions["track_data"]
+        return profile
+
+    def default_elevation(self):
+        """
+        the elevation_profile() with the default smoothing, built again if
+        track_data has changed since it was kept in elevation_data
+        """
+        if (
+            self.elevation_version != self.frame_versions["track_data"]
+            or self.elevation_data.shape[0] != self.track_data.shape[0]
+        ):
+            self.elevation_profile()
+        return self.elevation_data
+
+    @memoized("track_data")
+    def elevation_totals(self, **smoothing):
+        """
+        total ascent and descent in metres with the given smoothing
+        """
+        profile = self.elevation_profile(**smoothing)
+        if profile.empty:
+            return (0.0, 0.0)
+        return (
+            float(profile["cum_ascent"].iloc[-1]),
+            float(profile["cum_descent"].iloc[-1]),
+        )
+
+    @memoized("track_data", "processed_track_data", "segment_data")
+    def summary(self):
+        """
+        return a dict of plain values summarising the track, suitable for
+        persisting as json or writing out as a row of a csv
+        """
+        moving_time = self.processed_track_data["tdiff"].sum().total_seconds()
+        moving_distance = float(self.processed_track_data["delta_dist"].sum())
+        first_point = self.track_data.iloc[0]
+        last_point = self.track_data.iloc[-1]
+        (smoothed_ascent, smoothed_descent) = self.elevation_totals()
+        return {
+            "start_time": first_point["dt"].isoformat(),
+            "segments": int(self.segment_data["moving_distance"].count()),
+            "points": int(self.track_data.shape[0]),
+            "moving_distance": moving_distance,
+            "moving_time": moving_time,
+            "elapsed_time": self.track_data["tdiff"].sum().total_seconds(),
+            "avg_secs_per_km": (
+                moving_time / moving_distance * 1000 if moving_distance > 0 else 0
+            ),
+            "ascent": float(self.segment_data["ascent"].sum()),
+            "descent": float(self.segment_data["descent"].sum()),
+            "smoothed_ascent": smoothed_ascent,
+            "smoothed_descent": smoothed_descent,
+            "activity_type": self.guess_activity_type(),
+            "west_bound": float(self.west_bound),
+            "east_bound": float(self.east_bound),
+            "north_bound": float(self.north_bound),
+            "south_bound": float(self.south_bound),
+            "start_lat": float(first_point["Latitude"]),
+            "start_lon": float(first_point["Longitude"]),
+            "end_lat": float(last_point["Latitude"]),
+            "end_lon": float(last_point["Longitude"]),
+        }
+
+    # the quantity -> (low, high) range of the LogHistogram sketches.  Speed
+    # is in m/s, pace in seconds per km and heart rate in beats per minute
+    SKETCH_RANGES = {
+        "speed": (0.1, 100.0),
+        "pace": (30.0, 10000.0),
+        "heart_rate": (20.0, 250.0),
+    }
+
+    def sketches(self):
+        """
+        LogHistogram sketches of the speed, pace and heart rate at each moving
+        point (one whose time wasn't removed by zero_tdiff_of_slow_point()),
+        to be merged with other tracks' for library wide percentiles
+        returns : a dict of quantity -> LogHistogram
+        """
+        secs = self.processed_track_data["tdiff"].dt.total_seconds().to_numpy()
+        dist = self.processed_track_data["delta_dist"].to_numpy(dtype=float)
+        moving = (secs > 0) & (dist > 0)
+        values = {
+            "speed": dist[moving] / secs[moving],
+            "pace": secs[moving] / dist[moving] * 1000,
+            "heart_rate": self.processed_track_data["Heart Rate"].to_numpy(dtype=float)[
+                moving
+            ],
+        }
+        return {
+            quantity: LogHistogram(low, high).add(values[quantity])
+            for (quantity, (low, high)) in TrackData.SKETCH_RANGES.items()
+        }
+
+    POWER_GRADE_DISTANCE = 100.0
+
+    def power_inputs(self):
+        """
+        the arrays cycling_power() is evaluated over, one entry per point of
+        processed_track_data: speed (m/s), smoothed grade, acceleration
+        (m/s/s) and moving seconds since the previous point.  Points whose
+        time was removed by zero_tdiff_of_slow_point() have no speed.
+        """
+        elevation = self.default_elevation()
+        secs = self.processed_track_data["tdiff"].dt.total_seconds().to_numpy()
+        dist = self.processed_track_data["delta_dist"].to_numpy(dtype=float)
+        speed = np.divide(dist, secs, out=np.zeros_like(secs), where=secs > 0)
+        # from v^2 = u^2 + 2as, so the work done accelerating is exactly
+        # the change in kinetic energy
+        accel = np.divide(
+            speed**2 - np.concatenate(([0.0], speed[:-1])) ** 2,
+            2 * dist,
+            out=np.zeros_like(secs),
+            where=(secs > 0) & (dist > 0),
+        )
+        # the per point grade jumps wherever the smoothed altitude steps, so
+        # the climb is taken over POWER_GRADE_DISTANCE metres centred on
+        # each point, ignoring the jumps in altitude between segments
+        cum_dist = dist.cumsum()
+        height = (elevation["cum_ascent"] - elevation["cum_descent"]).to_numpy()
+        half = TrackData.POWER_GRADE_DISTANCE / 2
+        run = np.zeros_like(cum_dist)
+        rise = np.zeros_like(cum_dist)
+        if cum_dist.shape[0] > 1:
+            behind = np.maximum(cum_dist - half, 0)
+            ahead = np.minimum(cum_dist + half, cum_dist[-1])
+            run = ahead - behind
+            rise = TrackData.interp_at(cum_dist, height, ahead) - TrackData.interp_at(
+                cum_dist, height, behind
+            )
+        return {
+            "speed": speed,
+            "grade": np.divide(rise, run, out=np.zeros_like(run), where=run > 0),
+            "accel": accel,
+            "secs": secs,
+        }
+
+    @memoized("track_data", "processed_track_data")
+    def power(self, rider=None):
+        """
+        the estimated cycling power at each point, see cycling_power()
+        rider: values to change in DEFAULT_RIDER
+        returns : a DataFrame indexed by time of speed, grade, power (watts)
+        and its rolling 30 second average (as used for normalized power)
+        """
+        batch = PowerBatch()
+        batch.add("", self)
+        (power, rolling) = batch.evaluate(rider)
+        inputs = self.power_inputs()
+        return pd.DataFrame(
+            {
+                "speed": inputs["speed"],
+                "grade": inputs["grade"],
+                "power": power,
+                "rolling_power": rolling,
+            },
+            index=pd.Index(self.processed_track_data["dt"], name="time"),
+        )
+
+    @memoized("track_data", "processed_track_data")
+    def power_summary(self, rider=None):
+        """
+        average and normalized power (watts) over the moving time, and the
+        work done in kJ, see PowerBatch.summaries()
+        """
+        batch = PowerBatch()
+        batch.add("", self)
+        return batch.summaries(rider).iloc[0].to_dict()
+
+    def to_arrow(self, path, source=""):
+        """
+        export the points and segment summaries to an Arrow IPC (Feather v2)
+        file, or to parquet if path ends in .parquet.  See write_arrow().
+        """
+        write_arrow([(source, self)], path)
+
+    @classmethod
+    def from_arrow(cls, path, source=None):
+        """
+        load a track written by to_arrow() or write_arrow() without parsing
+        any gpx.  Arrow files are memory mapped and their numeric columns
+        are used in place rather than copied.  source picks one track out of
+        a file holding several.
+        """
+        (points, segments, info) = read_arrow(path)
+        if source is None:
+            sources = list(info)
+            if len(sources) != 1:
+                raise ValueError(f"{path} holds {len(sources)} tracks, pick a source")
+            source = sources[0]
+        if source not in info:
+            raise KeyError(f"{source} not in {path}")
+        if len(info) > 1:
+            points = points.filter(pyarrow.compute.equal(points["Source"], source))
+            segments = segments.filter(
+                pyarrow.compute.equal(segments["Source"], source)
+            )
+
+        track = cls()
+        point_frame = points.drop_columns(["Source"]).to_pandas(split_blocks=True)
+        point_frame.insert(3, "Date_time", point_frame["Time"])
+        point_frame = point_frame.rename(columns={"Time": "dt"})
+        moving_tdiff = point_frame.pop("moving_tdiff")
+        track.track_data = point_frame[list(TrackData.ARROW_POINT_ORDER)]
+        track.processed_track_data = track.track_data.assign(tdiff=moving_tdiff)
+        track.segment_data = segments.drop_columns(["Source"]).to_pandas()
+        track.track_names = info[source]["track_names"]
+        track.duration = pd.Timedelta(seconds=info[source]["duration"])
+        track.calc_track_bounds()
+        track.invalidate()
+        return track
+
+    # the column order of track_data, for rebuilding it from arrow
+    ARROW_POINT_ORDER = (
+        "TrackNo",
+        "SegNo",
+        "PointNo",
+        "Date_time",
+        "Latitude",
+        "Longitude",
+        "Altitude",
+        "GPS Speed",
+        "DOP",
+        "gpxpy_speed",
+        "seg_speed",
+        "delta_dist",
+        "Heart Rate",
+        "dt",
+        "tdiff",
+    )
+
+    POST_PROCESS = [guess_activity_type, zero_tdiff_of_slow_point, calc_track_bounds]
+
+
+class OSMAnd_Track_File:
+    """
+    The name of the OSMAnd GPX file tells us about when it was created
+    """
+
+    def __init__(self, filename):
+        """
+        info about the gpx file
+        """
+        self.filename = filename
+        self.track_date = self.date_from_track_name(filename)
+        self.trackdata = TrackData()
+
+    def slurp(self):
+        """
+        actually read the data points from gpx into the internal trackdata
+        """
+        # with open(self.filename, "r") as file_handle:
+        # self.trackdata.process(file_handle)
+        self.trackdata.slurp(self.filename)
+
+    # 2022-07-04_07-35_Mon, once the extensions are stripped
+    TRACK_NAME = re.compile(r"(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})(?:_[A-Za-z]{3})?")
+
+    # the directories OSMAnd files its tracks into, see dirname_for_date()
+    MONTH_DIR = re.compile(r"^\d{4}-\d{2}$")
+
+    @staticmethod
+    def date_from_track_name(path_name):
+        """
+        gpx tracks from OSM have a name like 2022-07-04_07-35_Mon.gpx
+        the _Mon suffix is an overspecification, so it's ignored and the rest
+        is parsed as a date.  Raises ValueError for any other name.
+        """
+        file_name = strip_compression_suffix(os.path.basename(path_name))
+        (date_portion, unused_extension) = os.path.splitext(file_name)
+        match = OSMAnd_Track_File.TRACK_NAME.fullmatch(date_portion)
+        if match is None:
+            raise ValueError(f"{file_name} is not an OSMAnd track name")
+        return datetime.datetime(*(int(field) for field in match.groups()))
+
+    @staticmethod
+    def dirname_for_date(timestamp):
+        """
+        OSMAnd stores recorded files by directory name based on the month and
+        the year.  These are in the shape "2023-07"
+        """
+        return "{:4d}-{:02d}".format(timestamp.year, timestamp.month)
+
+    @staticmethod
+    def month_range(start_date, end_date):
+        """
+        an iterator: for m in month_range(start, end):
+        returns a date in each month between the start and end dates inclusive,
+        on the start date's day of the month or the last day of shorter months
+        """
+        if isinstance(start_date, str):
+            start_date = pd.to_datetime(start_date)
+        if isinstance(end_date, str):
+            end_date = pd.to_datetime(end_date)
+
+        year = start_date.year
+        month = start_date.month  # set start month
+        while year <= end_date.year:
+            while (month <= 12 and year < end_date.year) or (
+                year == end_date.year and month <= end_date.month
+            ):
+                last_day = calendar.monthrange(year, month)[1]
+                yield datetime.datetime(year, month, min(start_date.day, last_day))
+                month += 1
+            year += 1
+            month = 1  # when year incremented, start month back to 1
+
+    @staticmethod
+    def select(root, start_date=None, end_date=None):
+        """
+        an iterator over the tracks in an OSMAnd tracks directory, laid out as
+        YYYY-MM/*.gpx, recorded between the (inclusive) dates.  Only the
+        month directories in the range are listed, and files are picked by
+        their name without being opened.  Anything not named by OSMAnd has
+        the first timestamp in its header read instead.
+        """
+        first_month = (
+            OSMAnd_Track_File.dirname_for_date(start_date) if start_date else ""
+        )
+        last_month = (
+            OSMAnd_Track_File.dirname_for_date(end_date) if end_date else "9999-99"
+        )
+        for month_dir in sorted(os.listdir(root)):
+            if not OSMAnd_Track_File.MONTH_DIR.match(month_dir):
+                continue
+            if not first_month <= month_dir <= last_month:
+                continue
+            month_path = os.path.join(root, month_dir)
+            if not os.path.isdir(month_path):
+                continue
+            for file_name in sorted(os.listdir(month_path)):
+                if file_name.endswith(TRACK_SUFFIXES):
+                    filename = os.path.join(month_path, file_name)
+                    if in_date_range(filename, start_date, end_date):
+                        yield filename
+
+
+def interp_rows(alongs, values, positions):
+    """
+    TrackData.interp_at() for many (along, values) pairs at the same
+    positions at once.  Each pair is shifted into its own stretch of one
+    long array, so a single binary search serves them all.
+    returns : an array with a row of interpolated values per pair
+    """
+    if not alongs:
+        return np.zeros((0, len(positions)))
+    positions = np.asarray(positions, dtype=float)
+    span = max(along[-1] for along in alongs) + abs(positions).max() + 1
+    offsets = np.arange(len(alongs)) * span
+    along = np.concatenate([row + offset for (row, offset) in zip(alongs, offsets)])
+    flat_values = np.concatenate(values)
+    # keep each row's positions within its own stretch
+    ends = np.array([row[-1] for row in alongs])
+    shifted = np.minimum(positions[np.newaxis, :], ends[:, np.newaxis])
+    shifted = np.maximum(shifted, 0) + offsets[:, np.newaxis]
+    result = TrackData.interp_at(along, flat_values, shifted.ravel())
+    return result.reshape(len(alongs), len(positions))
+
+
+# the WGS84 ellipsoid: equatorial radius (m) and flattening
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+def equirectangular(lat_1, lon_1, lat_2, lon_2):
+    """
+    distance in metres between points, treating the earth as flat around
+    them with longitude scaled by the cosine of the latitude (gpxpy's short
+    range approximation)
+    """
+    lat_1 = np.asarray(lat_1, dtype=float)
+    return (
+        np.hypot(
+            lat_1 - np.asarray(lat_2, dtype=float),
+            (np.asarray(lon_1, dtype=float) - np.asarray(lon_2, dtype=float))
+            * np.cos(np.radians(lat_1)),
+        )
+        * gpxpy.geo.ONE_DEGREE
+    )
+
+
+def haversine(lat_1, lon_1, lat_2, lon_2):
+    """
+    great circle distance in metres between points on a spherical earth
+    """
+    lat_1 = np.radians(np.asarray(lat_1, dtype=float))
+    lat_2 = np.radians(np.asarray(lat_2, dtype=float))
+    d_lon = np.radians(np.asarray(lon_2, dtype=float) - np.asarray(lon_1, dtype=float))
+    chord = (
+        np.sin((lat_2 - lat_1) / 2) ** 2
+        + np.cos(lat_1) * np.cos(lat_2) * np.sin(d_lon / 2) ** 2
+    )
+    return 2 * gpxpy.geo.EARTH_RADIUS * np.arctan2(np.sqrt(chord), np.sqrt(1 - chord))
+
+
+def distance_2d(lat_1, lon_1, lat_2, lon_2):
+    """
+    vectorised version of gpxpy's 2d point to point distance in metres: a
+    flat earth approximation scaled by the cosine of the latitude, switching
+    to haversine for points more than 0.2 degrees apart
+    """
+    lat_1 = np.asarray(lat_1, dtype=float)
+    lat_2 = np.asarray(lat_2, dtype=float)
+    lon_1 = np.asarray(lon_1, dtype=float)
+    lon_2 = np.asarray(lon_2, dtype=float)
+    flat = equirectangular(lat_1, lon_1, lat_2, lon_2)
+    far = (np.abs(lat_1 - lat_2) > 0.2) | (np.abs(lon_1 - lon_2) > 0.2)
+    if not far.any():
+        return flat
+    return np.where(far, haversine(lat_1, lon_1, lat_2, lon_2), flat)
+
+
+def vincenty(lat_1, lon_1, lat_2, lon_2, tolerance=1e-12, iterations=200):
+    """
+    distance in metres between points on the WGS84 ellipsoid by Vincenty's
+    inverse method, iterating on every pair at once until the longitude on
+    the auxiliary sphere settles.  Nearly antipodal pairs, where the method
+    doesn't converge, fall back to haversine.
+    """
+    lat_1 = np.asarray(lat_1, dtype=float)
+    lat_2 = np.asarray(lat_2, dtype=float)
+    minor = (1 - WGS84_F) * WGS84_A
+    along = np.radians(np.asarray(lon_2, dtype=float) - np.asarray(lon_1, dtype=float))
+    u_1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat_1)))
+    u_2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat_2)))
+    (sin_u1, cos_u1, sin_u2, cos_u2) = (
+        np.sin(u_1),
+        np.cos(u_1),
+        np.sin(u_2),
+        np.cos(u_2),
+    )
+    lam = along
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for unused in range(iterations):
+            sin_sigma = np.hypot(
+                cos_u2 * np.sin(lam), cos_u1 * sin_u2 - sin_u1 * cos_u2 * np.cos(lam)
+            )
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * np.cos(lam)
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma > 0, cos_u1 * cos_u2 * np.sin(lam) / sin_sigma, 0
+            )
+            cos2_alpha = 1 - sin_alpha**2
+            # zero on the equator, where cos2_alpha is 0 too
+            cos_2sigma_m = np.where(
+                cos2_alpha > 0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha, 0
+            )
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            previous = lam
+            lam = along + (1 - c) * WGS84_F * sin_alpha * (
+                sigma
+                + c
+                * sin_sigma
+                * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+            converged = np.abs(lam - previous) <= tolerance
+            if converged.all():
+                break
+    u_sq = cos2_alpha * (WGS84_A**2 - minor**2) / minor**2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        b
+        * sin_sigma
+        * (
+            cos_2sigma_m
+            + b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                - b
+                / 6
+                * cos_2sigma_m
+                * (-3 + 4 * sin_sigma**2)
+                * (-3 + 4 * cos_2sigma_m**2)
+            )
+        )
+    )
+    distance = minor * a * (sigma - delta_sigma)
+    if converged.all():
+        return distance
+    return np.where(converged, distance, haversine(lat_1, lon_1, lat_2, lon_2))
+
+
+def karney(lat_1, lon_1, lat_2, lon_2):
+    """
+    distance in metres between points on the WGS84 ellipsoid by Karney's
+    method, accurate to nanometres everywhere.  Needs geographiclib, which
+    isn't vectorised, so each pair is a python call.
+    """
+    if geographiclib is None:
+        raise RuntimeError("geographiclib is needed for the karney distance model")
+    geodesic = geographiclib.geodesic.Geodesic.WGS84
+    pairs = np.broadcast_arrays(
+        *(np.asarray(column, dtype=float) for column in (lat_1, lon_1, lat_2, lon_2))
+    )
+    distance = np.array(
+        [
+            geodesic.Inverse(*pair, outmask=geographiclib.geodesic.Geodesic.DISTANCE)[
+                "s12"
+            ]
+            for pair in zip(*(column.ravel() for column in pairs))
+        ],
+        dtype=float,
+    )
+    return distance.reshape(pairs[0].shape)
+
+
+# the models geodesic_distance() can use, with their relative error against
+# karney for pairs of points 1 - 50 m apart (as in a track) at latitudes up
+# to 80 degrees, and throughput in pairs per second on one core, as found by
+# benchmark_distances():
+#   model            mean error  worst error  pairs / s
+#   equirectangular  0.2%        0.7%         ~19 million
+#   haversine        0.2%        0.7%         ~13 million
+#   gpxpy            equirectangular up to 0.2 degrees apart, then haversine,
+#                    matching gpxpy's own distance_2d
+#   vincenty         1e-8        4e-8         ~2 million
+#   karney           exact                    ~20 thousand
+# The spherical models are short on north-south legs away from the equator
+# and long on east-west ones.  Bulk library jobs can use equirectangular,
+# and anything compared with other apps or races vincenty (or karney).
+DISTANCE_MODELS = {
+    "gpxpy": distance_2d,
+    "equirectangular": equirectangular,
+    "haversine": haversine,
+    "vincenty": vincenty,
+    "karney": karney,
+}
+
+
+def geodesic_distance(
+    lat_1, lon_1, lat_2, lon_2, model="gpxpy", altitude_1=None, altitude_2=None
+):
+    """
+    distance in metres between points by one of the DISTANCE_MODELS.  Given
+    altitudes the distance is 3d, combining the climb with the distance
+    over the ground (as gpxpy's distance_3d), except where an altitude is
+    missing (NaN).
+    """
+    try:
+        distance = DISTANCE_MODELS[model](lat_1, lon_1, lat_2, lon_2)
+    except KeyError:
+        raise ValueError(
+            f"unknown distance model {model}, one of {', '.join(DISTANCE_MODELS)}"
+        ) from None
+    if altitude_1 is None or altitude_2 is None:
+        return distance
+    climb = np.asarray(altitude_2, dtype=float) - np.asarray(altitude_1, dtype=float)
+    return np.where(np.isnan(climb), distance, np.hypot(distance, climb))
+
+
+def benchmark_distances(pairs=200000, seed=0):
+    """
+    time each of the DISTANCE_MODELS over pairs of points a few metres apart
+    at random latitudes, and find their error against karney (or vincenty,
+    without geographiclib)
+    returns : a DataFrame with a row per model of pairs per second and the
+    mean and largest relative error
+    """
+    rng = np.random.default_rng(seed)
+    lat_1 = rng.uniform(-80, 80, pairs)
+    lon_1 = rng.uniform(-180, 180, pairs)
+    bearing = rng.uniform(0, 2 * np.pi, pairs)
+    step = rng.uniform(1, 50, pairs) / gpxpy.geo.ONE_DEGREE
+    lat_2 = lat_1 + step * np.cos(bearing)
+    lon_2 = lon_1 + step * np.sin(bearing) / np.cos(np.radians(lat_1))
+    models = [model for model in DISTANCE_MODELS if model != "karney"]
+    truth_model = "vincenty"
+    if geographiclib is not None:
+        models.append("karney")
+        truth_model = "karney"
+    # karney is far slower, so it is timed over (and judged on) fewer pairs
+    checked = slice(0, min(pairs, 5000))
+    truth = DISTANCE_MODELS[truth_model](
+        lat_1[checked], lon_1[checked], lat_2[checked], lon_2[checked]
+    )
+    results = []
+    for model in models:
+        timed = checked if model == "karney" else slice(None)
+        started = time.perf_counter()
+        distance = DISTANCE_MODELS[model](
+            lat_1[timed], lon_1[timed], lat_2[timed], lon_2[timed]
+        )
+        elapsed = time.perf_counter() - started
+        error = np.abs(distance[checked] - truth) / truth
+        results.append(
+            {
+                "model": model,
+                "pairs_per_sec": distance.shape[0] / elapsed,
+                "mean_error": error.mean(),
+                "max_error": error.max(),
+            }
+        )
+    return pd.DataFrame(results).set_index("model")
+
+
+# a typical rider on a road bike on the hoods, for cycling_power().  Masses
+# are in kg, cda (drag coefficient times frontal area) in square metres and
+# air density in kg per cubic metre.
+DEFAULT_RIDER = {
+    "rider_mass": 75.0,
+    "bike_mass": 9.0,
+    "crr": 0.005,  # rolling resistance coefficient
+    "cda": 0.32,
+    "air_density": 1.225,
+    "drivetrain_efficiency": 0.976,
+}
+
+GRAVITY = 9.80665
+
+
+def cycling_power(speed, grade, accel, rider=None):
+    """
+    the power in watts a rider must put into the pedals to hold speed (m/s)
+    up grade while accelerating at accel (m/s/s): climbing, rolling
+    resistance, aerodynamic drag in still air and the change of kinetic
+    energy, less drivetrain losses.  Coasting and braking (negative power)
+    count as 0.  Works on arrays of any shape.
+    rider: values to change in DEFAULT_RIDER
+    """
+    rider = dict(DEFAULT_RIDER, **(rider or {}))
+    mass = rider["rider_mass"] + rider["bike_mass"]
+    angle = np.arctan(grade)
+    force = (
+        mass * GRAVITY * (np.sin(angle) + rider["crr"] * np.cos(angle))
+        + 0.5 * rider["air_density"] * rider["cda"] * speed**2
+        + mass * accel
+    )
+    return np.clip(force * speed / rider["drivetrain_efficiency"], 0, None)
+
+
+class PowerBatch:
+    """
+    the power_inputs() of many tracks laid end to end, so cycling_power()
+    can be evaluated for a whole library of rides in one go, and again for
+    each change of rider, without reading any gpx.
+    """
+
+    # seconds averaged over for normalized power
+    ROLLING_SECS = 30
+
+    def __init__(self):
+        self.names = []
+        self.inputs = {"speed": [], "grade": [], "accel": [], "secs": []}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, track):
+        """
+        add a TrackData to the batch
+        """
+        self.names.append(name)
+        for key, values in track.power_inputs().items():
+            self.inputs[key].append(values)
+
+    @classmethod
+    def from_arrow(cls, path, sources=None):
+        """
+        a batch of the tracks in an arrow or parquet export (see
+        write_arrow()), or of just the named sources
+        """
+        batch = cls()
+        if sources is None:
+            sources = list(read_arrow(path)[2])
+        for source in sources:
+            batch.add(source, TrackData.from_arrow(path, source))
+        return batch
+
+    def arrays(self):
+        """
+        the inputs joined into single arrays, with the track number of each
+        point
+        """
+        joined = {
+            key: np.concatenate(values) if values else np.zeros(0)
+            for key, values in self.inputs.items()
+        }
+        joined["track"] = np.repeat(
+            np.arange(len(self.names)),
+            [values.shape[0] for values in self.inputs["secs"]],
+        )
+        return joined
+
+    def evaluate(self, rider=None):
+        """
+        returns : (the power at every point, its rolling average over the
+        ROLLING_SECS of moving time ending at the point, or since the start of
+        the track for points nearer the start than that)
+        """
+        if not self.names:
+            return (np.zeros(0), np.zeros(0))
+        joined = self.arrays()
+        power = cycling_power(joined["speed"], joined["grade"], joined["accel"], rider)
+        # leave a gap longer than the window between tracks, so no window
+        # reaches back into the track before
+        gap = np.zeros_like(joined["secs"])
+        starts = np.flatnonzero(np.diff(joined["track"], prepend=-1))
+        gap[starts[1:]] = PowerBatch.ROLLING_SECS + 1
+        cum_secs = (joined["secs"] + gap).cumsum()
+        cum_energy = (power * joined["secs"]).cumsum()
+        start_secs = cum_secs[starts][joined["track"]]
+        window_start = np.maximum(cum_secs - PowerBatch.ROLLING_SECS, start_secs)
+        covered = cum_secs - window_start
+        rolling = np.divide(
+            cum_energy - np.interp(window_start, cum_secs, cum_energy),
+            covered,
+            out=np.zeros_like(covered),
+            where=covered > 0,
+        )
+        return (power, rolling)
+
+    def summaries(self, rider=None):
+        """
+        returns : a DataFrame with a row per track of its average and
+        normalized power (watts, over the moving time) and the work done (kJ)
+        """
+        joined = self.arrays()
+        (power, rolling) = self.evaluate(rider)
+        tracks = len(self.names)
+        secs = np.bincount(joined["track"], joined["secs"], tracks)
+        energy = np.bincount(joined["track"], power * joined["secs"], tracks)
+        fourth = np.bincount(joined["track"], rolling**4 * joined["secs"], tracks)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame(
+                {
+                    "avg_power": energy / secs,
+                    "normalized_power": (fourth / secs) ** 0.25,
+                    "energy_kj": energy / 1000,
+                },
+                index=pd.Index(self.names, name="track"),
+            )
+
+
+def iter_point_chunks(source, chunk_points=50000):
+    """
+    an iterator over the track points of a gpx file in chunks of at most
+    chunk_points, each a dict of numpy arrays: SegNo, Latitude, Longitude,
+    Altitude (NaN if missing) and Time (seconds since the epoch).  The file
+    is parsed incrementally and each point's xml is discarded once read, so
+    memory use doesn't grow with the length of the track.
+    """
+    columns = ("SegNo", "Latitude", "Longitude", "Altitude", "Time")
+
+    def as_chunk(rows):
+        return {
+            name: np.array(values, dtype=float)
+            for name, values in zip(columns, zip(*rows))
+        }
+
+    rows = []
+    seg_no = -1
+    open_elements = []
+    with open_track_file(source) as gpx_file:
+        for event, element in ElementTree.iterparse(gpx_file, ("start", "end")):
+            tag = element.tag.rpartition("}")[2]
+            if event == "start":
+                open_elements.append(element)
+                if tag == "trkseg":
+                    seg_no += 1
+                continue
+            open_elements.pop()
+            if tag != "trkpt":
+                continue
+            altitude = np.nan
+            timestamp = np.nan
+            for child in element:
+                child_tag = child.tag.rpartition("}")[2]
+                if child_tag == "ele":
+                    altitude = float(child.text)
+                elif child_tag == "time":
+                    timestamp = datetime.datetime.fromisoformat(
+                        child.text.strip()
+                    ).timestamp()
+            rows.append(
+                (
+                    seg_no,
+                    float(element.get("lat")),
+                    float(element.get("lon")),
+                    altitude,
+                    timestamp,
+                )
+            )
+            open_elements[-1].remove(element)  # forget the point's xml
+            if len(rows) >= chunk_points:
+                yield as_chunk(rows)
+                rows = []
+    if rows:
+        yield as_chunk(rows)
+
+
+TRKPT_TAG = re.compile(rb"<(?:[\w.-]+:)?trkpt[\s>/]")
+
+
+def track_fingerprint(source, sample_points=32, block_size=1 << 20):
+    """
+    a cheap fingerprint for spotting copies of the same recording under
+    different names: the time of the first point, the number of points, the
+    bounds from the gpx metadata (None if it has none) and a hash of the
+    first sample_points points, rounded to 1e-5 degrees and whole seconds so
+    re-exported copies still match.  Only the start of the file is parsed,
+    the points are counted by scanning the raw bytes block_size at a time.
+    """
+    bounds = None
+    start_time = None
+    sample = hashlib.sha1()
+    sampled = 0
+    with open_track_file(source) as gpx_file:
+        for unused_event, element in ElementTree.iterparse(gpx_file):
+            tag = element.tag.rpartition("}")[2]
+            if tag == "bounds":
+                bounds = [float(element.get(name)) for name in TrackData.BOUNDS_ATTRS]
+            elif tag == "trkpt":
+                time_text = None
+                for child in element:
+                    if child.tag.rpartition("}")[2] == "time":
+                        time_text = child.text.strip()
+                timestamp = (
+                    round(datetime.datetime.fromisoformat(time_text).timestamp())
+                    if time_text
+                    else None
+                )
+                if start_time is None and timestamp is not None:
+                    start_time = timestamp
+                point = (
+                    round(float(element.get("lat")), 5),
+                    round(float(element.get("lon")), 5),
+                    timestamp,
+                )
+                sample.update(repr(point).encode("ascii"))
+                sampled += 1
+                if sampled >= sample_points:
+                    break
+    point_count = 0
+    overlap = b""
+    with open_track_file(source) as gpx_file:
+        for block in iter(lambda: gpx_file.read(block_size), b""):
+            text = overlap + block
+            matches = list(TRKPT_TAG.finditer(text))
+            # a tag ending within the overlap was whole, and so counted, in
+            # the last block, one straddling the boundary wasn't
+            point_count += sum(1 for match in matches if match.end() > len(overlap))
+            overlap = text[-32:]
+    return {
+        "start_time": start_time,
+        "point_count": point_count,
+        "bounds": bounds,
+        "sample_hash": sample.hexdigest(),
+    }
+
+
+def fingerprint_key(fingerprint):
+    """
+    the parts of a fingerprint which must agree for two files to be copies,
+    the bounds are left out as not every exporter writes them
+    """
+    return (
+        fingerprint["start_time"],
+        fingerprint["point_count"],
+        fingerprint["sample_hash"],
+    )
+
+
+class ChunkedTrack:
+    """
+    Summarise a track too long to hold in a TrackData, e.g. a multi-day
+    bikepacking trip recorded at 1 Hz.  Points are streamed through in chunks
+    with the same distance, stop removal (as zero_tdiff_of_slow_point()) and
+    hysteresis ascent as TrackData, keeping only running totals and, for the
+    best efforts, the points still close enough to the end of the track to
+    start an effort which hasn't finished yet.
+    """
+
+    def __init__(
+        self,
+        best_efforts=(1000, 5000, 10000),
+        chunk_points=50000,
+        distance_model="gpxpy",
+    ):
+        """
+        best_efforts: distances in metres to find the quickest stretch for
+        distance_model: one of the DISTANCE_MODELS to measure between points
+        """
+        self.best_efforts = tuple(best_efforts)
+        self.chunk_points = chunk_points
+        self.distance_model = distance_model
+        self.logger = logging.getLogger(__name__)
+        self.segment_rows = []
+        self.best = {distance: None for distance in self.best_efforts}
+        self.points = 0
+        self.elapsed_time = 0.0
+        self.bounds = [np.inf, -np.inf, np.inf, -np.inf]  # S, N, W, E
+        self.first_point = None
+        self.last_point = None  # (SegNo, Latitude, Longitude, Altitude, Time)
+        self.ascent = 0.0
+        self.descent = 0.0
+        self.level = np.nan  # the hysteresis altitude
+        # cumulative distance, moving time and time of the points which may
+        # still start a best effort
+        self.tail = (np.zeros(0), np.zeros(0), np.zeros(0))
+        self.cum_dist = 0.0
+        self.cum_secs = 0.0
+
+    def process(self, source):
+        """
+        stream every point of a gpx file (or open binary file) through
+        """
+        self.logger.debug(f"process() {source}")
+        for chunk in iter_point_chunks(source, self.chunk_points):
+            self.add_chunk(chunk)
+        return self
+
+    def add_chunk(self, chunk):
+        """
+        fold a chunk of points, as produced by iter_point_chunks(), into the
+        running totals
+        """
+        seg_no = chunk["SegNo"]
+        lat = chunk["Latitude"]
+        lon = chunk["Longitude"]
+        altitude = chunk["Altitude"]
+        secs = chunk["Time"]
+        if self.last_point is None:
+            self.first_point = tuple(column[0] for column in chunk.values())
+            previous = self.first_point
+        else:
+            previous = self.last_point
+        prev_seg = np.concatenate(([previous[0]], seg_no[:-1]))
+        prev_lat = np.concatenate(([previous[1]], lat[:-1]))
+        prev_lon = np.concatenate(([previous[2]], lon[:-1]))
+        prev_secs = np.concatenate(([previous[4]], secs[:-1]))
+        same_segment = seg_no == prev_seg
+        if self.last_point is None:
+            same_segment[0] = False
+
+        delta_dist = np.where(
+            same_segment,
+            geodesic_distance(prev_lat, prev_lon, lat, lon, self.distance_model),
+            0,
+        )
+        tdiff = np.where(same_segment, np.nan_to_num(secs - prev_secs), 0)
+        moving_tdiff = np.where(stopped(delta_dist, tdiff), 0, tdiff)
+
+        # a row per segment, with its moving distance and time, for
+        # guess_activity_type()
+        for seg in np.unique(seg_no):
+            in_seg = seg_no == seg
+            if not self.segment_rows or self.segment_rows[-1]["SegNo"] != seg:
+                self.segment_rows.append(
+                    {"SegNo": seg, "moving_distance": 0.0, "moving_time": 0.0}
+                )
+            self.segment_rows[-1]["moving_distance"] += delta_dist[in_seg].sum()
+            self.segment_rows[-1]["moving_time"] += moving_tdiff[in_seg].sum()
+
+        self.points += seg_no.shape[0]
+        self.elapsed_time += tdiff.sum()
+        self.bounds = [
+            min(self.bounds[0], lat.min()),
+            max(self.bounds[1], lat.max()),
+            min(self.bounds[2], lon.min()),
+            max(self.bounds[3], lon.max()),
+        ]
+        self.add_altitudes(seg_no, altitude, same_segment)
+
+        cum_dist = self.cum_dist + delta_dist.cumsum()
+        cum_secs = self.cum_secs + moving_tdiff.cumsum()
+        self.cum_dist = cum_dist[-1]
+        self.cum_secs = cum_secs[-1]
+        self.add_best_efforts(cum_dist, cum_secs, secs)
+        self.last_point = tuple(column[-1] for column in chunk.values())
+
+    def add_altitudes(self, seg_no, altitude, same_segment):
+        """
+        hysteresis ascent and descent, as TrackData.smooth_elevation(), with
+        the current level carried from one chunk to the next
+        """
+        threshold = TrackData.ELEVATION_SMOOTHING["threshold"]
+        for height, continues in zip(altitude.tolist(), same_segment.tolist()):
+            if np.isnan(height):
+                continue
+            if not continues or np.isnan(self.level):
+                self.level = height
+            elif abs(height - self.level) >= threshold:
+                if height > self.level:
+                    self.ascent += height - self.level
+                else:
+                    self.descent += self.level - height
+                self.level = height
+
+    def add_best_efforts(self, cum_dist, cum_secs, secs):
+        """
+        check every start point whose effort can now be completed.  Those
+        which can't yet (they are within the longest effort of the end) are
+        kept to try again with the next chunk.
+        """
+        (tail_dist, tail_secs, tail_time) = self.tail
+        all_dist = np.concatenate((tail_dist, cum_dist))
+        all_secs = np.concatenate((tail_secs, cum_secs))
+        all_time = np.concatenate((tail_time, secs))
+        keep_from = all_dist.shape[0]
+        for distance in self.best_efforts:
+            end_rows = np.searchsorted(all_dist, all_dist + distance, side="left")
+            complete = np.flatnonzero(end_rows < all_dist.shape[0])
+            if complete.shape[0] < all_dist.shape[0]:
+                keep_from = min(keep_from, complete.shape[0])
+            if complete.shape[0] == 0:
+                continue
+            times = all_secs[end_rows[complete]] - all_secs[complete]
+            best_row = times.argmin()
+            if self.best[distance] is None or times[best_row] < self.best[distance][1]:
+                self.best[distance] = (all_time[complete[best_row]], times[best_row])
+        self.tail = (
+            all_dist[keep_from:],
+            all_secs[keep_from:],
+            all_time[keep_from:],
+        )
+
+    def summary(self):
+        """
+        the summary of the track so far, with the same keys as
+        TrackData.summary() where they are available, plus the best efforts
+        """
+        segments = TrackData()
+        segments.segment_data = pd.DataFrame(self.segment_rows)
+        moving_distance = float(self.cum_dist)
+        moving_time = float(self.cum_secs)
+        summary = {
+            "start_time": datetime.datetime.fromtimestamp(
+                self.first_point[4], datetime.timezone.utc
+            ).isoformat(),
+            "segments": len(self.segment_rows),
+            "points": self.points,
+            "moving_distance": moving_distance,
+            "moving_time": moving_time,
+            "elapsed_time": float(self.elapsed_time),
+            "avg_secs_per_km": (
+                moving_time / moving_distance * 1000 if moving_distance > 0 else 0
+            ),
+            "smoothed_ascent": self.ascent,
+            "smoothed_descent": self.descent,
+            "activity_type": segments.guess_activity_type(),
+            "west_bound": float(self.bounds[2]),
+            "east_bound": float(self.bounds[3]),
+            "north_bound": float(self.bounds[1]),
+            "south_bound": float(self.bounds[0]),
+            "start_lat": float(self.first_point[1]),
+            "start_lon": float(self.first_point[2]),
+            "end_lat": float(self.last_point[1]),
+            "end_lon": float(self.last_point[2]),
+        }
+        for distance, best in self.best.items():
+            summary[f"best_{distance:g}m"] = (
+                float(best[1]) if best is not None else None
+            )
+        return summary
+
+
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+TRACK_SUFFIXES = (".gpx",) + tuple(".gpx" + suffix for suffix in COMPRESSION_SUFFIXES)
+
+
+def strip_compression_suffix(file_name):
+    """
+    2022-07-04_07-35_Mon.gpx.gz -> 2022-07-04_07-35_Mon.gpx
+    """
+    (stem, extension) = os.path.splitext(file_name)
+    return stem if extension in COMPRESSION_SUFFIXES else file_name
+
+
+def open_track_file(source):
+    """
+    open a track for reading as a binary stream, decompressing it on the fly
+    if its first bytes mark it as gzip, bz2, xz or zstd.  source may be a
+    path or an already open binary file (e.g. a member of an archive).
+    zstd needs the zstandard package.
+    """
+    opened_here = not hasattr(source, "read")
+    if opened_here:
+        raw_file = open(source, "rb")  # pylint: disable=consider-using-with
+    elif hasattr(source, "peek"):
+        raw_file = source
+    else:
+        raw_file = io.BufferedReader(source)
+    magic = raw_file.peek(6)[:6]
+    for signature, module in [
+        (b"\x1f\x8b", gzip),
+        (b"BZh", bz2),
+        (b"\xfd7zXZ\x00", lzma),
+    ]:
+        if magic.startswith(signature):
+            if not opened_here:
+                return module.open(raw_file, "rb")  # caller closes source
+            raw_file.close()
+            return module.open(source, "rb")
+    if magic.startswith(b"\x28\xb5\x2f\xfd"):
+        if zstandard is None:
+            raw_file.close()
+            raise ValueError(f"{source} is zstd compressed, install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(raw_file, closefd=opened_here)
+    return raw_file
+
+
+def iter_archive_tracks(archive_name):
+    """
+    an iterator of (member name, binary file) over the gpx tracks, compressed
+    or not, held in a zip or tar archive, without extracting them to disk.
+    Each file is only valid until the next one is produced.
+    """
+    if zipfile.is_zipfile(archive_name):
+        with zipfile.ZipFile(archive_name) as archive:
+            for member in archive.infolist():
+                if member.filename.endswith(TRACK_SUFFIXES):
+                    with archive.open(member) as member_file:
+                        yield (member.filename, member_file)
+    else:
+        # stream mode reads a (compressed) tar front to back without seeking
+        with tarfile.open(archive_name, "r|*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(TRACK_SUFFIXES):
+                    yield (member.name, archive.extractfile(member))
+
+
+def slurp_bytes(data):
+    """
+    slurp a track held in memory, used by slurp_archive()'s workers
+    """
+    track = TrackData()
+    track.slurp(io.BytesIO(data))
+    return track
+
+
+def slurp_archive(archive_name, workers=None):
+    """
+    slurp every track in a zip or tar archive on a pool of worker processes.
+    The archive is read once, front to back, with no more than two tracks
+    per worker waiting to be parsed.
+    returns : a dict of member name -> TrackData
+    """
+    logger = logging.getLogger(__name__)
+    workers = workers or os.cpu_count()
+    tracks = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        in_flight = {}
+        for member_name, member_file in iter_archive_tracks(archive_name):
+            in_flight[executor.submit(slurp_bytes, member_file.read())] = member_name
+            if len(in_flight) >= 2 * workers:
+                (done, unused_not_done) = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    tracks[in_flight.pop(future)] = future.result()
+        for future in concurrent.futures.as_completed(in_flight):
+            tracks[in_flight[future]] = future.result()
+    logger.debug(f"slurp_archive() {len(tracks)} tracks from {archive_name}")
+    return tracks
+
+
+def summarise_track(
+    filename, best_efforts=(), splits=None, sketches=False, distance_model=None
+):
+    """
+    slurp a track file and return its summary dict.  This is the unit of work
+    handed to worker processes, so it lives at module level where it can be
+    pickled.  OSMAnd shaped names also record the date from the filename.
+
+    best_efforts: distances in metres, the moving time of the quickest
+    stretch covering each is added as best_<distance>m (None if the track is
+    too short)
+    splits: if given, the lap argument for TrackData.splits(), and the
+    splits table is added as a list of dicts
+    sketches: add the TrackData.sketches() of speed, pace and heart rate,
+    as dicts
+    distance_model: one of the DISTANCE_MODELS, rather than gpxpy's distances
+    """
+    track = TrackData()
+    track.slurp(filename, distance_model=distance_model)
+    return summary_record(filename, track, best_efforts, splits, sketches)
+
+
+def summary_record(filename, track, best_efforts=(), splits=None, sketches=False):
+    """
+    the summary dict of a slurped track, see summarise_track()
+    """
+    summary = {"filename": str(filename)}
+    try:
+        track_date = OSMAnd_Track_File.date_from_track_name(filename)
+        summary["track_date"] = track_date.isoformat()
+    except ValueError:
+        summary["track_date"] = None  # not an OSMAnd name
+    summary.update(track.summary())
+    for distance in best_efforts:
+        effort = track.best_effort(distance)
+        summary[f"best_{distance:g}m"] = (
+            effort["moving_time"] if effort is not None else None
+        )
+    if splits is not None:
+        split_table = track.splits(splits).reset_index()
+        summary["splits"] = json.loads(split_table.to_json(orient="records"))
+    if sketches:
+        summary["sketches"] = {
+            quantity: sketch.to_dict()
+            for (quantity, sketch) in track.sketches().items()
+        }
+    return summary
+
+
+# bumped whenever the columns written by write_arrow() change
+ARROW_SCHEMA_VERSION = 1
+
+# (column, arrow type name) of the exported points.  Time is the dt column,
+# tdiff the elapsed and moving_tdiff the moving time since the last point
+ARROW_POINT_COLUMNS = (
+    ("Source", "string"),
+    ("TrackNo", "int64"),
+    ("SegNo", "int64"),
+    ("PointNo", "int64"),
+    ("Time", "timestamp"),
+    ("Latitude", "float64"),
+    ("Longitude", "float64"),
+    ("Altitude", "float64"),
+    ("GPS Speed", "float64"),
+    ("DOP", "float64"),
+    ("gpxpy_speed", "float64"),
+    ("seg_speed", "float64"),
+    ("delta_dist", "float64"),
+    ("Heart Rate", "float64"),
+    ("tdiff", "duration"),
+    ("moving_tdiff", "duration"),
+)
+
+# and of the exported segment summaries
+ARROW_SEGMENT_COLUMNS = (
+    ("Source", "string"),
+    ("TrackNo", "int64"),
+    ("SegNo", "int64"),
+    ("moving_time", "float64"),
+    ("stopped_time", "float64"),
+    ("moving_distance", "float64"),
+    ("stopped_distance", "float64"),
+    ("max_speed", "float64"),
+    ("ascent", "float64"),
+    ("descent", "float64"),
+    ("2d length", "float64"),
+    ("3d length", "float64"),
+    ("moving_speed", "float64"),
+    ("pace", "duration"),
+    ("P(walk) from speed", "float64"),
+    ("P(run) from speed", "float64"),
+    ("P(cycle) from speed", "float64"),
+    ("P(walk) from distance", "float64"),
+    ("P(run) from distance", "float64"),
+    ("P(cycle) from distance", "float64"),
+    ("activity_type", "string"),
+)
+
+
+def arrow_schema(columns, metadata=None):
+    """
+    build a pyarrow schema from one of the ARROW_*_COLUMNS tables
+    """
+    types = {
+        "string": pyarrow.string(),
+        "int64": pyarrow.int64(),
+        "float64": pyarrow.float64(),
+        "timestamp": pyarrow.timestamp("us", tz="UTC"),
+        "duration": pyarrow.duration("ns"),
+    }
+    return pyarrow.schema(
+        [(name, types[type_name]) for (name, type_name) in columns], metadata=metadata
+    )
+
+
+def segments_path(path):
+    """
+    the segment summaries are written alongside the points:
+    tracks.arrow -> tracks.segments.arrow
+    """
+    (stem, suffix) = os.path.splitext(path)
+    return f"{stem}.segments{suffix}"
+
+
+def arrow_tables(source, track):
+    """
+    the points and segment summaries of a TrackData as pyarrow tables
+    conforming to ARROW_POINT_COLUMNS and ARROW_SEGMENT_COLUMNS
+    """
+    track.guess_activity_type()  # make sure the segment columns are there
+    points = track.track_data
+    point_columns = {
+        "Source": pd.Series(source, index=points.index, dtype=object),
+        "Time": points["dt"],
+        "DOP": pd.to_numeric(points["DOP"]),
+        "moving_tdiff": track.processed_track_data["tdiff"],
+    }
+    point_table = pyarrow.Table.from_pandas(
+        pd.DataFrame(
+            {
+                name: point_columns.get(name, points.get(name))
+                for (name, unused_type) in ARROW_POINT_COLUMNS
+            }
+        ),
+        schema=arrow_schema(ARROW_POINT_COLUMNS),
+        preserve_index=False,
+    )
+    segments = track.segment_data
+    segment_table = pyarrow.Table.from_pandas(
+        pd.DataFrame(
+            {
+                name: (
+                    pd.Series(source, index=segments.index, dtype=object)
+                    if name == "Source"
+                    else segments[name]
+                )
+                for (name, unused_type) in ARROW_SEGMENT_COLUMNS
+            }
+        ),
+        schema=arrow_schema(ARROW_SEGMENT_COLUMNS),
+        preserve_index=False,
+    )
+    return (point_table, segment_table)
+
+
+def write_arrow(tracks, path):
+    """
+    export an iterable of (source, TrackData) to path.  Points go to path
+    and segment summaries to segments_path(path), both as Arrow IPC
+    (Feather v2) files, or parquet if path ends in .parquet.  The points are
+    written a track at a time, so a year of tracks never has to be in memory
+    at once.  The segments file's schema metadata holds the schema version
+    and each source's track names and moving duration.
+    """
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is needed to write arrow or parquet files")
+    parquet = path.endswith(".parquet")
+    metadata = {"track_analyzer_schema": str(ARROW_SCHEMA_VERSION)}
+    point_schema = arrow_schema(ARROW_POINT_COLUMNS, metadata)
+    segment_tables = []
+    info = {}
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(path, point_schema)
+    else:
+        writer = pyarrow.ipc.new_file(path, point_schema)
+    with writer:
+        for source, track in tracks:
+            source = str(source)
+            (point_table, segment_table) = arrow_tables(source, track)
+            writer.write_table(point_table.replace_schema_metadata(metadata))
+            segment_tables.append(segment_table)
+            info[source] = {
+                "track_names": list(track.track_names),
+                "duration": track.duration.total_seconds(),
+            }
+
+    metadata["tracks"] = json.dumps(info)
+    segment_table = pyarrow.concat_tables(
+        segment_tables or [arrow_schema(ARROW_SEGMENT_COLUMNS).empty_table()]
+    ).replace_schema_metadata(metadata)
+    if parquet:
+        pyarrow.parquet.write_table(segment_table, segments_path(path))
+    else:
+        with pyarrow.ipc.new_file(
+            segments_path(path), segment_table.schema
+        ) as segment_writer:
+            segment_writer.write_table(segment_table)
+
+
+def read_arrow(path):
+    """
+    read a file written by write_arrow().  Arrow files are memory mapped, so
+    opening even a large export costs next to nothing until columns are
+    used.
+    returns : (points pyarrow.Table, segments pyarrow.Table, dict of
+    source -> {"track_names", "duration"})
+    """
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is needed to read arrow or parquet files")
+
+    def read_table(table_path):
+        if table_path.endswith(".parquet"):
+            return pyarrow.parquet.read_table(table_path, memory_map=True)
+        return pyarrow.ipc.open_file(pyarrow.memory_map(table_path)).read_all()
+
+    segments = read_table(segments_path(path))
+    metadata = segments.schema.metadata or {}
+    version = int(metadata.get(b"track_analyzer_schema", 0))
+    if version != ARROW_SCHEMA_VERSION:
+        raise ValueError(
+            f"{path} has schema version {version}, expected {ARROW_SCHEMA_VERSION}"
+        )
+    return (read_table(path), segments, json.loads(metadata[b"tracks"]))
+
+
+def slurp_track(filename):
+    """
+    slurp a track file in a worker process
+    """
+    track = TrackData()
+    track.slurp(filename)
+    return track
+
+
+def export_arrow(filenames, path, workers=None):
+    """
+    slurp the tracks on a pool of worker processes and write_arrow() them
+    to path as they finish, with each file name as the source.  No more than
+    two tracks per worker are held at a time.
+    """
+    logger = logging.getLogger(__name__)
+    workers = workers or os.cpu_count()
+
+    def finished_tracks():
+        filenames_left = iter(filenames)
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            in_flight = {}
+            while True:
+                for filename in filenames_left:
+                    in_flight[executor.submit(slurp_track, filename)] = filename
+                    if len(in_flight) >= 2 * workers:
+                        break
+                if not in_flight:
+                    return
+                (done, unused_not_done) = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    filename = in_flight.pop(future)
+                    try:
+                        yield (filename, future.result())
+                    except Exception:  # pylint: disable=broad-except
+                        logger.exception(f"failed to process {filename}")
+
+    write_arrow(finished_tracks(), path)
+
+
+def memory_report(tracks):
+    """
+    the memory used by each frame of a collection of slurped tracks, heaviest
+    track first.
+    tracks: a dict of name -> TrackData, or an iterable of TrackData
+    returns : a DataFrame of bytes indexed by track name
+    """
+    if not isinstance(tracks, dict):
+        tracks = dict(enumerate(tracks))
+    usage = {name: track.memory_usage() for (name, track) in tracks.items()}
+    report = pd.DataFrame.from_dict(usage, orient="index")
+    report["slurp_peak_memory"] = [track.slurp_peak_memory for track in tracks.values()]
+    return report.sort_values("total", ascending=False)
+
+
+def recompute_elevation(tracks, **smoothing):
+    """
+    work out ascent and descent again for a collection of already slurped
+    tracks, e.g. after changing the smoothing parameters.
+    tracks: a dict of name -> TrackData, or an iterable of TrackData
+    returns : a DataFrame of ascent and descent indexed by track name
+    """
+    if not isinstance(tracks, dict):
+        tracks = dict(enumerate(tracks))
+    totals = {
+        name: track.elevation_totals(**smoothing) for (name, track) in tracks.items()
+    }
+    return pd.DataFrame.from_dict(totals, orient="index", columns=["ascent", "descent"])
+
+
+def expand_track_paths(paths):
+    """
+    an iterator over the gpx files named by paths, each of which may be a
+    file, a directory (searched recursively) or a glob pattern
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if file_name.endswith(TRACK_SUFFIXES):
+                        yield os.path.join(dir_path, file_name)
+        elif os.path.exists(path):
+            yield path
+        else:
+            yield from sorted(glob.glob(path, recursive=True))
+
 
-            # which means removing the delta time and distance of that point
-            total_dist -= self.processed_track_data.iloc[start_row]["delta_dist"]
-            total_time -= self.processed_track_data.iloc[start_row]["tdiff"]
+def header_timestamp(source):
+    """
+    the first timestamp in a gpx file (the metadata time, or else the first
+    point's) as a naive UTC datetime, reading no further into the file than
+    that.  None if there isn't one before the first track.
+    """
+    with open_track_file(source) as gpx_file:
+        for unused_event, element in ElementTree.iterparse(gpx_file, ("end",)):
+            tag = element.tag.rpartition("}")[2]
+            if tag == "time" and element.text:
+                when = pd.Timestamp(element.text.strip())
+                if when.tzinfo is not None:
+                    when = when.tz_convert("UTC").tz_localize(None)
+                return when.to_pydatetime()
+            if tag == "trkseg":
+                return None  # a segment without times
+    return None
 
-            # even though the start point has been removed, we could still be
-            # in a situation where the cumulative distance and time are with
-            # the criteria
-            if test_after_adding_point(total_dist, total_time):
-                # record and go around the loop again
-                continue
 
-            # then adding points at the end until the criteria is met again
-            while end_row < last_row:
-                end_row += 1
-                total_dist += self.processed_track_data.iloc[end_row]["delta_dist"]
-                total_time += self.processed_track_data.iloc[end_row]["tdiff"]
-                if test_after_adding_point(total_dist, total_time):
-                    break
+def local_time(when):
+    """
+    a datetime (or pd.Timestamp) as a naive local time.  Naive ones are
+    taken to be local already.
+    """
+    if when.tzinfo is None:
+        return when
+    if isinstance(when, pd.Timestamp):
+        when = when.to_pydatetime()
+    return when.astimezone().replace(tzinfo=None)
 
-        dl_df = pd.DataFrame(distance_list)
-        dl_df["secs_per_km"] = (
-            dl_df["cum_time"].apply(lambda x: x.total_seconds())
-            / dl_df["cum_dist"]
-            * 1000
-        )  # in s/km
-        dl_df["pace"] = dl_df["secs_per_km"].apply(lambda x: pd.Timedelta(seconds=x))
-        dl_df.index = dl_df["start_time"]
-        dl_df.drop(["start_time"], inplace=True, axis="columns")
-        return dl_df
 
-    def show_strava_stats(self):
-        """
-        display and return a set of stats which are similar to those shown
-        in the summary of a Strava track
-        """
-        moving_distance = self.processed_track_data["delta_dist"].sum()
-        moving_time = self.processed_track_data["tdiff"].sum()
-        pace = pd.Timedelta(
-            seconds=moving_time.total_seconds() / moving_distance * 1000
-        )
-        elapsed_time = self.track_data["tdiff"].sum()
-        stats = {
-            "moving_distance": moving_distance,
-            "moving_time": moving_time,
-            "avg_pace": pace,
-            "elapsed_time": elapsed_time,
-        }
-        if TrackData.isnotebook():
-            display(stats)
-        else:
-            print(stats)
-        return stats
+def in_date_range(filename, start_date=None, end_date=None):
+    """
+    true if the date of a track lies within the (inclusive) range.  The date
+    comes from an OSMAnd track name, or failing that from the header of the
+    file.  Tracks with neither are only accepted if no range is given.
+    OSMAnd names are in local time and headers in UTC, so headers are
+    converted to local time, as are dates given with a time zone, before
+    they are compared.
+    """
+    if start_date is None and end_date is None:
+        return True
+    try:
+        track_date = OSMAnd_Track_File.date_from_track_name(filename)
+    except ValueError:
+        track_date = header_timestamp(filename)
+        if track_date is not None:
+            track_date = local_time(track_date.replace(tzinfo=datetime.timezone.utc))
+    if track_date is None:
+        logging.getLogger(__name__).warning(f"no date found, skipping {filename}")
+        return False
+    if start_date is not None:
+        start_date = local_time(start_date)
+    if end_date is not None:
+        end_date = local_time(end_date)
+    if start_date is not None and track_date < start_date:
+        return False
+    if end_date is not None and track_date >= end_date + datetime.timedelta(days=1):
+        return False
+    return True
 
-    def calc_track_bounds(self):
-        """
-        set the min and max of lat and long
-        """
-        self.west_bound = min(self.track_data["Longitude"])
-        self.east_bound = max(self.track_data["Longitude"])
-        self.north_bound = max(self.track_data["Latitude"])
-        self.south_bound = max(self.track_data["Latitude"])
-        self.centre = [
-            np.mean([self.west_bound, self.east_bound]),
-            np.mean([self.north_bound, self.south_bound]),
-        ]
 
-    POST_PROCESS = [guess_activity_type, zero_tdiff_of_slow_point, calc_track_bounds]
+def select_track_paths(paths, start_date=None, end_date=None):
+    """
+    an iterator over the tracks named by paths (see expand_track_paths())
+    recorded between the (inclusive) dates.  OSMAnd tracks directories are
+    searched with OSMAnd_Track_File.select(), so months out of range are
+    never listed.
+    """
+    for path in paths:
+        if os.path.isdir(path) and any(
+            OSMAnd_Track_File.MONTH_DIR.match(entry) for entry in os.listdir(path)
+        ):
+            yield from OSMAnd_Track_File.select(path, start_date, end_date)
+        else:
+            for filename in expand_track_paths([path]):
+                if in_date_range(filename, start_date, end_date):
+                    yield filename
 
 
-class OSMAnd_Track_File:
+def process_tracks(filenames, workers=None, best_efforts=(), distance_model=None):
     """
-    The name of the OSMAnd GPX file tells us about when it was created
+    summarise the tracks on a pool of worker processes, yielding each
+    summary as soon as it is ready (so not in the order given).  No more
+    than two tracks per worker are queued at a time, so an arbitrarily long
+    iterator of filenames is never held in memory.
+    distance_model: see summarise_track()
     """
+    logger = logging.getLogger(__name__)
+    workers = workers or os.cpu_count()
+    filenames = iter(filenames)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        in_flight = {}
+        while True:
+            for filename in filenames:
+                future = executor.submit(
+                    summarise_track,
+                    filename,
+                    best_efforts,
+                    distance_model=distance_model,
+                )
+                in_flight[future] = filename
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                return
+            (done, unused_not_done) = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                filename = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(f"failed to process {filename}")
 
-    def __init__(self, filename):
-        """
-        info about the gpx file
-        """
-        self.filename = filename
-        self.track_date = self.date_from_track_name(filename)
-        self.trackdata = TrackData()
 
-    def slurp(self):
-        """
-        actually read the data points from gpx into the internal trackdata
-        """
-        # with open(self.filename, "r") as file_handle:
-        # self.trackdata.process(file_handle)
-        self.trackdata.slurp(self.filename)
+def write_records(records, out_file, output_format="jsonl"):
+    """
+    write each record to out_file as it arrives, either as json lines or as
+    csv rows with the header taken from the first record
+    """
+    writer = None
+    for record in records:
+        if output_format == "csv":
+            if writer is None:
+                writer = csv.DictWriter(out_file, fieldnames=list(record))
+                writer.writeheader()
+            writer.writerow(record)
+        else:
+            out_file.write(json.dumps(record) + "\n")
+        out_file.flush()
 
-    @staticmethod
-    def date_from_track_name(path_name):
-        """
-        gpx tracks from OSM have a name like 2022-07-04_07-35_Mon.gpx
-        the _Mon suffix is an overspecification, so remove it, and parse the rest
-        as a date
-        """
-        file_name = os.path.basename(path_name)
-        (date_portion, unused_extension) = os.path.splitext(file_name)
-        # print(f"front: {date_portion} back: {ext}")
-        without_junk = re.sub(r"_\w{3}", "", date_portion)
-        track_date = datetime.datetime.strptime(without_junk, "%Y-%m-%d_%H-%M")
-        return track_date
 
-    @staticmethod
-    def dirname_for_date(timestamp):
-        """
-        OSMAnd stores recorded files by directory name based on the month and
-        the year.  These are in the shape "2023-07"
-        """
-        return "{:4d}-{:02d}".format(timestamp.year, timestamp.month)
+def synthetic_gpx(
+    filename,
+    points=600,
+    segments=1,
+    speed=3.0,
+    start=None,
+    heart_rate=None,
+    tracks=1,
+):
+    """
+    write a synthetic gpx track heading due north at a steady speed (m/s)
+    with one point per second and a gently rolling elevation, for the
+    benchmarks and the unit tests of every module, which so don't depend on
+    recordings held elsewhere.
+    heart_rate: if given, a Garmin style hr extension is added to each point
+    tracks: the number of tracks, each with the given number of segments
+    """
+    if start is None:
+        start = datetime.datetime(2023, 7, 17, 10, 52, tzinfo=datetime.timezone.utc)
+    garmin_ns = "http://www.garmin.com/xmlschemas/TrackPointExtension/v1"
+    gpx = gpxpy.gpx.GPX()
+    gpx.nsmap["gpxtpx"] = garmin_ns
+    point_no = 0
+    for track_no in range(tracks):
+        track = gpxpy.gpx.GPXTrack(name=f"track {track_no}")
+        gpx.tracks.append(track)
+        for unused_seg_no in range(segments):
+            segment = gpxpy.gpx.GPXTrackSegment()
+            track.segments.append(segment)
+            for unused_i in range(points):
+                point = gpxpy.gpx.GPXTrackPoint(
+                    51.0 + point_no * speed / gpxpy.geo.ONE_DEGREE,
+                    -1.3,
+                    elevation=50 + 10 * np.sin(point_no / 50),
+                    time=start + datetime.timedelta(seconds=point_no),
+                )
+                if heart_rate is not None:
+                    extension = ElementTree.Element(
+                        f"{{{garmin_ns}}}TrackPointExtension"
+                    )
+                    ElementTree.SubElement(extension, f"{{{garmin_ns}}}hr").text = str(
+                        heart_rate
+                    )
+                    point.extensions.append(extension)
+                segment.points.append(point)
+                point_no += 1
+    with open(filename, "w", encoding="utf-8") as gpx_file:
+        gpx_file.write(gpx.to_xml())
+    return filename
 
-    @staticmethod
-    def month_range(start_date, end_date):
-        """
-        an iterator: for m in month_range(start, end):
-        returns a date in each month between the start and end dates inclusive
-        """
-        if isinstance(start_date, str):
-            start_date = pd.to_datetime(start_date)
-        if isinstance(end_date, str):
-            end_date = pd.to_datetime(end_date)
 
-        year = start_date.year
-        month = start_date.month  # set start month
-        while year <= end_date.year:
-            while (month <= 12 and year < end_date.year) or (
-                year == end_date.year and month <= end_date.month
-            ):
-                yield datetime.datetime(year, month, start_date.day)
-                month += 1
-            year += 1
-            month = 1  # when year incremented, start month back to 1
+def benchmark_process(segment_counts=(25, 50, 100, 200, 400), points=20):
+    """
+    time TrackData.process() over synthetic files with more and more
+    segments of a few points each, as OSMAnd writes when GPS keeps dropping
+    out.  The seconds per segment should stay flat as the count grows.
+    returns : a DataFrame of seconds and seconds per segment, indexed by
+    segment count
+    """
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for segments in segment_counts:
+            filename = synthetic_gpx(
+                os.path.join(tmp_dir, f"{segments}.gpx"),
+                points=points,
+                segments=segments,
+            )
+            track = TrackData()
+            with open(filename, "rb") as gpx_file:
+                started = time.perf_counter()
+                track.process(gpx_file, workers=1)
+                seconds = time.perf_counter() - started
+            timings[segments] = {
+                "seconds": seconds,
+                "per_segment": seconds / segments,
+            }
+    return pd.DataFrame.from_dict(timings, orient="index")
 
 
 class TestStuff(unittest.TestCase):
@@ -658,7 +3406,7 @@ class TestStuff(unittest.TestCase):
         self.assertEqual(t_4.guess_activity_type(), "run")
         # d = t_4.build_distance_list(test_after_adding_point=TrackData.fastest5k)
         distance_list = t_4.build_distance_list()
-        print(distance_list)
+        print(with_paces(distance_list))
 
     def test_05(self):
         """
@@ -719,6 +3467,776 @@ class TestStuff(unittest.TestCase):
         self.assertEqual(
             list(OSMAnd_Track_File.month_range(t09_date, t09_date)), [t09_date]
         )
+        self.assertEqual(
+            [
+                month.day
+                for month in OSMAnd_Track_File.month_range(
+                    datetime.datetime(2023, 12, 31), datetime.datetime(2024, 4, 1)
+                )
+            ],
+            [31, 31, 29, 31, 30],
+        )
+
+    def test_10(self):
+        """
+        summarise_track() reads a track and returns plain values describing it
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = synthetic_gpx(
+                os.path.join(tmp_dir, "2023-07-17_10-52_Mon.gpx"), speed=3.0
+            )
+            summary = summarise_track(filename)
+        self.assertEqual(summary["track_date"], "2023-07-17T10:52:00")
+        self.assertEqual(summary["points"], 600)
+        self.assertEqual(summary["activity_type"], "run")
+        self.assertAlmostEqual(summary["moving_distance"], 599 * 3.0, delta=5)
+        self.assertLess(summary["south_bound"], summary["north_bound"])
+
+    def test_11(self):
+        """
+        best_effort() finds the quickest stretch covering a distance
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_11 = TrackData()
+            t_11.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=3.0))
+        effort = t_11.best_effort(1000)
+        self.assertGreaterEqual(effort["distance"], 1000)
+        self.assertAlmostEqual(effort["moving_time"], 1000 / 3.0, delta=2)
+        self.assertIsNone(t_11.best_effort(5000))
+
+    def test_12(self):
+        """
+        the batch functions pick tracks by path and date, and stream a record
+        for each one
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "2023-07"))
+            for name in ["2023-07-17_10-52_Mon.gpx", "2023-07-20_08-00_Thu.gpx"]:
+                synthetic_gpx(os.path.join(tmp_dir, "2023-07", name))
+            filenames = [
+                filename
+                for filename in expand_track_paths([tmp_dir])
+                if in_date_range(filename, datetime.datetime(2023, 7, 18), None)
+            ]
+            self.assertEqual(len(filenames), 1)
+            # 02:00 UTC on the 18th is still the 17th five hours west, which
+            # is when the OSMAnd name says the other track was recorded
+            late = synthetic_gpx(
+                os.path.join(tmp_dir, "late.gpx"),
+                start=datetime.datetime(2023, 7, 18, 2, tzinfo=datetime.timezone.utc),
+            )
+            try:
+                with unittest.mock.patch.dict(os.environ, {"TZ": "UTC+5"}):
+                    time.tzset()
+                    day = datetime.datetime(2023, 7, 17)
+                    self.assertTrue(in_date_range(late, day, day))
+                    self.assertFalse(in_date_range(late, day.replace(day=18), None))
+                    self.assertTrue(
+                        in_date_range(late, pd.Timestamp("2023-07-18", tz="UTC"), day)
+                    )
+            finally:
+                time.tzset()
+            os.remove(late)
+            self.assertEqual(
+                list(expand_track_paths([os.path.join(tmp_dir, "*", "*Mon.gpx")])),
+                [os.path.join(tmp_dir, "2023-07", "2023-07-17_10-52_Mon.gpx")],
+            )
+            out_file = io.StringIO()
+            write_records(process_tracks(filenames, 1, [1000]), out_file)
+        record = json.loads(out_file.getvalue())
+        self.assertEqual(record["track_date"], "2023-07-20T08:00:00")
+        self.assertAlmostEqual(record["best_1000m"], 1000 / 3.0, delta=2)
+
+    def test_13(self):
+        """
+        smoothing removes GPS altitude jitter from the ascent, and every
+        method agrees on a clean track
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_13 = TrackData()
+            t_13.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx")))
+        clean = t_13.track_data["Altitude"].to_numpy(dtype=float)
+        clean_ascent = np.clip(np.diff(clean), 0, None).sum()
+        for method in ["none", "moving_average", "savgol"]:
+            (ascent, unused_descent) = t_13.elevation_totals(method=method)
+            self.assertAlmostEqual(ascent, clean_ascent, delta=1)
+        profile = t_13.elevation_profile(method="savgol", window=9)
+        self.assertEqual(profile.shape[0], clean.shape[0])
+        self.assertAlmostEqual(profile["grade"].max(), 10 / 50 / 3.0, delta=0.005)
+        # other smoothing leaves the default profile, and what reads it, alone
+        default = t_13.elevation_profile()
+        t_13.elevation_totals(method="none", window=3)
+        pd.testing.assert_frame_equal(t_13.default_elevation(), default)
+        splits = t_13.splits("km")
+        t_13.elevation_profile(method="savgol", window=31)
+        pd.testing.assert_frame_equal(t_13.splits("km"), splits)
+
+        jitter = np.where(np.arange(clean.shape[0]) % 2, 1.0, -1.0)
+        t_13.track_data["Altitude"] = clean + jitter
+        t_13.invalidate("track_data")
+        (noisy_ascent, unused_descent) = t_13.elevation_totals(method="none")
+        self.assertGreater(noisy_ascent, clean_ascent + 100)
+        (ascent, descent) = t_13.elevation_totals(method="hysteresis", threshold=3)
+        self.assertAlmostEqual(ascent, clean_ascent, delta=5)
+        self.assertAlmostEqual(ascent - descent, clean[-1] - clean[0], delta=4)
+        table = recompute_elevation({"t_13": t_13}, method="none")
+        self.assertAlmostEqual(table.loc["t_13", "ascent"], noisy_ascent)
+
+        # a track which only climbs has no descent, not a negative zero one
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            climb = TrackData()
+            climb.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), points=60))
+        for method in ["none", "hysteresis"]:
+            (unused_ascent, descent) = climb.elevation_totals(method=method)
+            self.assertFalse(np.signbit(descent))
+        self.assertNotIn("-0.0", json.dumps(climb.summary()))
+
+    def test_14(self):
+        """
+        rolling_stats() matches the steady pace of a synthetic track, and
+        grade adjusted pace is quicker than pace going uphill
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_14 = TrackData()
+            t_14.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=3.0))
+        by_time = t_14.rolling_stats(window=60)
+        self.assertTrue(np.isnan(by_time["speed"].iloc[59]))
+        self.assertAlmostEqual(by_time["secs_per_km"].iloc[60], 1000 / 3.0, delta=1)
+        self.assertAlmostEqual(by_time["moving_time"].iloc[-1], 60)
+        uphill = by_time["grade"] > 0.01
+        self.assertTrue(
+            (by_time["gap_secs_per_km"][uphill] < by_time["secs_per_km"][uphill]).all()
+        )
+        by_distance = t_14.rolling_stats(window=300, by="distance")
+        self.assertAlmostEqual(by_distance["moving_time"].iloc[-1], 100, delta=1)
+
+    def test_15(self):
+        """
+        splits() cuts the track into km laps with any remainder at the end,
+        and picks up heart rate from Garmin style extensions
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_15 = TrackData()
+            t_15.slurp(
+                synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=3.0, heart_rate=150)
+            )
+        table = t_15.splits("km")
+        self.assertEqual(list(table.index), [1, 2])
+        self.assertAlmostEqual(table.loc[1, "distance"], 1000)
+        self.assertAlmostEqual(table.loc[1, "moving_time"], 1000 / 3.0, delta=0.5)
+        self.assertAlmostEqual(table.loc[1, "avg_heart_rate"], 150)
+        self.assertAlmostEqual(
+            table["elapsed_time"].sum(),
+            t_15.track_data["tdiff"].sum().total_seconds(),
+        )
+        custom = t_15.splits([400, 400, 800])
+        self.assertEqual(list(custom["distance"].round()[:3]), [400, 400, 800])
+        self.assertEqual(custom.shape[0], 4)
+
+    def test_16(self):
+        """
+        declarative criteria give the same windows as the equivalent call
+        back, and can be combined
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_16 = TrackData()
+            t_16.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=3.0))
+        slow = t_16.build_distance_list(lambda dist, unused_time: dist >= 1000)
+        fast = t_16.build_distance_list(Distance >= 1000)
+        # the call back never ends a window on the final point, otherwise
+        # the two agree
+        last_row = t_16.processed_track_data.shape[0] - 1
+        pd.testing.assert_frame_equal(
+            fast[fast["end_row"] < last_row], slow, check_dtype=False
+        )
+        self.assertEqual(fast["end_row"].iloc[-1], last_row)
+        # an effort can take the whole track, ending on its final point
+        whole = t_16.processed_track_data["delta_dist"].sum()
+        self.assertEqual(
+            list(t_16.build_distance_list(Distance >= whole)["end_row"]), [last_row]
+        )
+        self.assertAlmostEqual(t_16.best_effort(whole)["distance"], whole)
+        self.assertEqual(Distance(">=", 1000), Distance >= 1000)
+
+        in_time = t_16.build_distance_list(MovingTime >= "2:00")
+        self.assertAlmostEqual(in_time["cum_dist"].max(), 360, delta=1)
+        both = t_16.build_distance_list(
+            And(MovingTime <= 400, Distance >= 1000) | (Elevation >= 1000)
+        )
+        self.assertEqual(list(both["end_row"]), list(fast["end_row"]))
+        self.assertTrue(
+            t_16.build_distance_list(And(MovingTime <= 300, Distance >= 1000)).empty
+        )
+
+    def test_17(self):
+        """
+        repeated analysis is served from the cache until the track changes,
+        and the cache stays within its size
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_17 = TrackData()
+            t_17.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=10.0))
+        hits = ANALYSIS_CACHE.hits
+        first = t_17.build_distance_list()
+        first["cum_dist"] = 0  # callers can't spoil the cached copy
+        second = t_17.build_distance_list(Distance >= 5000)
+        self.assertEqual(ANALYSIS_CACHE.hits, hits + 1)
+        self.assertFalse(second.empty)
+        self.assertTrue((second["cum_dist"] > 0).all())
+        t_17.guess_activity_type()
+        self.assertEqual(ANALYSIS_CACHE.hits, hits + 2)
+
+        t_17.invalidate("processed_track_data")
+        t_17.build_distance_list()
+        t_17.guess_activity_type()  # only depends on segment_data
+        self.assertEqual(ANALYSIS_CACHE.hits, hits + 3)
+        # and the results from before are gone, not just out of reach
+        versions = {
+            frame_version
+            for key in ANALYSIS_CACHE.results
+            if key[0] == t_17.cache_id
+            for frame_version in key[2]
+        }
+        self.assertEqual(versions, set(t_17.frame_versions.items()))
+        self.assertGreater(ANALYSIS_CACHE.usage(t_17.cache_id), 0)
+        t_17.invalidate()
+        self.assertEqual(ANALYSIS_CACHE.usage(t_17.cache_id), 0)
+
+        class Nested(TrackData):
+            @memoized()
+            def nested(self):
+                return {"laps": [1, 2]}
+
+        nested = Nested()
+        nested.nested()["laps"].append(3)
+        self.assertEqual(nested.nested(), {"laps": [1, 2]})
+
+        maxsize = ANALYSIS_CACHE.maxsize
+        try:
+            ANALYSIS_CACHE.maxsize = 2
+            for distance in [100, 200, 300]:
+                t_17.best_effort(distance)
+            self.assertEqual(len(ANALYSIS_CACHE.results), 2)
+        finally:
+            ANALYSIS_CACHE.maxsize = maxsize
+
+    def test_18(self):
+        """
+        compressed tracks and tracks inside zip and tar archives read the same
+        as the plain gpx
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            plain = synthetic_gpx(os.path.join(tmp_dir, "2023-07-17_10-52_Mon.gpx"))
+            with open(plain, "rb") as plain_file:
+                data = plain_file.read()
+            for suffix, opener in [(".gz", gzip.open), (".bz2", bz2.open)]:
+                with opener(plain + suffix, "wb") as packed_file:
+                    packed_file.write(data)
+                t_18 = TrackData()
+                t_18.slurp(plain + suffix)
+                self.assertEqual(t_18.track_data.shape[0], 600)
+            self.assertEqual(
+                OSMAnd_Track_File.date_from_track_name(plain + ".gz"),
+                datetime.datetime(2023, 7, 17, 10, 52),
+            )
+
+            zip_name = os.path.join(tmp_dir, "export.zip")
+            with zipfile.ZipFile(zip_name, "w") as archive:
+                archive.write(plain, "activities/a.gpx")
+                archive.write(plain + ".gz", "activities/b.gpx.gz")
+                archive.writestr("activities/notes.txt", "not a track")
+            tar_name = os.path.join(tmp_dir, "export.tar.xz")
+            with tarfile.open(tar_name, "w:xz") as archive:
+                archive.add(plain, "a.gpx")
+            self.assertEqual(
+                [name for name, unused in iter_archive_tracks(zip_name)],
+                ["activities/a.gpx", "activities/b.gpx.gz"],
+            )
+            tracks = slurp_archive(zip_name, workers=2)
+            tracks.update(slurp_archive(tar_name, workers=1))
+        self.assertEqual(
+            sorted(tracks), ["a.gpx", "activities/a.gpx", "activities/b.gpx.gz"]
+        )
+        for track in tracks.values():
+            self.assertEqual(track.track_data.shape[0], 600)
+
+    def test_19(self):
+        """
+        a track streamed through in small chunks summarises the same as when
+        it is slurped whole, including best efforts spanning chunks
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = synthetic_gpx(
+                os.path.join(tmp_dir, "t.gpx"), points=300, segments=2
+            )
+            t_19 = TrackData()
+            t_19.slurp(filename)
+            chunked = ChunkedTrack(best_efforts=[200, 1000], chunk_points=70)
+            summary = chunked.process(filename).summary()
+        expected = t_19.summary()
+        for key in [
+            "segments",
+            "points",
+            "moving_distance",
+            "moving_time",
+            "elapsed_time",
+            "smoothed_ascent",
+            "activity_type",
+            "north_bound",
+            "end_lat",
+        ]:
+            self.assertAlmostEqual(summary[key], expected[key], msg=key)
+        for distance in [200, 1000]:
+            self.assertAlmostEqual(
+                summary[f"best_{distance}m"],
+                t_19.best_effort(distance)["moving_time"],
+            )
+        # only about the last 1000m of points are held back
+        self.assertLess(chunked.tail[0].shape[0], 1000 / 3.0 + 5)
+
+    def test_20(self):
+        """
+        every track of a multi-track file is kept, and extracting the
+        segments on a worker pool gives the same frames
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = synthetic_gpx(
+                os.path.join(tmp_dir, "t.gpx"), points=100, segments=2, tracks=3
+            )
+            t_20 = TrackData()
+            t_20.slurp(filename)
+            parallel = TrackData()
+            saved = TrackData.PARALLEL_POINTS
+            try:
+                TrackData.PARALLEL_POINTS = 0
+                with open(filename, "rb") as gpx_file:
+                    parallel.process(gpx_file, workers=2)
+            finally:
+                TrackData.PARALLEL_POINTS = saved
+        self.assertEqual(t_20.track_data.shape[0], 600)
+        self.assertEqual(list(t_20.segment_data["TrackNo"]), [0, 0, 1, 1, 2, 2])
+        self.assertEqual(t_20.duration, pd.Timedelta(seconds=6 * 99))
+        summary = t_20.track_summary()
+        self.assertEqual(list(summary["name"]), ["track 0", "track 1", "track 2"])
+        self.assertEqual(list(summary["segments"]), [2, 2, 2])
+        self.assertEqual(sorted(t_20.track_frames()), [0, 1, 2])
+        pd.testing.assert_frame_equal(parallel.track_data, t_20.track_data)
+        pd.testing.assert_frame_equal(
+            parallel.segment_data,
+            t_20.segment_data[parallel.segment_data.columns],
+        )
+
+    def test_21(self):
+        """
+        a renamed, recompressed copy of a track has the same fingerprint, a
+        different track doesn't
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            original = synthetic_gpx(os.path.join(tmp_dir, "2023-07-17_10-52_Mon.gpx"))
+            with open(original, "rb") as plain_file:
+                with gzip.open(
+                    os.path.join(tmp_dir, "Titled_run.gpx.gz"), "wb"
+                ) as copy:
+                    copy.write(plain_file.read())
+            synthetic_gpx(os.path.join(tmp_dir, "other.gpx"), points=601)
+            fingerprints = [
+                track_fingerprint(os.path.join(tmp_dir, name), sample_points=10)
+                for name in [
+                    "2023-07-17_10-52_Mon.gpx",
+                    "Titled_run.gpx.gz",
+                    "other.gpx",
+                ]
+            ]
+        self.assertEqual(fingerprints[0]["point_count"], 600)
+        self.assertEqual(fingerprints[0]["start_time"], 1689591120)
+        self.assertEqual(
+            fingerprint_key(fingerprints[0]), fingerprint_key(fingerprints[1])
+        )
+        self.assertNotEqual(
+            fingerprint_key(fingerprints[0]), fingerprint_key(fingerprints[2])
+        )
+        self.assertEqual(fingerprints[2]["sample_hash"], fingerprints[0]["sample_hash"])
+
+    def test_31(self):
+        """
+        points are counted whichever block boundaries their tags straddle
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gpx_file = synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), points=10)
+            with open(gpx_file, "rb") as raw_file:
+                data = raw_file.read()
+            # a block boundary 3 bytes into the first tag
+            first_tag = TRKPT_TAG.search(data).start()
+            for block_size in [first_tag + 3] + list(range(5, 80, 3)):
+                self.assertEqual(
+                    track_fingerprint(gpx_file, block_size=block_size)["point_count"],
+                    10,
+                    f"block_size {block_size}",
+                )
+
+    @unittest.skipUnless(pyarrow, "pyarrow not installed")
+    def test_22(self):
+        """
+        tracks round trip through arrow and parquet files
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_22 = TrackData()
+            t_22.slurp(
+                synthetic_gpx(
+                    os.path.join(tmp_dir, "t.gpx"), segments=2, heart_rate=130
+                )
+            )
+            other = TrackData()
+            other.slurp(synthetic_gpx(os.path.join(tmp_dir, "o.gpx"), speed=5))
+            for suffix in [".arrow", ".parquet"]:
+                path = os.path.join(tmp_dir, f"tracks{suffix}")
+                write_arrow([("t", t_22), ("o", other)], path)
+                loaded = TrackData.from_arrow(path, source="t")
+                expected = t_22.processed_track_data[list(TrackData.ARROW_POINT_ORDER)]
+                pd.testing.assert_frame_equal(
+                    loaded.processed_track_data.reset_index(drop=True),
+                    expected.assign(DOP=pd.to_numeric(expected["DOP"])),
+                    check_dtype=False,
+                )
+                self.assertEqual(loaded.summary(), t_22.summary())
+                self.assertEqual(loaded.guess_activity_type(), "run")
+                self.assertEqual(
+                    TrackData.from_arrow(path, source="o").guess_activity_type(),
+                    "cycle",
+                )
+                with self.assertRaises(ValueError):
+                    TrackData.from_arrow(path)
+
+            t_22.to_arrow(os.path.join(tmp_dir, "t.arrow"))
+            (points, unused_segments, info) = read_arrow(
+                os.path.join(tmp_dir, "t.arrow")
+            )
+        self.assertEqual(points.num_rows, 1200)
+        self.assertEqual(info[""]["track_names"], ["track 0"])
+
+    def test_23(self):
+        """
+        a file with many short segments is built into single frames with
+        elapsed time restarting at each segment
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_23 = TrackData()
+            t_23.slurp(
+                synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), points=10, segments=50)
+            )
+        self.assertEqual(t_23.segment_data.shape[0], 50)
+        self.assertEqual(list(t_23.segment_data["SegNo"]), list(range(50)))
+        self.assertEqual(t_23.track_data.shape[0], 500)
+        self.assertTrue(t_23.track_data.index.equals(pd.RangeIndex(500)))
+        self.assertEqual(t_23.track_data["tdiff"].sum(), pd.Timedelta(seconds=50 * 9))
+        timings = benchmark_process(segment_counts=(2, 4), points=5)
+        self.assertEqual(list(timings.index), [2, 4])
+
+    def test_24(self):
+        """
+        histogram sketches give percentiles close to the exact ones, and
+        merge into the sketch of all the values
+        """
+        values = np.random.default_rng(24).lognormal(1, 0.5, 20000)
+        whole = LogHistogram(0.1, 100).add(values)
+        for q in [5, 50, 95]:
+            self.assertAlmostEqual(
+                whole.percentile(q) / np.percentile(values, q), 1, delta=0.012
+            )
+        halves = LogHistogram(0.1, 100).add(values[:7000])
+        halves.merge(
+            LogHistogram.from_dict(LogHistogram(0.1, 100).add(values[7000:]).to_dict())
+        )
+        np.testing.assert_array_equal(halves.counts, whole.counts)
+        self.assertEqual(LogHistogram(0.1, 100).add([0, 50, 500, np.nan]).count(), 3)
+        with self.assertRaises(ValueError):
+            whole.merge(LogHistogram(1, 100))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary = summarise_track(
+                synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), heart_rate=140),
+                sketches=True,
+            )
+        speed = LogHistogram.from_dict(summary["sketches"]["speed"])
+        self.assertEqual(speed.count(), 599)
+        self.assertAlmostEqual(speed.percentile(50), 3, delta=0.05)
+        pace = LogHistogram.from_dict(summary["sketches"]["pace"])
+        self.assertAlmostEqual(pace.percentile(50), 1000 / 3, delta=5)
+        heart_rate = LogHistogram.from_dict(summary["sketches"]["heart_rate"])
+        self.assertGreater(heart_rate.percentile(95), heart_rate.percentile(5))
+
+    def test_25(self):
+        """
+        selecting tracks by date only lists the months in range, and reads
+        the header of files without an OSMAnd name
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for month in ["2023-06", "2023-07", "2023-08", "notes"]:
+                os.makedirs(os.path.join(tmp_dir, month))
+            for name in [
+                "2023-06-30_18-00_Fri.gpx",
+                "2023-07-09_09-00_Sun.gpx",
+                "2023-07-17_10-52_Mon.gpx.gz",
+                "2023-08-01_07-00_Tue.gpx",
+            ]:
+                with open(
+                    os.path.join(tmp_dir, name[:7], name), "w", encoding="utf-8"
+                ) as out:
+                    out.write("not opened")
+            for name, day in [("Parkrun.gpx", 15), ("Old_parkrun.gpx", 1)]:
+                synthetic_gpx(
+                    os.path.join(tmp_dir, "2023-07", name),
+                    points=5,
+                    start=datetime.datetime(
+                        2023, 7, day, 9, tzinfo=datetime.timezone.utc
+                    ),
+                )
+            listed = []
+            real_listdir = os.listdir
+            with unittest.mock.patch(
+                "os.listdir", lambda path: listed.append(path) or real_listdir(path)
+            ):
+                selected = list(
+                    select_track_paths(
+                        [tmp_dir],
+                        datetime.datetime(2023, 7, 10),
+                        datetime.datetime(2023, 7, 31),
+                    )
+                )
+        self.assertEqual(
+            [os.path.basename(filename) for filename in selected],
+            ["2023-07-17_10-52_Mon.gpx.gz", "Parkrun.gpx"],
+        )
+        self.assertNotIn(os.path.join(tmp_dir, "2023-06"), listed)
+        self.assertNotIn(os.path.join(tmp_dir, "2023-08"), listed)
+        with self.assertRaises(ValueError):
+            OSMAnd_Track_File.date_from_track_name("2023-07-17_10-52_Mon_copy.gpx")
+
+    def test_26(self):
+        """
+        memory is reported per frame, and downcasting shrinks the points
+        without upsetting the summary
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_26 = TrackData()
+            t_26.slurp(
+                synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), heart_rate=120),
+                trace_memory=True,
+            )
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertGreater(t_26.slurp_peak_memory, 0)
+        usage = t_26.memory_usage()
+        self.assertEqual(
+            usage["total"],
+            sum(usage[frame] for frame in usage if frame != "total"),
+        )
+        self.assertGreater(usage["track_data"], 600 * 8 * 10)
+        summary = t_26.summary()
+        self.assertGreater(t_26.downcast(), 0)
+        self.assertEqual(t_26.track_data["Altitude"].dtype, np.float32)
+        downcast_summary = t_26.summary()
+        self.assertEqual(downcast_summary["moving_time"], summary["moving_time"])
+        self.assertAlmostEqual(
+            downcast_summary["moving_distance"], summary["moving_distance"]
+        )
+        report = memory_report({"t": t_26})
+        self.assertEqual(list(report.index), ["t"])
+        self.assertIn("processed_track_data", report.columns)
+
+    def test_27(self):
+        """
+        efforts at different speeds over the same route open up the gaps
+        expected, singly and against a history in one go
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            efforts = {}
+            for speed in [3.0, 3.3, 3.6]:
+                efforts[speed] = TrackData()
+                efforts[speed].slurp(
+                    synthetic_gpx(
+                        os.path.join(tmp_dir, f"{speed}.gpx"),
+                        points=int(2200 / speed),
+                        speed=speed,
+                    )
+                )
+        today = efforts[3.3]
+        comparison = today.compare(efforts[3.0])
+        distance = comparison["distance"].iloc[-1]
+        self.assertAlmostEqual(
+            comparison["gap"].iloc[-1], distance / 3.3 - distance / 3.0, delta=1
+        )
+        self.assertTrue((comparison["gained"].iloc[1:] > 0).all())
+        self.assertAlmostEqual(comparison["gained"].sum(), -comparison["gap"].iloc[-1])
+
+        split_table = today.compare_splits(efforts[3.6])
+        self.assertEqual(list(split_table.index), [1, 2, 3])
+        self.assertAlmostEqual(
+            split_table["difference"].iloc[0], 1000 / 3.3 - 1000 / 3.6, delta=1
+        )
+
+        gaps = today.compare_with_history(
+            {"slow": efforts[3.0], "fast": efforts[3.6], "same": today}
+        )
+        self.assertEqual(list(gaps.columns[:2]), [1000, 2000])
+        self.assertAlmostEqual(gaps.loc["slow", 1000], 1000 / 3.3 - 1000 / 3.0, delta=1)
+        self.assertGreater(gaps.loc["fast", 2000], 0)
+        np.testing.assert_allclose(gaps.loc["same"], 0, atol=1e-9)
+        for name, track in [("slow", efforts[3.0]), ("fast", efforts[3.6])]:
+            marks = gaps.columns.to_numpy()
+            single = today.compare(track)
+            np.testing.assert_allclose(
+                gaps.loc[name],
+                TrackData.interp_at(*today.distance_and_time(), marks)
+                - TrackData.interp_at(*track.distance_and_time(), marks),
+            )
+            self.assertLess(abs(single["gap"].iloc[-1] - gaps.loc[name].iloc[-1]), 2)
+
+    def test_28(self):
+        """
+        the likelihood ramps work on arrays as they do on single values, and
+        pace is only turned into a Timedelta for display
+        """
+        speeds = np.array([0, 1.0, 1.788, 2.5, 3.0, 4.0, 4.444, 7.0, 12.0, np.nan])
+        for from_speed, from_distance in ACTIVITY_LIKELIHOODS.values():
+            self.assertEqual(
+                list(from_speed(speeds)), [from_speed(speed) for speed in speeds]
+            )
+            self.assertEqual(from_distance(np.nan), 0)
+        self.assertAlmostEqual(run_likelihood(3.0), 1)
+        self.assertAlmostEqual(walk_likelihood(1.788 / 2), 0.5)
+        self.assertAlmostEqual(cycle_distance_likelihood(85000), 0.5)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            t_28 = TrackData()
+            t_28.slurp(synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), points=700))
+        distance_list = t_28.build_distance_list(Distance >= 1000)
+        self.assertNotIn("pace", distance_list.columns)
+        self.assertAlmostEqual(
+            distance_list["secs_per_km"].iloc[0], 1000 / 3.0, delta=1
+        )
+        shown = with_paces(distance_list)
+        self.assertEqual(list(shown.columns[-2:]), ["secs_per_km", "pace"])
+        self.assertEqual(
+            shown["pace"].iloc[0].round("s"),
+            pd.Timedelta(seconds=round(distance_list["secs_per_km"].iloc[0])),
+        )
+        self.assertEqual(t_28.guess_activity_type(), "run")
+        self.assertAlmostEqual(
+            t_28.segment_data["pace"].iloc[0].total_seconds(), 1000 / 3.0, delta=1
+        )
+
+    def test_29(self):
+        """
+        the distance models agree with known geodesics and each other, and a
+        track can be remeasured by any of them
+        """
+        # Vincenty's own test line, Flinders Peak to Buninyong
+        flinders = (-(37 + 57 / 60 + 3.72030 / 3600), 144 + 25 / 60 + 29.52440 / 3600)
+        buninyong = (-(37 + 39 / 60 + 10.15610 / 3600), 143 + 55 / 60 + 35.38390 / 3600)
+        for model in ["vincenty", "karney"]:
+            if model == "karney" and geographiclib is None:
+                continue
+            self.assertAlmostEqual(
+                float(geodesic_distance(*flinders, *buninyong, model=model)),
+                54972.271,
+                places=2,
+            )
+        self.assertAlmostEqual(float(vincenty(0, 0, 1, 0)), 110574.389, places=2)
+        self.assertAlmostEqual(
+            float(haversine(0, 0, 1, 0)), np.pi / 180 * gpxpy.geo.EARTH_RADIUS
+        )
+        self.assertEqual(float(vincenty(51.5, -1.3, 51.5, -1.3)), 0)
+        self.assertAlmostEqual(
+            float(geodesic_distance(0, 0, 0, 0, "haversine", 100, 130)), 30
+        )
+        with self.assertRaises(ValueError):
+            geodesic_distance(0, 0, 1, 1, "flat")
+
+        benchmark = benchmark_distances(pairs=2000)
+        self.assertLess(benchmark.loc["vincenty", "max_error"], 1e-6)
+        self.assertLess(benchmark.loc["equirectangular", "max_error"], 0.01)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gpx_file = synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), segments=2)
+            t_29 = TrackData()
+            t_29.slurp(gpx_file)
+            gpxpy_distance = t_29.strava_stats()["moving_distance"]
+            t_29.remeasure("gpxpy")
+            self.assertAlmostEqual(
+                t_29.strava_stats()["moving_distance"], gpxpy_distance, places=6
+            )
+            accurate = TrackData()
+            accurate.slurp(gpx_file, distance_model="vincenty")
+            chunked = ChunkedTrack(distance_model="vincenty").process(gpx_file)
+        vincenty_distance = accurate.strava_stats()["moving_distance"]
+        self.assertNotAlmostEqual(vincenty_distance, gpxpy_distance, places=0)
+        self.assertAlmostEqual(vincenty_distance / gpxpy_distance, 1, delta=0.01)
+        self.assertEqual(accurate.track_data["delta_dist"].iloc[600], 0)
+        self.assertAlmostEqual(
+            chunked.summary()["moving_distance"], vincenty_distance, places=3
+        )
+
+    def test_30(self):
+        """
+        the power model matches a hand worked steady ride, climbs cost more,
+        and a batch of tracks gives each the same result as on its own
+        """
+        rider = DEFAULT_RIDER
+        mass = rider["rider_mass"] + rider["bike_mass"]
+        steady = (
+            (
+                mass * GRAVITY * rider["crr"]
+                + 0.5 * rider["air_density"] * rider["cda"] * 100
+            )
+            * 10
+            / rider["drivetrain_efficiency"]
+        )
+        self.assertAlmostEqual(float(cycling_power(10.0, 0.0, 0.0)), steady)
+        self.assertGreater(float(cycling_power(5.0, 0.05, 0.0)), steady)
+        self.assertEqual(float(cycling_power(10.0, -0.1, 0.0)), 0)  # coasting
+        self.assertGreater(float(cycling_power(10.0, 0.0, 0.0, {"cda": 0.5})), steady)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rides = []
+            for speed in [8.0, 10.0]:
+                rides.append(TrackData())
+                rides[-1].slurp(
+                    synthetic_gpx(
+                        os.path.join(tmp_dir, f"{speed}.gpx"),
+                        points=900,
+                        speed=speed,
+                        segments=2,
+                    )
+                )
+        power = rides[1].power()
+        self.assertEqual(power.shape[0], rides[1].processed_track_data.shape[0])
+        self.assertAlmostEqual(power["power"].median(), steady, delta=0.1 * steady)
+        summary = rides[1].power_summary()
+        self.assertGreaterEqual(summary["normalized_power"], summary["avg_power"])
+        moving_secs = rides[1].processed_track_data["tdiff"].dt.total_seconds().sum()
+        self.assertAlmostEqual(
+            summary["energy_kj"], summary["avg_power"] * moving_secs / 1000
+        )
+        # the rolling hills average out, leaving the flat work plus getting
+        # up to speed at the start of each segment
+        kinetic = 2 * 0.5 * mass * 10**2 / rider["drivetrain_efficiency"]
+        self.assertAlmostEqual(
+            summary["energy_kj"],
+            (steady * moving_secs + kinetic) / 1000,
+            delta=0.05 * steady * moving_secs / 1000,
+        )
+
+        batch = PowerBatch()
+        for n, ride in enumerate(rides):
+            batch.add(n, ride)
+        summaries = batch.summaries()
+        for key, value in summary.items():
+            self.assertAlmostEqual(summaries.loc[1, key], value)
+        heavier = batch.summaries({"rider_mass": 95.0})
+        self.assertTrue((heavier["energy_kj"] > summaries["energy_kj"]).all())
+        (point_power, unused_rolling) = batch.evaluate()
+        np.testing.assert_allclose(point_power[-power.shape[0] :], power["power"])
+        self.assertTrue(PowerBatch().summaries().empty)
 
 
 def do_tests():
@@ -736,17 +4254,97 @@ def main():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--test", help="run the unit tests", action="store_true")
-    parser.add_argument("filename", help="track file to be read", type=str, nargs="?")
+    parser.add_argument(
+        "--start", help="first OSMAnd track date, yyyy-mm-dd", type=pd.to_datetime
+    )
+    parser.add_argument(
+        "--end", help="last OSMAnd track date, yyyy-mm-dd", type=pd.to_datetime
+    )
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument(
+        "--format", help="output format", choices=["jsonl", "csv"], default="jsonl"
+    )
+    parser.add_argument(
+        "--best-effort",
+        help="distance in metres to find the best effort for, may be repeated",
+        type=float,
+        action="append",
+        dest="best_efforts",
+    )
+    parser.add_argument(
+        "--bench",
+        help="time processing files with more and more segments",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--arrow",
+        help="export the points and segments to this .arrow or .parquet file",
+        type=str,
+    )
+    parser.add_argument(
+        "--distance-model",
+        help="how to measure between points, see benchmark_distances()",
+        choices=list(DISTANCE_MODELS),
+    )
+    parser.add_argument(
+        "--bench-distances",
+        help="time the distance models and find their errors",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--power",
+        help="estimate the cycling power of every track in this arrow export",
+        type=str,
+    )
+    parser.add_argument(
+        "--rider",
+        help='json of values to change in DEFAULT_RIDER, e.g. {"rider_mass": 70}',
+        type=json.loads,
+    )
+    parser.add_argument(
+        "--compare",
+        help="race this track against the earlier efforts given as paths",
+        type=str,
+    )
+    parser.add_argument(
+        "paths", help="track files, directories or globs", type=str, nargs="*"
+    )
     args = parser.parse_args()
     if args.test:
         print("running unit tests")
         do_tests()
+    elif args.power:
+        print(PowerBatch.from_arrow(args.power).summaries(args.rider).to_string())
+    elif args.compare:
+        today = TrackData()
+        today.slurp(args.compare, distance_model=args.distance_model)
+        history = {}
+        for filename in select_track_paths(args.paths, args.start, args.end):
+            history[filename] = TrackData()
+            history[filename].slurp(filename, distance_model=args.distance_model)
+        print(today.compare_with_history(history).round(1).to_string())
+    elif args.bench:
+        print(benchmark_process())
+    elif args.bench_distances:
+        print(benchmark_distances().to_string())
+    elif args.arrow:
+        export_arrow(
+            select_track_paths(args.paths, args.start, args.end),
+            args.arrow,
+            args.workers,
+        )
     else:
-        print(f"processing {args.filename}")
+        filenames = select_track_paths(args.paths, args.start, args.end)
+        best_efforts = args.best_efforts or [1000, 5000, 10000]
+        write_records(
+            process_tracks(filenames, args.workers, best_efforts, args.distance_model),
+            sys.stdout,
+            args.format,
+        )
 
 
 if __name__ == "__main__":
     main()
     sys.exit()
 else:
-    print(f"module {__module__} imported")
+    print(f"module {__module__} imported", file=sys.stderr)
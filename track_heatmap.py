@@ -0,0 +1,412 @@
+#! /usr/bin/env python3
+"""
+    track_heatmap: a personal heatmap of everywhere the tracks in the library
+    have been, as web mercator tiles
+"""
+__module__ = "track_heatmap"
+
+import concurrent.futures
+import logging
+import math
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+import argparse
+import numpy as np
+
+import track_analyzer
+
+
+def to_pixels(lat, lon, zoom, tile_size=256):
+    """
+    convert latitudes and longitudes to web mercator pixel coordinates at a
+    zoom level, counted from the top left of the world
+    """
+    scale = tile_size * 2**zoom
+    lat = np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)
+    x = (np.asarray(lon, dtype=float) + 180) / 360 * scale
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2 * scale
+    return (x, y)
+
+
+def line_pixels(x, y, seg_no):
+    """
+    the pixels crossed by the lines joining consecutive points of the same
+    segment, found by stepping along each line at no more than a pixel at a
+    time.  Every line is stepped at once with array operations.
+    returns : (x, y) integer pixel arrays, each pixel appearing once
+    """
+    if x.shape[0] == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    joined = seg_no[1:] == seg_no[:-1]
+    x_0 = x[:-1][joined]
+    y_0 = y[:-1][joined]
+    d_x = x[1:][joined] - x_0
+    d_y = y[1:][joined] - y_0
+    steps = np.ceil(np.maximum(np.abs(d_x), np.abs(d_y))).astype(np.int64) + 1
+    line = np.repeat(np.arange(steps.shape[0]), steps)
+    first_step = np.cumsum(steps) - steps
+    fraction = (np.arange(line.shape[0]) - first_step[line]) / np.maximum(
+        steps[line] - 1, 1
+    )
+    all_x = np.concatenate((x_0[line] + d_x[line] * fraction, x))
+    all_y = np.concatenate((y_0[line] + d_y[line] * fraction, y))
+    pixels = np.unique(
+        np.stack((np.floor(all_x), np.floor(all_y)), axis=1).astype(np.int64),
+        axis=0,
+    )
+    return (pixels[:, 0], pixels[:, 1])
+
+
+def rasterise(lat, lon, seg_no, zooms, tile_size=256):
+    """
+    the tiles touched by a track, with 1 for every pixel it passes through,
+    so a track counts once per pixel however often it crosses it
+    returns : a dict of (zoom, tile x, tile y) -> uint32 grid
+    """
+    grids = {}
+    for zoom in zooms:
+        (x, y) = to_pixels(lat, lon, zoom, tile_size)
+        (pixel_x, pixel_y) = line_pixels(x, y, seg_no)
+        (tile_x, in_x) = np.divmod(pixel_x, tile_size)
+        (tile_y, in_y) = np.divmod(pixel_y, tile_size)
+        tiles = np.stack((tile_x, tile_y), axis=1)
+        (unique_tiles, tile_of_pixel, counts) = np.unique(
+            tiles, axis=0, return_inverse=True, return_counts=True
+        )
+        # sort the pixels by tile once, rather than searching for each tile's
+        order = np.argsort(tile_of_pixel.reshape(-1), kind="stable")
+        cells = (in_y * tile_size + in_x)[order]
+        for (t_x, t_y), tile_cells in zip(
+            unique_tiles.tolist(), np.split(cells, np.cumsum(counts)[:-1])
+        ):
+            grid = np.bincount(tile_cells, minlength=tile_size * tile_size)
+            grids[(zoom, t_x, t_y)] = grid.reshape(tile_size, tile_size).astype(
+                np.uint32
+            )
+    return grids
+
+
+def rasterise_file(filename, zooms, tile_size=256):
+    """
+    rasterise a track file, streaming its points a chunk at a time.  This is
+    the unit of work handed to worker processes.
+    """
+    grids = {}
+    previous = None
+    for chunk in track_analyzer.iter_point_chunks(filename):
+        lat = chunk["Latitude"]
+        lon = chunk["Longitude"]
+        seg_no = chunk["SegNo"]
+        if previous is not None:
+            # carry on the line from the end of the last chunk
+            lat = np.concatenate(([previous[0]], lat))
+            lon = np.concatenate(([previous[1]], lon))
+            seg_no = np.concatenate(([previous[2]], seg_no))
+        previous = (lat[-1], lon[-1], seg_no[-1])
+        for key, grid in rasterise(lat, lon, seg_no, zooms, tile_size).items():
+            if key in grids:
+                np.maximum(grids[key], grid, out=grids[key])
+            else:
+                grids[key] = grid
+    return grids
+
+
+class Heatmap:
+    """
+    Counts of the tracks passing through each pixel of the web mercator tiles
+    at several zoom levels.  Tracks are remembered by id (normally their
+    file name) so adding the library again only rasterises the new ones, and
+    the tiles changed since they were last written are tracked, as is the
+    brightest count they were scaled by.
+    """
+
+    def __init__(self, zooms=(10, 12, 14), tile_size=256):
+        self.zooms = tuple(zooms)
+        self.tile_size = tile_size
+        self.grids = {}  # (zoom, tile x, tile y) -> uint32 counts
+        self.track_ids = set()
+        self.dirty = set()
+        self.written_brightest = {}  # zoom -> brightest when tiles were written
+        self.logger = logging.getLogger(__name__)
+
+    def merge(self, grids):
+        """
+        add a set of partial grids, e.g. from one track, into the heatmap
+        """
+        for key, grid in grids.items():
+            if key in self.grids:
+                self.grids[key] += grid
+            else:
+                self.grids[key] = grid.astype(np.uint32)
+            self.dirty.add(key)
+
+    def add_track(self, track_id, track):
+        """
+        add an already slurped TrackData, unless it's already in the heatmap
+        """
+        if track_id in self.track_ids:
+            return False
+        segments = (
+            track.track_data["TrackNo"].to_numpy() * 1_000_000
+            + track.track_data["SegNo"].to_numpy()
+        )
+        self.merge(
+            rasterise(
+                track.track_data["Latitude"].to_numpy(dtype=float),
+                track.track_data["Longitude"].to_numpy(dtype=float),
+                segments,
+                self.zooms,
+                self.tile_size,
+            )
+        )
+        self.track_ids.add(track_id)
+        return True
+
+    def add_files(self, filenames, workers=None):
+        """
+        rasterise the track files not already in the heatmap on a pool of
+        worker processes, merging each track's grids as it finishes
+        returns : the number of tracks added
+        """
+        new_files = [
+            os.path.abspath(filename)
+            for filename in filenames
+            if os.path.abspath(filename) not in self.track_ids
+        ]
+        workers = workers or os.cpu_count()
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(rasterise_file, filename, self.zooms, self.tile_size): (
+                    filename
+                )
+                for filename in new_files
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    self.merge(future.result())
+                    self.track_ids.add(futures[future])
+                except Exception:  # pylint: disable=broad-except
+                    self.logger.exception(f"failed to rasterise {futures[future]}")
+        return len(new_files)
+
+    def save(self, filename):
+        """
+        keep the heatmap, with the ids of its tracks, the tiles not yet
+        written and the scale of those which were, as a numpy archive
+        """
+        arrays = {f"{z}/{x}/{y}": grid for (z, x, y), grid in self.grids.items()}
+        arrays["track_ids"] = np.array(sorted(self.track_ids), dtype=str)
+        arrays["zooms"] = np.array(self.zooms)
+        arrays["dirty"] = np.array(sorted(self.dirty), dtype=np.int64).reshape(-1, 3)
+        arrays["written_brightest"] = np.array(
+            sorted(self.written_brightest.items()), dtype=np.int64
+        ).reshape(-1, 2)
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        read a heatmap written by save().  Archives saved without the dirty
+        tiles have every tile marked dirty.
+        """
+        with np.load(filename) as arrays:
+            heatmap = cls(zooms=arrays["zooms"].tolist())
+            heatmap.track_ids = set(arrays["track_ids"].tolist())
+            for name in arrays.files:
+                if "/" in name:
+                    key = tuple(int(part) for part in name.split("/"))
+                    heatmap.grids[key] = arrays[name]
+                    heatmap.tile_size = arrays[name].shape[0]
+            if "dirty" in arrays.files:
+                heatmap.dirty = {tuple(key) for key in arrays["dirty"].tolist()}
+                heatmap.written_brightest = dict(arrays["written_brightest"].tolist())
+            else:
+                heatmap.dirty = set(heatmap.grids)
+        return heatmap
+
+    @staticmethod
+    def png_bytes(grid, brightest):
+        """
+        a grey scale and alpha png of a tile, brighter and more opaque where
+        more tracks have been, on a log scale so single visits still show
+        """
+        level = np.log1p(grid) / np.log1p(max(brightest, 1))
+        pixels = np.empty(grid.shape + (2,), dtype=np.uint8)
+        pixels[..., 0] = 255
+        pixels[..., 1] = np.round(level * 255)
+        rows = b"".join(b"\x00" + row.tobytes() for row in pixels)
+
+        def chunk(kind, data):
+            return (
+                struct.pack(">I", len(data))
+                + kind
+                + data
+                + struct.pack(">I", zlib.crc32(kind + data))
+            )
+
+        header = struct.pack(">IIBBBBB", grid.shape[1], grid.shape[0], 8, 4, 0, 0, 0)
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(rows))
+            + chunk(b"IEND", b"")
+        )
+
+    def write_png_tiles(self, out_dir, only_dirty=True):
+        """
+        write tiles as out_dir/zoom/x/y.png, by default only those changed
+        since the last call.  Brightness is scaled by the brightest pixel of
+        each zoom level, so when that changes every tile of the zoom is
+        written again to keep them on the same scale.
+        returns : the number of tiles written
+        """
+        brightest = {}
+        for (zoom, unused_x, unused_y), grid in self.grids.items():
+            brightest[zoom] = max(brightest.get(zoom, 0), int(grid.max()))
+        rescaled = {
+            zoom
+            for zoom, value in brightest.items()
+            if self.written_brightest.get(zoom) != value
+        }
+        if only_dirty:
+            keys = self.dirty | {key for key in self.grids if key[0] in rescaled}
+        else:
+            keys = set(self.grids)
+        for zoom, x, y in keys:
+            tile_dir = os.path.join(out_dir, str(zoom), str(x))
+            os.makedirs(tile_dir, exist_ok=True)
+            with open(os.path.join(tile_dir, f"{y}.png"), "wb") as png_file:
+                png_file.write(
+                    Heatmap.png_bytes(self.grids[(zoom, x, y)], brightest[zoom])
+                )
+        written = len(keys)
+        self.dirty = set()
+        self.written_brightest = brightest
+        return written
+
+
+class TestStuff(unittest.TestCase):
+    """
+    rasterise synthetic tracks into a heatmap
+    """
+
+    def test_00(self):
+        """
+        a track is drawn as an unbroken line, counted once per track, and
+        not counted again when the same track is added twice
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            track = track_analyzer.TrackData()
+            track.slurp(
+                track_analyzer.synthetic_gpx(os.path.join(tmp_dir, "t.gpx"), speed=5)
+            )
+        heatmap = Heatmap(zooms=(14,))
+        self.assertTrue(heatmap.add_track("a", track))
+        self.assertFalse(heatmap.add_track("a", track))
+        heatmap.add_track("b", track)
+        counts = sum(grid.sum() for grid in heatmap.grids.values())
+        # 3km due north is about 3000 / 9.5 pixels at zoom 14 and latitude 51
+        self.assertAlmostEqual(counts / 2, 3000 / 9.5 / 0.63, delta=30)
+        self.assertEqual(max(grid.max() for grid in heatmap.grids.values()), 2)
+        column = np.concatenate([grid.sum(axis=0) for grid in heatmap.grids.values()])
+        self.assertEqual(np.count_nonzero(column), len(heatmap.grids))
+
+    def test_01(self):
+        """
+        files are rasterised in parallel, only new ones are added, and the
+        heatmap survives a save and load and can be written as png tiles
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = track_analyzer.synthetic_gpx(os.path.join(tmp_dir, "1.gpx"))
+            second = track_analyzer.synthetic_gpx(
+                os.path.join(tmp_dir, "2.gpx"), segments=2, points=300
+            )
+            heatmap = Heatmap(zooms=(12, 14))
+            self.assertEqual(heatmap.add_files([first], workers=1), 1)
+            self.assertEqual(heatmap.add_files([first, second], workers=2), 1)
+            archive = os.path.join(tmp_dir, "heatmap.npz")
+            heatmap.save(archive)
+            loaded = Heatmap.load(archive)
+            self.assertEqual(loaded.track_ids, heatmap.track_ids)
+            self.assertEqual(loaded.zooms, (12, 14))
+            for key, grid in heatmap.grids.items():
+                self.assertEqual(loaded.grids[key].max(), 2)
+                np.testing.assert_array_equal(loaded.grids[key], grid)
+            written = heatmap.write_png_tiles(os.path.join(tmp_dir, "tiles"))
+            self.assertEqual(written, len(heatmap.grids))
+            self.assertEqual(heatmap.write_png_tiles(os.path.join(tmp_dir, "tiles")), 0)
+            # the loaded heatmap still has every tile to write
+            self.assertEqual(loaded.dirty, set(heatmap.grids))
+            heatmap.save(archive)
+            self.assertEqual(Heatmap.load(archive).dirty, set())
+
+            # a new brightest pixel rescales, so rewrites, the whole zoom
+            key = next(key for key in heatmap.grids if key[0] == 14)
+            heatmap.merge({key: np.full_like(heatmap.grids[key], 5)})
+            self.assertEqual(
+                heatmap.write_png_tiles(os.path.join(tmp_dir, "tiles")),
+                sum(1 for other in heatmap.grids if other[0] == 14),
+            )
+            (zoom, x, y) = next(iter(heatmap.grids))
+            with open(
+                os.path.join(tmp_dir, "tiles", str(zoom), str(x), f"{y}.png"), "rb"
+            ) as png_file:
+                self.assertEqual(png_file.read(8), b"\x89PNG\r\n\x1a\n")
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    will add tracks to a heatmap archive and write its changed tiles, or run
+    unit tests
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument("--tiles", help="directory to write png tiles into")
+    parser.add_argument(
+        "--zoom", help="zoom level, may be repeated", type=int, action="append"
+    )
+    parser.add_argument("archive", help="heatmap .npz archive", nargs="?")
+    parser.add_argument(
+        "paths", help="track files, directories or globs", type=str, nargs="*"
+    )
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    else:
+        if args.archive is None:
+            parser.error("a heatmap archive is needed")
+        logging.basicConfig(level=logging.INFO)
+        if os.path.exists(args.archive):
+            heatmap = Heatmap.load(args.archive)
+        else:
+            heatmap = Heatmap(zooms=args.zoom or (10, 12, 14))
+        added = heatmap.add_files(
+            track_analyzer.expand_track_paths(args.paths), args.workers
+        )
+        heatmap.save(args.archive)
+        logging.info(f"added {added} tracks")
+        if args.tiles:
+            heatmap.write_png_tiles(args.tiles)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)
@@ -0,0 +1,878 @@
+#! /usr/bin/env python3
+"""
+    track_library: keep the results of analysing tracks so they don't have
+    to be worked out again each time a notebook is opened
+"""
+__module__ = "track_library"
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+import argparse
+import collections
+import datetime
+import gpxpy.geo
+import numpy as np
+import pandas as pd
+
+import track_analyzer
+
+
+def cluster_places(lat, lon, radius=200.0):
+    """
+    group points lying together, such as where tracks start and finish.
+    Points are snapped to a grid of cells half of radius (metres) across, and
+    neighbouring occupied cells (diagonals included) are joined into one
+    place so long as the centres of their points stay within radius of each
+    other, so a line of cells can't chain far apart points together.
+    Clustering costs a single pass over the occupied cells, busiest first.
+    returns : an array of the place number of each point, numbered from the
+    place with the most points down
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    if lat.shape[0] == 0:
+        return np.zeros(0, dtype=int)
+    cell = radius / 2
+    # longitude is scaled as at the latitude furthest from the equator, so
+    # cells are never narrower than cell metres, wherever the points are
+    scale = max(np.cos(np.radians(np.abs(lat).max())), 0.01)
+    rows = np.floor(lat * gpxpy.geo.ONE_DEGREE / cell)
+    cols = np.floor(lon * gpxpy.geo.ONE_DEGREE * scale / cell)
+    (cells, cell_of_point) = np.unique(
+        np.column_stack((rows, cols)).astype(np.int64), axis=0, return_inverse=True
+    )
+    cell_of_point = cell_of_point.ravel()
+    index = {tuple(occupied): n for n, occupied in enumerate(cells.tolist())}
+    parent = list(range(len(index)))
+    # the point count and coordinate sums of each place, kept at its root
+    count = np.bincount(cell_of_point).astype(float)
+    sum_lat = np.bincount(cell_of_point, lat)
+    sum_lon = np.bincount(cell_of_point, lon)
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    def join(n, other):
+        (root, other_root) = (find(n), find(other))
+        if root == other_root:
+            return
+        apart = track_analyzer.equirectangular(
+            sum_lat[root] / count[root],
+            sum_lon[root] / count[root],
+            sum_lat[other_root] / count[other_root],
+            sum_lon[other_root] / count[other_root],
+        )
+        if apart <= radius:
+            parent[other_root] = root
+            count[root] += count[other_root]
+            sum_lat[root] += sum_lat[other_root]
+            sum_lon[root] += sum_lon[other_root]
+
+    for n in np.argsort(-count, kind="stable").tolist():
+        (row, col) = cells[n].tolist()
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                other = index.get((row + d_row, col + d_col))
+                if other is not None:
+                    join(n, other)
+    roots = np.array([find(n) for n in range(len(parent))])[cell_of_point]
+    (unused, labels, counts) = np.unique(roots, return_inverse=True, return_counts=True)
+    rank = np.empty_like(counts)
+    rank[np.argsort(-counts, kind="stable")] = np.arange(counts.shape[0])
+    return rank[labels.ravel()]
+
+
+def track_day(when):
+    """
+    the day of a date, datetime, pd.Timestamp or iso format string, as a tz
+    naive pd.Timestamp at midnight so that any of them can be compared
+    """
+    day = pd.Timestamp(when)
+    if day.tzinfo is not None:
+        day = day.tz_localize(None)
+    return day.normalize()
+
+
+class Places:
+    """
+    The places tracks start and finish: the centre of each and the number of
+    track ends there, numbered as by cluster_places(), and the names given to
+    some of them.  Names are kept with their coordinates rather than a place
+    number, so they survive the places being clustered again.
+    """
+
+    def __init__(self, radius=200.0, centres=(), names=None):
+        self.radius = radius
+        self.centres = [list(centre) for centre in centres]  # [lat, lon, count]
+        self.names = dict(names or {})  # name -> [lat, lon]
+
+    def to_dict(self):
+        """
+        a json friendly dict, which from_dict() turns back into Places
+        """
+        return {"radius": self.radius, "centres": self.centres, "names": self.names}
+
+    @classmethod
+    def from_dict(cls, places):
+        """
+        the Places saved by to_dict()
+        """
+        return cls(places["radius"], places["centres"], places["names"])
+
+    def near(self, lat, lon):
+        """
+        the place numbers whose centres are within radius of a point, nearest
+        first
+        """
+        if not self.centres:
+            return []
+        centres = np.array(self.centres)
+        distance = track_analyzer.equirectangular(
+            centres[:, 0], centres[:, 1], lat, lon
+        )
+        nearby = np.flatnonzero(distance <= self.radius)
+        return [int(n) for n in nearby[np.argsort(distance[nearby])]]
+
+    def assign(self, lat, lon):
+        """
+        the number of the place a track end belongs to: the nearest within
+        radius, whose centre is moved towards it, or else a new place
+        """
+        nearby = self.near(lat, lon)
+        if not nearby:
+            self.centres.append([lat, lon, 1])
+            return len(self.centres) - 1
+        centre = self.centres[nearby[0]]
+        centre[2] += 1
+        centre[0] += (lat - centre[0]) / centre[2]
+        centre[1] += (lon - centre[1]) / centre[2]
+        return nearby[0]
+
+    def withdraw(self, place, lat, lon):
+        """
+        undo assign() of a track end to a place, as when its track is stored
+        again.  A place left with no track ends keeps its number.
+        """
+        centre = self.centres[place]
+        if centre[2] > 1:
+            centre[0] -= (lat - centre[0]) / (centre[2] - 1)
+            centre[1] -= (lon - centre[1]) / (centre[2] - 1)
+        centre[2] = max(centre[2] - 1, 0)
+
+    def lookup(self, place):
+        """
+        the place numbers meant by a place number or name
+        """
+        if place in self.names:
+            return set(self.near(*self.names[place]))
+        if isinstance(place, int) or str(place).isdigit():
+            return {int(place)}
+        raise KeyError(f"no place called {place}")
+
+    def label(self, number):
+        """
+        the name of a place if it has one, otherwise its number
+        """
+        for name in self.names:
+            if number in self.lookup(name):
+                return name
+        return number
+
+
+class TrackLibrary:
+    """
+    A directory of json summaries, one per track file.  Each record remembers
+    the size and modification time of the file it was built from, so a
+    changed file is noticed and processed again.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        the cache directory is created if it isn't already there
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.originals = None  # fingerprint key -> path, built when first needed
+        self.places = None  # the Places, loaded when first needed
+        self.logger = logging.getLogger(__name__)
+
+    # where the Places are kept amongst the records
+    PLACES_FILE = "places.json"
+
+    def _record_path(self, filename):
+        """
+        records are named after a hash of the track's absolute path, which
+        keeps them unique whichever directory the track lives in
+        """
+        key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @staticmethod
+    def source_info(filename):
+        """
+        the details of the track file which tell us whether it has changed
+        """
+        stat = os.stat(filename)
+        return {
+            "path": os.path.abspath(filename),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+
+    def is_current(self, filename):
+        """
+        true if there is a record for the file and the file hasn't changed
+        since it was made
+        """
+        record = self.load(filename)
+        if record is None:
+            return False
+        try:
+            return record["source"] == self.source_info(filename)
+        except FileNotFoundError:
+            return False
+
+    def _write_json(self, path, value):
+        """
+        write to a temporary file and rename it into place, so readers never
+        see half a file
+        """
+        (handle, temp_name) = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(handle, "w", encoding="utf-8") as temp_file:
+            json.dump(value, temp_file)
+        os.replace(temp_name, path)
+
+    def store(self, filename, summary):
+        """
+        persist the summary of a track.  Its start and end are labelled with
+        the places they belong to, as start_place and end_place, having
+        first withdrawn those of any record it replaces.
+        """
+        record = dict(summary)
+        record["source"] = self.source_info(filename)
+        if "start_lat" in record and "duplicate_of" not in record:
+            places = self.load_places()
+            old = self.load(filename)
+            if old is not None and "start_place" in old:
+                places.withdraw(old["start_place"], old["start_lat"], old["start_lon"])
+                places.withdraw(old["end_place"], old["end_lat"], old["end_lon"])
+            record["start_place"] = places.assign(
+                record["start_lat"], record["start_lon"]
+            )
+            record["end_place"] = places.assign(record["end_lat"], record["end_lon"])
+            self.save_places()
+        self._write_json(self._record_path(filename), record)
+        self.logger.debug(f"store() {filename}")
+        if (
+            self.originals is not None
+            and "fingerprint" in record
+            and "duplicate_of" not in record
+        ):
+            key = track_analyzer.fingerprint_key(record["fingerprint"])
+            self.originals.setdefault(key, record["source"]["path"])
+        return record
+
+    def load_places(self):
+        """
+        the Places of the library
+        """
+        if self.places is None:
+            try:
+                with open(
+                    os.path.join(self.cache_dir, self.PLACES_FILE), encoding="utf-8"
+                ) as places_file:
+                    self.places = Places.from_dict(json.load(places_file))
+            except FileNotFoundError:
+                self.places = Places()
+        return self.places
+
+    def save_places(self):
+        """
+        persist the Places
+        """
+        self._write_json(
+            os.path.join(self.cache_dir, self.PLACES_FILE), self.places.to_dict()
+        )
+
+    def name_place(self, name, lat, lon):
+        """
+        name the place at a point, e.g. name_place("home", 51.06, -1.31)
+        """
+        self.load_places().names[name] = [lat, lon]
+        self.save_places()
+
+    def cluster(self, radius=None):
+        """
+        cluster the starts and ends of every track afresh with
+        cluster_places(), relabelling the records whose places change
+        radius: metres, defaulting to that of the current Places
+        returns : the new Places
+        """
+        names = self.load_places().names
+        radius = radius or self.places.radius
+        records = [record for record in self.records() if "start_lat" in record]
+        ends = len(records)
+        lat = np.array(
+            [record["start_lat"] for record in records]
+            + [record["end_lat"] for record in records]
+        )
+        lon = np.array(
+            [record["start_lon"] for record in records]
+            + [record["end_lon"] for record in records]
+        )
+        labels = cluster_places(lat, lon, radius)
+        counts = np.bincount(labels)
+        centres = np.column_stack(
+            (
+                np.bincount(labels, lat) / np.maximum(counts, 1),
+                np.bincount(labels, lon) / np.maximum(counts, 1),
+                counts,
+            )
+        )
+        self.places = Places(
+            radius,
+            [
+                [mid_lat, mid_lon, int(count)]
+                for (mid_lat, mid_lon, count) in centres.tolist()
+            ],
+            names,
+        )
+        self.save_places()
+        for n, record in enumerate(records):
+            places = (int(labels[n]), int(labels[ends + n]))
+            if (record.get("start_place"), record.get("end_place")) != places:
+                (record["start_place"], record["end_place"]) = places
+                self._write_json(self._record_path(record["source"]["path"]), record)
+        return self.places
+
+    def route_records(self, start=None, end=None, activity_type=None):
+        """
+        the records of the tracks starting and ending at the given places
+        (numbers or names, see name_place()), e.g.
+        route_records("home", "river", "run")
+        """
+        places = self.load_places()
+        starts = places.lookup(start) if start is not None else None
+        ends = places.lookup(end) if end is not None else None
+        for record in self.records():
+            if (
+                activity_type is not None
+                and record.get("activity_type") != activity_type
+            ):
+                continue
+            if starts is not None and record.get("start_place") not in starts:
+                continue
+            if ends is not None and record.get("end_place") not in ends:
+                continue
+            yield record
+
+    def find_duplicate(self, filename, fingerprint):
+        """
+        the path of another track in the library with the same fingerprint
+        (see track_analyzer.track_fingerprint()), or None
+        """
+        if self.originals is None:
+            self.originals = {}
+            for record in self.records():
+                if "fingerprint" in record:
+                    key = track_analyzer.fingerprint_key(record["fingerprint"])
+                    self.originals.setdefault(key, record["source"]["path"])
+        original = self.originals.get(track_analyzer.fingerprint_key(fingerprint))
+        if original is None or original == os.path.abspath(filename):
+            return None
+        return original
+
+    def link_duplicate(self, filename, original, fingerprint):
+        """
+        record that a track is a copy of one already in the library, instead
+        of analysing it again
+        """
+        return self.store(
+            filename,
+            {
+                "filename": str(filename),
+                "duplicate_of": original,
+                "fingerprint": fingerprint,
+            },
+        )
+
+    def load(self, filename):
+        """
+        return the record for a track file, or None if there isn't one
+        """
+        try:
+            with open(self._record_path(filename), encoding="utf-8") as record_file:
+                return json.load(record_file)
+        except FileNotFoundError:
+            return None
+
+    def records(self, include_duplicates=False):
+        """
+        an iterator over every record in the library, leaving out those
+        linking a copy to its original unless include_duplicates
+        """
+        for entry in sorted(os.listdir(self.cache_dir)):
+            if entry.endswith(".json") and entry != self.PLACES_FILE:
+                with open(
+                    os.path.join(self.cache_dir, entry), encoding="utf-8"
+                ) as record_file:
+                    record = json.load(record_file)
+                if include_duplicates or "duplicate_of" not in record:
+                    yield record
+
+    def merged_sketch(
+        self, quantity, activity_type=None, start_date=None, end_date=None
+    ):
+        """
+        merge the sketches of quantity (see TrackData.SKETCH_RANGES) of every
+        track of the activity type whose start date lies within the
+        (inclusive) range.  The dates may be anything track_day() takes, and
+        only their day counts.  Tracks stored without sketches are left out.
+        returns : a track_analyzer.LogHistogram
+        """
+        (low, high) = track_analyzer.TrackData.SKETCH_RANGES[quantity]
+        merged = track_analyzer.LogHistogram(low, high)
+        start_date = None if start_date is None else track_day(start_date)
+        end_date = None if end_date is None else track_day(end_date)
+        for record in self.records():
+            sketch = record.get("sketches", {}).get(quantity)
+            if sketch is None:
+                continue
+            if activity_type is not None and record["activity_type"] != activity_type:
+                continue
+            track_date = track_day(record["start_time"][:10])
+            if start_date is not None and track_date < start_date:
+                continue
+            if end_date is not None and track_date > end_date:
+                continue
+            merged.merge(track_analyzer.LogHistogram.from_dict(sketch))
+        return merged
+
+    def percentiles(self, quantity, qs=(5, 50, 95), **selection):
+        """
+        library wide percentiles of speed, pace or heart rate, e.g.
+        percentiles("pace", (50,), activity_type="run") for a typical run
+        pace.  selection is passed on to merged_sketch().
+        returns : a dict of percentile -> value
+        """
+        merged = self.merged_sketch(quantity, **selection)
+        return {q: merged.percentile(q) for q in qs}
+
+
+class LoadedTracks:
+    """
+    Slurped tracks held in memory, e.g. for a notebook working through a
+    season, kept within a memory budget (in bytes, by
+    TrackData.memory_usage() and the track's results held in
+    track_analyzer.ANALYSIS_CACHE).  When the budget is exceeded the least
+    recently used tracks are first downcast and then, if that isn't enough,
+    evicted to be slurped again when next asked for, their cached results
+    going with them.  The most recently used track is always kept.
+    """
+
+    def __init__(self, budget=1 << 30, downcast=True):
+        self.budget = budget
+        self.downcast = downcast
+        self.tracks = collections.OrderedDict()  # filename -> TrackData
+        self.usage = {}  # filename -> bytes
+        self.downcast_tracks = set()
+        self.evictions = 0
+        self.logger = logging.getLogger(__name__)
+
+    def __contains__(self, filename):
+        return filename in self.tracks
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def total(self):
+        """
+        the bytes used by the loaded tracks
+        """
+        return sum(self.usage.values())
+
+    def measure(self, filename):
+        """
+        the bytes used by a loaded track's frames and its cached results
+        """
+        track = self.tracks[filename]
+        cached = track_analyzer.ANALYSIS_CACHE.usage(track.cache_id)
+        self.usage[filename] = track.memory_usage()["total"] + cached
+        return self.usage[filename]
+
+    def get(self, filename):
+        """
+        the TrackData of a file, slurping it if it isn't loaded.  Results
+        cached since the last call count towards the budget from now on.
+        """
+        if filename in self.tracks:
+            self.tracks.move_to_end(filename)
+        else:
+            track = track_analyzer.TrackData()
+            track.slurp(filename)
+            self.tracks[filename] = track
+        self.enforce_budget()
+        return self.tracks[filename]
+
+    def enforce_budget(self):
+        """
+        downcast, then evict, least recently used tracks until the loaded
+        tracks fit in the budget.  Either way the track's cached results are
+        dropped.
+        """
+        for filename in self.tracks:
+            self.measure(filename)
+        if self.downcast:
+            for filename in list(self.tracks)[:-1]:
+                if self.total() <= self.budget:
+                    return
+                if filename not in self.downcast_tracks:
+                    self.tracks[filename].downcast()
+                    self.tracks[filename].invalidate()
+                    self.measure(filename)
+                    self.downcast_tracks.add(filename)
+        while self.total() > self.budget and len(self.tracks) > 1:
+            (filename, track) = self.tracks.popitem(last=False)
+            track.invalidate()
+            del self.usage[filename]
+            self.downcast_tracks.discard(filename)
+            self.evictions += 1
+            self.logger.debug(f"evicted {filename}")
+
+    def report(self):
+        """
+        the memory used by each frame of each loaded track, heaviest first
+        """
+        return track_analyzer.memory_report(self.tracks)
+
+
+def duplicate_clusters(filenames):
+    """
+    group track files which are copies of the same recording, by fingerprint
+    returns : a list of the clusters with more than one file, each a sorted
+    list of file names
+    """
+    clusters = {}
+    for filename in filenames:
+        fingerprint = track_analyzer.track_fingerprint(filename)
+        clusters.setdefault(track_analyzer.fingerprint_key(fingerprint), []).append(
+            filename
+        )
+    return sorted(sorted(cluster) for cluster in clusters.values() if len(cluster) > 1)
+
+
+class TestStuff(unittest.TestCase):
+    """
+    exercise the library against a temporary directory
+    """
+
+    def test_00(self):
+        """
+        a stored record can be loaded back and is current until the track
+        file changes
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            track_file = os.path.join(tmp_dir, "track.gpx")
+            with open(track_file, "w", encoding="utf-8") as out:
+                out.write("<gpx/>")
+            library = TrackLibrary(os.path.join(tmp_dir, "cache"))
+            self.assertFalse(library.is_current(track_file))
+            library.store(track_file, {"activity_type": "run"})
+            self.assertTrue(library.is_current(track_file))
+            self.assertEqual(library.load(track_file)["activity_type"], "run")
+            self.assertEqual(len(list(library.records())), 1)
+            with open(track_file, "a", encoding="utf-8") as out:
+                out.write("\n")
+            self.assertFalse(library.is_current(track_file))
+
+    def test_01(self):
+        """
+        copies of a track are clustered, and linked to the original in the
+        library
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            names = [
+                track_analyzer.synthetic_gpx(os.path.join(tmp_dir, name))
+                for name in ["2021-03-06_07-59_Sat.gpx", "Parkrun.gpx"]
+            ]
+            other = track_analyzer.synthetic_gpx(
+                os.path.join(tmp_dir, "other.gpx"), speed=4
+            )
+            self.assertEqual(duplicate_clusters(names + [other]), [sorted(names)])
+
+            library = TrackLibrary(os.path.join(tmp_dir, "cache"))
+            fingerprint = track_analyzer.track_fingerprint(names[0])
+            self.assertIsNone(library.find_duplicate(names[0], fingerprint))
+            library.store(names[0], {"fingerprint": fingerprint})
+            self.assertIsNone(library.find_duplicate(names[0], fingerprint))
+            original = library.find_duplicate(names[1], fingerprint)
+            self.assertEqual(original, os.path.abspath(names[0]))
+            library.link_duplicate(names[1], original, fingerprint)
+            self.assertEqual(len(list(library.records())), 1)
+            self.assertEqual(len(list(library.records(include_duplicates=True))), 2)
+
+    def test_02(self):
+        """
+        percentiles are taken over the sketches of the selected tracks, and
+        tracks stored without sketches are left out
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            library = TrackLibrary(os.path.join(tmp_dir, "cache"))
+            for name, speed, day in [("a", 3.0, 1), ("b", 3.5, 2), ("c", 9, 3)]:
+                filename = track_analyzer.synthetic_gpx(
+                    os.path.join(tmp_dir, f"{name}.gpx"),
+                    speed=speed,
+                    start=datetime.datetime(
+                        2023, 7, day, 10, tzinfo=datetime.timezone.utc
+                    ),
+                )
+                summary = track_analyzer.summarise_track(filename, sketches=name != "a")
+                summary["activity_type"] = "cycle" if speed > 5 else "run"
+                library.store(filename, summary)
+
+            runs = library.percentiles("speed", (50,), activity_type="run")
+            self.assertAlmostEqual(runs[50], 3.5, delta=0.05)
+            rides = library.merged_sketch("speed", activity_type="cycle")
+            self.assertEqual(rides.count(), 599)
+            self.assertAlmostEqual(rides.percentile(95), 9, delta=0.1)
+            self.assertEqual(
+                library.merged_sketch(
+                    "speed", start_date=datetime.date(2023, 7, 3)
+                ).count(),
+                599,
+            )
+            self.assertIsNone(
+                library.percentiles("speed", end_date=datetime.date(2023, 7, 1))[50]
+            )
+            # any kind of date will do, and only its day counts
+            for start_date, end_date in [
+                ("2023-07-02", "2023-07-02"),
+                (datetime.datetime(2023, 7, 2, 23), pd.Timestamp("2023-07-02 01:00")),
+                (pd.Timestamp("2023-07-02", tz="UTC"), datetime.date(2023, 7, 2)),
+            ]:
+                self.assertEqual(
+                    library.merged_sketch("speed", None, start_date, end_date).count(),
+                    599,
+                )
+
+    def test_03(self):
+        """
+        loaded tracks are downcast and then evicted, least recently used
+        first, to stay within the budget
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            names = [
+                track_analyzer.synthetic_gpx(os.path.join(tmp_dir, f"{n}.gpx"))
+                for n in range(3)
+            ]
+            loaded = LoadedTracks(budget=10**9)
+            track = loaded.get(names[0])
+            self.assertIs(loaded.get(names[0]), track)
+            size = loaded.total()
+
+            loaded = LoadedTracks(budget=int(2.9 * size))
+            for name in names:
+                loaded.get(name)
+            self.assertEqual(len(loaded), 3)
+            self.assertEqual(loaded.downcast_tracks, {names[0]})
+            self.assertLessEqual(loaded.total(), loaded.budget)
+
+            loaded.get(names[0])  # names[1] is now the least recently used
+            loaded.budget = int(1.5 * size)
+            loaded.enforce_budget()
+            self.assertEqual(list(loaded.tracks), [names[2], names[0]])
+            self.assertEqual(loaded.evictions, 1)
+            self.assertEqual(sorted(loaded.report().index), sorted(loaded.tracks))
+
+            # cached results count, and go when their track does
+            loaded = LoadedTracks(budget=10**9)
+            track = loaded.get(names[0])
+            cache_id = track.cache_id
+            track.build_distance_list(track_analyzer.Distance >= 100)
+            frames = loaded.total()
+            loaded.get(names[1])
+            self.assertGreater(loaded.usage[names[0]], frames)
+            loaded.budget = loaded.usage[names[1]]
+            loaded.enforce_budget()
+            self.assertEqual(list(loaded.tracks), [names[1]])
+            self.assertEqual(track_analyzer.ANALYSIS_CACHE.usage(cache_id), 0)
+
+    def test_04(self):
+        """
+        track ends are labelled with places as they are stored, clustering
+        afresh agrees, and routes can be picked out by place name
+        """
+        home = (51.0, -1.3)
+        river = (51.02, -1.28)
+        parkrun = (51.05, -1.35)
+        rng = np.random.default_rng(1)
+        routes = [(home, river, "run")] * 3 + [(home, home, "run")] * 2
+        routes += [(parkrun, parkrun, "run"), (home, river, "cycle")]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            library = TrackLibrary(os.path.join(tmp_dir, "cache"))
+            for n, (start, end, activity_type) in enumerate(routes):
+                track_file = os.path.join(tmp_dir, f"{n}.gpx")
+                with open(track_file, "w", encoding="utf-8") as out:
+                    out.write("<gpx/>")
+                # within 30 m or so of the place
+                (start_lat, start_lon) = np.array(start) + rng.normal(0, 0.0002, 2)
+                (end_lat, end_lon) = np.array(end) + rng.normal(0, 0.0002, 2)
+                record = library.store(
+                    track_file,
+                    {
+                        "activity_type": activity_type,
+                        "start_lat": start_lat,
+                        "start_lon": start_lon,
+                        "end_lat": end_lat,
+                        "end_lon": end_lon,
+                    },
+                )
+                if n == 0:
+                    self.assertEqual(
+                        (record["start_place"], record["end_place"]), (0, 1)
+                    )
+            self.assertEqual(len(library.load_places().centres), 3)
+            self.assertEqual(library.places.centres[0][2], 8)  # home
+
+            # storing a track again replaces its ends rather than adding them
+            centres = [list(centre) for centre in library.places.centres]
+            first = library.load(os.path.join(tmp_dir, "0.gpx"))
+            summary = {key: first[key] for key in first if key != "source"}
+            for unused in range(2):
+                record = library.store(os.path.join(tmp_dir, "0.gpx"), summary)
+            self.assertEqual((record["start_place"], record["end_place"]), (0, 1))
+            np.testing.assert_allclose(library.places.centres, centres)
+
+            library.name_place("home", *home)
+            library.name_place("river", *river)
+            runs = list(library.route_records("home", "river", "run"))
+            self.assertEqual(len(runs), 3)
+            self.assertEqual(len(list(library.route_records(start="home"))), 6)
+            self.assertEqual(library.places.label(1), "river")
+            with self.assertRaises(KeyError):
+                list(library.route_records("work"))
+
+            before = {record["source"]["path"]: record for record in library.records()}
+            places = TrackLibrary(os.path.join(tmp_dir, "cache")).cluster()
+            self.assertEqual([centre[2] for centre in places.centres], [8, 4, 2])
+            self.assertEqual(list(library.records()), list(before.values()))
+            self.assertEqual(places.label(0), "home")
+
+            # a wide radius merges the river with home
+            library.cluster(radius=5000)
+            self.assertEqual(len(library.places.centres), 2)
+            self.assertEqual(len(list(library.route_records("home", "home"))), 6)
+
+        labels = cluster_places(
+            rng.uniform(50, 52, 10000), rng.uniform(-2, 0, 10000), 200
+        )
+        self.assertEqual(labels.shape, (10000,))
+        self.assertTrue((np.bincount(labels)[:-1] >= np.bincount(labels)[1:]).all())
+
+        # a line of points 50 m apart is split up, not chained into one place
+        lat = 51.0 + np.arange(100) * 50 / gpxpy.geo.ONE_DEGREE
+        labels = cluster_places(lat, np.full(100, -1.3), 200)
+        self.assertGreater(labels.max(), 5)
+        for place in range(labels.max() + 1):
+            spread = np.ptp(lat[labels == place]) * gpxpy.geo.ONE_DEGREE
+            self.assertLessEqual(spread, 2 * 200)
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument(
+        "--duplicates",
+        help="report clusters of copies of the same recording amongst paths",
+        action="store_true",
+    )
+    parser.add_argument("--library", help="track library directory")
+    parser.add_argument(
+        "--percentiles",
+        help="print the 5th, 50th and 95th percentiles of a quantity",
+        choices=list(track_analyzer.TrackData.SKETCH_RANGES),
+    )
+    parser.add_argument("--activity", help="only tracks of this activity type")
+    parser.add_argument(
+        "--start", help="first track date, yyyy-mm-dd", type=pd.to_datetime
+    )
+    parser.add_argument(
+        "--end", help="last track date, yyyy-mm-dd", type=pd.to_datetime
+    )
+    parser.add_argument(
+        "--places",
+        help="cluster the starts and ends of the tracks and list the places",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--radius", help="metres across which a place spreads", type=float
+    )
+    parser.add_argument("--start-place", help="list tracks starting here")
+    parser.add_argument("--end-place", help="list tracks ending here")
+    parser.add_argument(
+        "paths", help="track files, directories or globs", type=str, nargs="*"
+    )
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    elif args.duplicates:
+        for cluster in duplicate_clusters(
+            track_analyzer.expand_track_paths(args.paths)
+        ):
+            print(" ".join(cluster))
+    elif args.library is None and (
+        args.places
+        or args.start_place is not None
+        or args.end_place is not None
+        or args.percentiles
+    ):
+        parser.error(
+            "--places, --start-place, --end-place and --percentiles need a --library"
+        )
+    elif args.places:
+        places = TrackLibrary(args.library).cluster(args.radius)
+        for number, (lat, lon, count) in enumerate(places.centres):
+            print(f"{places.label(number)}: {lat:.5f} {lon:.5f} {count} track ends")
+    elif args.start_place is not None or args.end_place is not None:
+        library = TrackLibrary(args.library)
+        for record in library.route_records(
+            args.start_place, args.end_place, args.activity
+        ):
+            print(record["source"]["path"])
+    elif args.percentiles:
+        library = TrackLibrary(args.library)
+        for q, value in library.percentiles(
+            args.percentiles,
+            activity_type=args.activity,
+            start_date=args.start,
+            end_date=args.end,
+        ).items():
+            print(f"{q}%: {value}")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)
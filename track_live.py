@@ -0,0 +1,436 @@
+#! /usr/bin/env python3
+"""
+    track_live: follow a track as its points arrive, from OSMAnd's online
+    tracking or from replaying a recording
+"""
+__module__ = "track_live"
+
+import collections
+import datetime
+import http.server
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+import urllib.request
+
+import argparse
+import gpxpy
+import gpxpy.geo
+
+import track_analyzer
+
+
+class LiveTrack:
+    """
+    The running analysis of a track fed a point (or a small batch of points)
+    at a time.  Moving time and distance use the same stop removal as
+    TrackData.zero_tdiff_of_slow_point(), track_analyzer.stopped(), the
+    activity guess the same
+    likelihoods as TrackData.guess_activity_type() and the best efforts the
+    same windows as TrackData.best_effort(), all updated in constant time
+    per point (amortized, for the best efforts).
+
+    Each best effort keeps a deque of the cumulative distance and moving time
+    at the points which could still start the quickest effort ending at the
+    latest point.  The deque only ever drops from the front as the track
+    grows, so each point is added and removed once.
+    """
+
+    def __init__(self, best_efforts=(1000, 5000, 10000)):
+        """
+        best_efforts: distances in metres to find the quickest stretch for
+        """
+        self.best_efforts = tuple(best_efforts)
+        self.logger = logging.getLogger(__name__)
+        self.points = 0
+        self.segments = 0
+        self.first_point = None
+        self.last_point = None  # (SegNo, Latitude, Longitude, Altitude, Time)
+        self.cum_dist = 0.0
+        self.cum_secs = 0.0
+        self.elapsed_time = 0.0
+        # likelihood totals of the finished segments and the moving distance
+        # and time of the current one
+        self.finished_scores = dict.fromkeys(track_analyzer.ACTIVITY_LIKELIHOODS, 0.0)
+        self.segment_distance = 0.0
+        self.segment_secs = 0.0
+        # distance -> deque of (cum_dist, cum_secs, time) of candidate starts
+        self.starts = {distance: collections.deque() for distance in self.best_efforts}
+        self.best = dict.fromkeys(self.best_efforts)  # -> (start time, secs)
+
+    def add_point(self, when, latitude, longitude, altitude=None, seg_no=0):
+        """
+        fold the next point into the running totals.  when is a datetime or
+        seconds since the epoch, and a change of seg_no starts a new segment.
+        """
+        if isinstance(when, datetime.datetime):
+            when = when.timestamp()
+        point = (seg_no, latitude, longitude, altitude, float(when))
+        previous = self.last_point
+        if previous is None or previous[0] != seg_no:
+            if previous is not None:
+                self.finish_segment()
+            self.segments += 1
+            delta_dist = 0.0
+            tdiff = 0.0
+        else:
+            delta_dist = gpxpy.geo.distance(
+                previous[1], previous[2], None, latitude, longitude, None
+            )
+            tdiff = point[4] - previous[4]
+        if self.first_point is None:
+            self.first_point = point
+        self.last_point = point
+        self.points += 1
+
+        moving_tdiff = 0.0 if track_analyzer.stopped(delta_dist, tdiff) else tdiff
+        self.elapsed_time += tdiff
+        self.cum_dist += delta_dist
+        self.cum_secs += moving_tdiff
+        self.segment_distance += delta_dist
+        self.segment_secs += moving_tdiff
+        self.add_best_efforts(point[4])
+
+    def add_points(self, points):
+        """
+        add a batch of (when, latitude, longitude, altitude, seg_no) tuples
+        """
+        for point in points:
+            self.add_point(*point)
+
+    def add_best_efforts(self, when):
+        """
+        the quickest effort of each distance ending at the latest point starts
+        at the last point at least that distance back.  Earlier starts can
+        never beat it again, so they are dropped from the deque.
+        """
+        for distance, starts in self.starts.items():
+            starts.append((self.cum_dist, self.cum_secs, when))
+            # a window is long enough exactly as TrackData.window_ends()
+            # decides, start distance + distance <= end distance
+            while len(starts) > 1 and starts[1][0] + distance <= self.cum_dist:
+                starts.popleft()
+            if starts[0][0] + distance <= self.cum_dist:
+                secs = self.cum_secs - starts[0][1]
+                if self.best[distance] is None or secs < self.best[distance][1]:
+                    self.best[distance] = (starts[0][2], secs)
+
+    @staticmethod
+    def segment_scores(distance, secs):
+        """
+        the walk, run and cycle likelihoods of a segment, as summed by
+        TrackData.guess_activity_type()
+        """
+        speed = distance / secs if secs > 0 else 0.0
+        return {
+            activity: from_speed(speed) + from_distance(distance)
+            for (
+                activity,
+                (from_speed, from_distance),
+            ) in track_analyzer.ACTIVITY_LIKELIHOODS.items()
+        }
+
+    def finish_segment(self):
+        """
+        add the likelihoods of the segment just ended to the totals
+        """
+        scores = LiveTrack.segment_scores(self.segment_distance, self.segment_secs)
+        for activity, score in scores.items():
+            self.finished_scores[activity] += score
+        self.segment_distance = 0.0
+        self.segment_secs = 0.0
+
+    def activity_type(self):
+        """
+        the current guess at the activity, over the segments so far
+        """
+        if self.last_point is None:
+            return "undetermined"
+        scores = LiveTrack.segment_scores(self.segment_distance, self.segment_secs)
+        return track_analyzer.pick_activity(
+            *(
+                self.finished_scores[activity] + scores[activity]
+                for activity in ("walk", "run", "cycle")
+            )
+        )
+
+    def snapshot(self):
+        """
+        the state of the track so far as a dict of plain values, with the
+        same keys as TrackData.summary() where they are available
+        """
+        if self.last_point is None:
+            return {"points": 0}
+        moving_distance = float(self.cum_dist)
+        moving_time = float(self.cum_secs)
+        snapshot = {
+            "start_time": datetime.datetime.fromtimestamp(
+                self.first_point[4], datetime.timezone.utc
+            ).isoformat(),
+            "last_time": datetime.datetime.fromtimestamp(
+                self.last_point[4], datetime.timezone.utc
+            ).isoformat(),
+            "segments": self.segments,
+            "points": self.points,
+            "moving_distance": moving_distance,
+            "moving_time": moving_time,
+            "elapsed_time": float(self.elapsed_time),
+            "avg_secs_per_km": (
+                moving_time / moving_distance * 1000 if moving_distance > 0 else 0
+            ),
+            "activity_type": self.activity_type(),
+            "end_lat": float(self.last_point[1]),
+            "end_lon": float(self.last_point[2]),
+        }
+        for distance, best in self.best.items():
+            snapshot[f"best_{distance:g}m"] = (
+                float(best[1]) if best is not None else None
+            )
+        return snapshot
+
+
+class LiveFeed(http.server.ThreadingHTTPServer):
+    """
+    A local stand in for an OSMAnd online tracking server.  OSMAnd is set up
+    with a url such as
+    http://127.0.0.1:8765/?lat={0}&lon={1}&timestamp={2}&altitude={4}
+    and each request adds a point to the LiveTrack.  A GET of /snapshot
+    returns the current snapshot as json.
+    """
+
+    def __init__(self, live_track, address=("127.0.0.1", 0)):
+        self.live_track = live_track
+        self.lock = threading.Lock()  # requests are handled on threads
+        super().__init__(address, LiveFeedHandler)
+
+    def snapshot(self):
+        """
+        the live track's snapshot, safe to call while points arrive
+        """
+        with self.lock:
+            return self.live_track.snapshot()
+
+
+class LiveFeedHandler(http.server.BaseHTTPRequestHandler):
+    """
+    turn OSMAnd's tracking requests into points
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        a point, or a request for the snapshot
+        """
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/snapshot":
+            body = json.dumps(self.server.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            point = (
+                float(query["timestamp"][0]) / 1000,  # OSMAnd sends ms
+                float(query["lat"][0]),
+                float(query["lon"][0]),
+                float(query["altitude"][0]) if "altitude" in query else None,
+                int(query.get("segment", ["0"])[0]),
+            )
+        except (KeyError, ValueError):
+            logging.getLogger(__name__).debug(f"bad point {self.path}")
+            self.send_error(400, "lat, lon and timestamp are needed")
+            return
+        with self.server.lock:
+            self.server.live_track.add_point(*point)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.getLogger(__name__).debug(format % args)
+
+
+def replay(filename, url, speedup=10.0):
+    """
+    send the points of a recorded track to an OSMAnd style tracking url,
+    sleeping between them for the recorded time divided by speedup.  The
+    segment number is sent too, which OSMAnd itself doesn't.
+    returns : the number of points sent
+    """
+    sent = 0
+    previous = None
+    for chunk in track_analyzer.iter_point_chunks(filename):
+        for seg_no, lat, lon, altitude, when in zip(
+            chunk["SegNo"].tolist(),
+            chunk["Latitude"].tolist(),
+            chunk["Longitude"].tolist(),
+            chunk["Altitude"].tolist(),
+            chunk["Time"].tolist(),
+        ):
+            if previous is not None and when > previous:
+                time.sleep((when - previous) / speedup)
+            previous = when
+            query = {
+                "lat": lat,
+                "lon": lon,
+                "timestamp": int(round(when * 1000)),
+                "segment": int(seg_no),
+            }
+            if altitude == altitude:  # not nan
+                query["altitude"] = altitude
+            with urllib.request.urlopen(f"{url}?{urllib.parse.urlencode(query)}"):
+                pass
+            sent += 1
+    return sent
+
+
+class TestStuff(unittest.TestCase):
+    """
+    compare the live analysis with the batch one
+    """
+
+    def test_00(self):
+        """
+        points fed one at a time give the same totals and best efforts as
+        slurping the file
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = track_analyzer.synthetic_gpx(
+                os.path.join(tmp_dir, "t.gpx"), points=400, segments=2, speed=4
+            )
+            track = track_analyzer.TrackData()
+            track.slurp(filename)
+            live = LiveTrack(best_efforts=(1000, 2000, 5000))
+            for chunk in track_analyzer.iter_point_chunks(filename, chunk_points=7):
+                live.add_points(
+                    zip(
+                        chunk["Time"].tolist(),
+                        chunk["Latitude"].tolist(),
+                        chunk["Longitude"].tolist(),
+                        chunk["Altitude"].tolist(),
+                        chunk["SegNo"].tolist(),
+                    )
+                )
+        snapshot = live.snapshot()
+        summary = track.summary()
+        self.assertEqual(snapshot["points"], 800)
+        self.assertEqual(snapshot["segments"], 2)
+        for key in ["moving_distance", "moving_time", "elapsed_time"]:
+            self.assertAlmostEqual(snapshot[key], summary[key], places=6)
+        self.assertEqual(snapshot["activity_type"], track.guess_activity_type())
+        for distance in [1000, 2000]:
+            self.assertAlmostEqual(
+                snapshot[f"best_{distance}m"],
+                track.best_effort(distance)["moving_time"],
+            )
+        self.assertIsNone(snapshot["best_5000m"])
+        self.assertEqual(len(live.starts[5000]), 800)
+        self.assertLess(len(live.starts[1000]), 260)
+
+    def test_01(self):
+        """
+        a recording with stops, replayed through the local feed at high
+        speed, agrees with slurping it, including an effort over the whole
+        track which ends on its final point
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = track_analyzer.synthetic_gpx(
+                os.path.join(tmp_dir, "t.gpx"), points=300, segments=2, speed=10
+            )
+            with open(filename, encoding="utf-8") as gpx_file:
+                gpx = gpxpy.parse(gpx_file)
+            for segment in gpx.tracks[0].segments:
+                for n in range(7, len(segment.points), 7):
+                    # stopped for a while, then catching up
+                    segment.points[n].latitude = segment.points[n - 1].latitude
+            with open(filename, "w", encoding="utf-8") as gpx_file:
+                gpx_file.write(gpx.to_xml())
+            track = track_analyzer.TrackData()
+            track.slurp(filename)
+            whole = track.summary()["moving_distance"] - 1e-6
+            feed = LiveFeed(LiveTrack(best_efforts=(1000, whole)))
+            server = threading.Thread(target=feed.serve_forever, daemon=True)
+            server.start()
+            try:
+                url = f"http://127.0.0.1:{feed.server_address[1]}/"
+                self.assertEqual(replay(filename, url, speedup=1e6), 600)
+                with urllib.request.urlopen(f"{url}snapshot") as response:
+                    snapshot = json.loads(response.read())
+            finally:
+                feed.shutdown()
+                feed.server_close()
+        summary = track.summary()
+        self.assertEqual(snapshot["points"], 600)
+        self.assertEqual(snapshot["activity_type"], track.guess_activity_type())
+        for key in ["moving_distance", "moving_time", "elapsed_time"]:
+            self.assertAlmostEqual(snapshot[key], summary[key], places=3)
+        self.assertLess(summary["moving_time"], summary["elapsed_time"] - 50)
+        for distance in [1000, whole]:
+            self.assertAlmostEqual(
+                snapshot[f"best_{distance:g}m"],
+                track.best_effort(distance)["moving_time"],
+            )
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    will follow an OSMAnd live track, replay a recording to a feed, or run
+    unit tests
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument(
+        "--port", help="port to listen for OSMAnd on", type=int, default=8765
+    )
+    parser.add_argument("--replay", help="gpx file to send to the feed at --url")
+    parser.add_argument(
+        "--url", help="feed to replay to", default="http://127.0.0.1:8765/"
+    )
+    parser.add_argument(
+        "--speedup", help="replay this many times faster", type=float, default=10.0
+    )
+    parser.add_argument(
+        "--best-effort",
+        help="distance in metres to follow the best effort for, may be repeated",
+        type=float,
+        action="append",
+        dest="best_efforts",
+    )
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    elif args.replay:
+        replay(args.replay, args.url, args.speedup)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        feed = LiveFeed(
+            LiveTrack(args.best_efforts or (1000, 5000, 10000)),
+            ("127.0.0.1", args.port),
+        )
+        logging.info(f"listening on http://127.0.0.1:{args.port}/")
+        feed.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)
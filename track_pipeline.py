@@ -0,0 +1,477 @@
+#! /usr/bin/env python3
+"""
+    track_pipeline: ingest tracks through stages joined by bounded queues, so
+    reading files, parsing and analysing them all overlap while a backfill
+    of years of tracks never holds more than a few of them in memory
+"""
+__module__ = "track_pipeline"
+
+import concurrent.futures
+import gzip
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import unittest
+
+import argparse
+import gpxpy
+import pandas as pd
+
+import track_analyzer
+import track_library
+
+DONE = object()  # passed down the queues after the last item
+
+
+class StageError(Exception):
+    """
+    a stage function failed.  It carries the original traceback as text,
+    since not every exception survives being pickled back from a worker
+    process (gpxpy's don't)
+    """
+
+
+def run_guarded(function, item):
+    """
+    call a stage function, turning whatever it raises into a StageError
+    """
+    try:
+        return function(item)
+    except Exception:  # pylint: disable=broad-except
+        raise StageError(traceback.format_exc()) from None
+
+
+class Stage:
+    """
+    One step of a Pipeline: function is applied to each item on a pool of
+    workers, either threads (for I/O bound steps) or processes (for CPU
+    bound ones, when function and the items must pickle).  A function
+    returning None drops the item.
+    """
+
+    def __init__(self, name, function, workers=1, pool="thread"):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"pool must be thread or process, not {pool}")
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.pool = pool
+
+    def executor(self):
+        """
+        a new pool for the stage
+        """
+        if self.pool == "process":
+            # the pipeline's other threads are running, so don't fork
+            return concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return concurrent.futures.ThreadPoolExecutor(
+            self.workers, thread_name_prefix=self.name
+        )
+
+
+class Chain:
+    """
+    several functions applied one after the other, so neighbouring steps can
+    share a worker process and their intermediate results (such as gpxpy
+    objects) never have to be pickled
+    """
+
+    def __init__(self, *functions):
+        self.functions = functions
+
+    def __call__(self, item):
+        for function in self.functions:
+            item = function(item)
+            if item is None:
+                break
+        return item
+
+
+def describe(item):
+    """
+    what to call an item in the log: the file name, for the ingest items
+    """
+    return item[0] if isinstance(item, tuple) else item
+
+
+class Pipeline:
+    """
+    Stages joined by bounded queues.  Each stage has a thread feeding its
+    queue into its pool, with no more than two items per worker in flight,
+    and a stage blocks when the queue after it is full.  So a slow stage
+    holds back the ones before it, rather than items piling up in memory,
+    and at most queue_size + 2 * workers items are held per stage.
+
+    An item whose function raises is logged and dropped, and counted in
+    errors, so one bad file doesn't stop a backfill.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.errors = 0
+        self.errors_lock = threading.Lock()  # errors are counted by each thread
+        self.logger = logging.getLogger(__name__)
+
+    def run(self, items):
+        """
+        feed items through the stages, yielding what comes out of the last
+        one as it arrives (so not necessarily in order)
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]))]
+        for stage, in_queue, out_queue in zip(self.stages, queues, queues[1:]):
+            threads.append(
+                threading.Thread(target=self._drive, args=(stage, in_queue, out_queue))
+            )
+        for thread in threads:
+            thread.daemon = True  # don't hang the interpreter if abandoned
+            thread.start()
+        while True:
+            item = queues[-1].get()
+            if item is DONE:
+                break
+            yield item
+        for thread in threads:
+            thread.join()
+
+    def count_error(self):
+        """
+        count an item which failed
+        """
+        with self.errors_lock:
+            self.errors += 1
+
+    def _feed(self, items, out_queue):
+        """
+        put the items on the first queue, waiting whenever it's full
+        """
+        try:
+            for item in items:
+                out_queue.put(item)
+        except Exception:  # pylint: disable=broad-except
+            self.count_error()
+            self.logger.exception("failed to list the items")
+        out_queue.put(DONE)
+
+    def _drive(self, stage, in_queue, out_queue):
+        """
+        pass items from in_queue through the stage's pool to out_queue
+        """
+        in_flight = {}  # future -> item
+
+        def pass_on(done):
+            for future in done:
+                item = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    self.count_error()
+                    self.logger.error(
+                        f"{stage.name} failed on {describe(item)}\n{error}"
+                    )
+                    continue
+                if result is not None:
+                    out_queue.put(result)
+
+        with stage.executor() as executor:
+            while True:
+                item = in_queue.get()
+                if item is DONE:
+                    break
+                future = executor.submit(run_guarded, stage.function, item)
+                in_flight[future] = item
+                if len(in_flight) >= 2 * stage.workers:
+                    (done, unused_not_done) = concurrent.futures.wait(
+                        in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    pass_on(done)
+            pass_on(list(concurrent.futures.as_completed(in_flight)))
+        out_queue.put(DONE)
+
+
+# the ingest stages, each taking and returning (filename, ...) tuples
+
+
+def read_track(filename):
+    """
+    read (and decompress) a track file into memory
+    """
+    with track_analyzer.open_track_file(filename) as track_file:
+        return (filename, track_file.read())
+
+
+def parse_track(item):
+    """
+    parse the gpx
+    """
+    (filename, data) = item
+    return (filename, gpxpy.parse(io.BytesIO(data)))
+
+
+def extract_track(item):
+    """
+    extract the points and segments into a TrackData, without a pool of its
+    own since the stage is already running on one
+    """
+    (filename, gpx) = item
+    track = track_analyzer.TrackData()
+    track.extract(gpx, workers=1)
+    return (filename, track)
+
+
+def post_process_track(item):
+    """
+    run the TrackData.POST_PROCESS steps
+    """
+    (filename, track) = item
+    track.post_process()
+    return (filename, track)
+
+
+class Summarise:
+    """
+    a stage function turning (filename, TrackData) into (filename, summary),
+    with the options of track_analyzer.summarise_track()
+    """
+
+    def __init__(self, best_efforts=(), splits=None, sketches=False):
+        self.best_efforts = tuple(best_efforts)
+        self.splits = splits
+        self.sketches = sketches
+
+    def __call__(self, item):
+        (filename, track) = item
+        return (
+            filename,
+            track_analyzer.summary_record(
+                filename, track, self.best_efforts, self.splits, self.sketches
+            ),
+        )
+
+
+class LibrarySink:
+    """
+    a stage function storing each summary in a track_library.TrackLibrary
+    """
+
+    def __init__(self, library):
+        self.library = library
+
+    def __call__(self, item):
+        (filename, summary) = item
+        self.library.store(filename, summary)
+        return item
+
+
+class StreamSink:
+    """
+    a stage function writing each summary to a stream as a json line
+    """
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+
+    def __call__(self, item):
+        (unused_filename, summary) = item
+        self.out_file.write(json.dumps(summary) + "\n")
+        self.out_file.flush()
+        return item
+
+
+def ingest_pipeline(
+    sink,
+    read_workers=4,
+    cpu_workers=None,
+    best_efforts=(),
+    splits=None,
+    sketches=False,
+    queue_size=4,
+):
+    """
+    the ingest Pipeline: read and decompress on a pool of threads, then
+    parse, extract points, post process and summarise on a pool of processes,
+    then hand each summary to sink on a single thread.  The CPU bound steps
+    are chained into one stage so the parsed gpx never leaves its process.
+    The pipeline is run over file names, e.g. from
+    track_analyzer.select_track_paths().
+    """
+    cpu_workers = cpu_workers or os.cpu_count()
+    return Pipeline(
+        [
+            Stage("read", read_track, read_workers, "thread"),
+            Stage(
+                "analyse",
+                Chain(
+                    parse_track,
+                    extract_track,
+                    post_process_track,
+                    Summarise(best_efforts, splits, sketches),
+                ),
+                cpu_workers,
+                "process",
+            ),
+            Stage("sink", sink, 1, "thread"),
+        ],
+        queue_size,
+    )
+
+
+class TestStuff(unittest.TestCase):
+    """
+    run pipelines over made up items and test tracks
+    """
+
+    def test_00(self):
+        """
+        a slow last stage holds back the source, and failures are dropped
+        """
+        produced = []
+        consumed = []
+        most_held = [0]
+
+        def source():
+            for n in range(40):
+                produced.append(n)
+                most_held[0] = max(most_held[0], len(produced) - len(consumed))
+                yield n
+
+        def halve(n):
+            if n == 13:
+                raise ValueError("unlucky")
+            return n / 2 if n % 10 else None  # drop the multiples of 10
+
+        def slow_sink(n):
+            time.sleep(0.002)
+            consumed.append(n)
+            return n
+
+        pipeline = Pipeline(
+            [Stage("halve", halve, 2), Stage("sink", slow_sink, 1)], queue_size=2
+        )
+        results = sorted(pipeline.run(source()))
+        self.assertEqual(len(results), 40 - 4 - 1)
+        self.assertEqual(pipeline.errors, 1)
+        # the queues and workers hold a handful, never all 40
+        self.assertLess(most_held[0], 20)
+
+    def test_01(self):
+        """
+        ingest test tracks, one of them compressed and one broken, into a
+        library
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            names = [
+                track_analyzer.synthetic_gpx(os.path.join(tmp_dir, f"{n}.gpx"))
+                for n in range(2)
+            ]
+            with open(names[1], "rb") as plain_file:
+                with gzip.open(names[1] + ".gz", "wb") as compressed:
+                    compressed.write(plain_file.read())
+            names[1] += ".gz"
+            broken = os.path.join(tmp_dir, "broken.gpx")
+            with open(broken, "w", encoding="utf-8") as out:
+                out.write("<gpx><trk>")
+            library = track_library.TrackLibrary(os.path.join(tmp_dir, "cache"))
+            pipeline = ingest_pipeline(
+                LibrarySink(library),
+                read_workers=2,
+                cpu_workers=2,
+                best_efforts=(1000,),
+            )
+            stored = sorted(
+                filename for (filename, unused) in pipeline.run(names + [broken])
+            )
+            self.assertEqual(stored, sorted(names))
+            self.assertEqual(pipeline.errors, 1)
+            record = library.load(names[1])
+            self.assertAlmostEqual(record["best_1000m"], 1000 / 3.0, delta=2)
+            self.assertEqual(
+                record,
+                dict(
+                    track_analyzer.summarise_track(names[1], best_efforts=(1000,)),
+                    source=record["source"],
+                    start_place=0,
+                    end_place=1,
+                ),
+            )
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    will ingest tracks into a library (or to stdout), or run unit tests
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument(
+        "--start",
+        help="first track date, yyyy-mm-dd",
+        type=pd.to_datetime,
+    )
+    parser.add_argument(
+        "--end", help="last track date, yyyy-mm-dd", type=pd.to_datetime
+    )
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument(
+        "--io-workers", help="number of threads reading files", type=int, default=4
+    )
+    parser.add_argument("--library", help="track library to store summaries in")
+    parser.add_argument(
+        "--best-effort",
+        help="distance in metres to find the best effort for, may be repeated",
+        type=float,
+        action="append",
+        dest="best_efforts",
+    )
+    parser.add_argument(
+        "paths", help="track files, directories or globs", type=str, nargs="*"
+    )
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    else:
+        logging.basicConfig(level=logging.INFO)
+        if args.library:
+            sink = LibrarySink(track_library.TrackLibrary(args.library))
+        else:
+            sink = StreamSink(sys.stdout)
+        pipeline = ingest_pipeline(
+            sink,
+            read_workers=args.io_workers,
+            cpu_workers=args.workers,
+            best_efforts=args.best_efforts or (1000, 5000, 10000),
+            sketches=True,
+        )
+        count = 0
+        for unused_item in pipeline.run(
+            track_analyzer.select_track_paths(args.paths, args.start, args.end)
+        ):
+            count += 1
+        logging.info(f"ingested {count} tracks, {pipeline.errors} failed")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)
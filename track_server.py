@@ -0,0 +1,481 @@
+#! /usr/bin/env python3
+"""
+    track_server: a local json service over track_analyzer, so notebooks
+    and scripts share one cache of results and one pool of workers rather
+    than each slurping the same tracks again
+"""
+__module__ = "track_server"
+
+import asyncio
+import collections
+import concurrent.futures
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import argparse
+import pandas as pd
+
+import track_analyzer
+
+# the tracks most recently slurped by this (worker) process, so asking for
+# several results of one track only slurps it once
+WORKER_TRACKS = collections.OrderedDict()  # (path, size, mtime) -> TrackData
+WORKER_TRACKS_MAX = 8
+
+
+def file_signature(path):
+    """
+    (absolute path, size, modification time) of a track file, which changes
+    whenever the file does
+    """
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+
+def worker_track(signature):
+    """
+    the TrackData of a file, from WORKER_TRACKS if it's there
+    """
+    if signature in WORKER_TRACKS:
+        WORKER_TRACKS.move_to_end(signature)
+        return WORKER_TRACKS[signature]
+    track = track_analyzer.TrackData()
+    track.slurp(signature[0])
+    WORKER_TRACKS[signature] = track
+    while len(WORKER_TRACKS) > WORKER_TRACKS_MAX:
+        WORKER_TRACKS.popitem(last=False)
+    return track
+
+
+def summary_result(signature, track):
+    """
+    the track's summary, as stored in a track library
+    """
+    return track_analyzer.summary_record(signature[0], track)
+
+
+def stats_result(unused_signature, track):
+    """
+    TrackData.strava_stats() with times in seconds and pace in seconds per km
+    """
+    stats = track.strava_stats()
+    return {
+        "moving_distance": float(stats["moving_distance"]),
+        "moving_time": stats["moving_time"].total_seconds(),
+        "avg_secs_per_km": stats["avg_pace"].total_seconds(),
+        "elapsed_time": stats["elapsed_time"].total_seconds(),
+    }
+
+
+def best_efforts_result(unused_signature, track, distances=(1000, 5000, 10000)):
+    """
+    TrackData.best_effort() over each distance, keyed by the distance
+    """
+    return {f"{distance:g}": track.best_effort(distance) for distance in distances}
+
+
+def splits_result(unused_signature, track, lap="km"):
+    """
+    TrackData.splits() as a list of dicts, one per split
+    """
+    return json.loads(track.splits(lap).reset_index().to_json(orient="records"))
+
+
+def bounds_result(unused_signature, track):
+    """
+    the bounding box and centre of the track
+    """
+    return {
+        "north": float(track.north_bound),
+        "south": float(track.south_bound),
+        "east": float(track.east_bound),
+        "west": float(track.west_bound),
+        "centre": [float(value) for value in track.centre],
+    }
+
+
+# endpoint -> function of (file signature, TrackData, **options)
+TRACK_ENDPOINTS = {
+    "summary": summary_result,
+    "stats": stats_result,
+    "best_efforts": best_efforts_result,
+    "splits": splits_result,
+    "bounds": bounds_result,
+}
+
+
+def analyse(endpoint, signature, options):
+    """
+    work out one endpoint's result for a track, in a worker process
+    """
+    return TRACK_ENDPOINTS[endpoint](signature, worker_track(signature), **options)
+
+
+def endpoint_options(endpoint, query):
+    """
+    the options of an endpoint from its query string, as a sorted tuple of
+    (name, value) pairs so requests can be matched against each other.
+    Raises ValueError for bad values.
+    """
+    if endpoint == "best_efforts" and "distance" in query:
+        return (("distances", tuple(sorted(float(d) for d in query["distance"]))),)
+    if endpoint == "splits" and "lap" in query:
+        lap = query["lap"][0]
+        if lap not in track_analyzer.TrackData.SPLIT_DISTANCES:
+            lap = float(lap)
+        return (("lap", lap),)
+    return ()
+
+
+def track_dates(query):
+    """
+    the start and end dates a tracks request is limited to, None when not
+    given.  Raises ValueError for dates which can't be parsed.
+    """
+    return tuple(
+        pd.to_datetime(query[bound][0]) if query.get(bound, [""])[0] else None
+        for bound in ("start", "end")
+    )
+
+
+def list_tracks(roots, start, end):
+    """
+    the tracks under the root directories (or globs) recorded between the
+    start and end dates, see track_analyzer.select_track_paths()
+    """
+    return list(track_analyzer.select_track_paths(roots, start, end))
+
+
+class RequestError(Exception):
+    """
+    a request which can't be answered, with the http status to answer with
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class TrackServer:
+    """
+    An asyncio HTTP server answering GETs such as /summary?path=... with
+    json.  Results are kept in a track_analyzer.AnalysisCache keyed by the
+    endpoint, its options and the track file's path, size and modification
+    time, so a changed file is analysed afresh.  Results which aren't
+    cached are worked out on a pool of worker processes, and identical
+    requests arriving while one is being worked out wait for the same result.
+
+    The track endpoints, each taking the track file as path=, are summary,
+    stats, best_efforts (distance= metres, may be repeated), splits (lap=
+    km, mile or metres) and bounds.  tracks lists the files under root= (may
+    be repeated) between the optional start= and end= dates and status
+    reports the cache.  Only loopback addresses can be served on.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=None, cache_size=256):
+        if host != "localhost" and not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"{host} isn't a loopback address")
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.cache = track_analyzer.AnalysisCache(cache_size)
+        self.in_flight = {}  # cache key -> asyncio.Future of the result
+        self.computed = 0  # results worked out on the pool
+        self.coalesced = 0  # requests which waited on another's result
+        self.executor = None
+        self.server = None
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self):
+        """
+        start the pool and listen, setting port if it was 0
+        """
+        # the loop's default executor has threads running, so don't fork
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info(f"serving on http://{self.host}:{self.port}")
+
+    async def close(self):
+        """
+        stop listening and shut the pool down
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def serve_forever(self):
+        """
+        start and serve until cancelled
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle(self, reader, writer):
+        """
+        answer one request and close the connection
+        """
+        request_line = b""
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # the headers aren't needed
+            try:
+                (method, target, unused_version) = request_line.decode().split()
+            except ValueError:
+                raise RequestError(400, "bad request line") from None
+            if method != "GET":
+                raise RequestError(405, f"{method} not supported")
+            url = urllib.parse.urlsplit(target)
+            body = await self.answer(
+                url.path.strip("/"), urllib.parse.parse_qs(url.query)
+            )
+            status = 200
+        except RequestError as error:
+            (status, body) = (error.status, {"error": str(error)})
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.exception(f"failed to answer {request_line}")
+            (status, body) = (500, {"error": str(error)})
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n".encode() + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def answer(self, endpoint, query):
+        """
+        the json body for an endpoint
+        """
+        if endpoint == "status":
+            return {
+                "cached": len(self.cache.results),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+                "computed": self.computed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self.in_flight),
+            }
+        if endpoint == "tracks":
+            if "root" not in query:
+                raise RequestError(400, "tracks needs a root")
+            try:
+                (start, end) = track_dates(query)
+            except ValueError as error:
+                raise RequestError(400, str(error)) from None
+            return await asyncio.get_running_loop().run_in_executor(
+                None, list_tracks, query["root"], start, end
+            )
+        if endpoint not in TRACK_ENDPOINTS:
+            raise RequestError(404, f"no endpoint {endpoint}")
+        if "path" not in query:
+            raise RequestError(400, f"{endpoint} needs a path")
+        try:
+            signature = file_signature(query["path"][0])
+        except OSError:
+            raise RequestError(404, f"can't read {query['path'][0]}") from None
+        try:
+            options = endpoint_options(endpoint, query)
+        except ValueError as error:
+            raise RequestError(400, str(error)) from None
+        return await self.result(endpoint, signature, options)
+
+    async def result(self, endpoint, signature, options):
+        """
+        an endpoint's result for a track: from the cache, from a request
+        already working it out, or else worked out on the pool
+        """
+        key = (endpoint, signature, options)
+        (found, result) = self.cache.get(key)
+        if found:
+            return result
+        if key in self.in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self.in_flight[key])
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, analyse, endpoint, signature, dict(options)
+        )
+        self.in_flight[key] = future
+        try:
+            result = await asyncio.shield(future)
+            self.computed += 1
+            self.cache.put(key, result)
+        finally:
+            del self.in_flight[key]
+        return result
+
+
+class TestStuff(unittest.TestCase):
+    """
+    run a server on a thread and ask it about test tracks
+    """
+
+    def setUp(self):
+        self.tmp_dir = (
+            tempfile.TemporaryDirectory()
+        )  # pylint: disable=consider-using-with
+        self.server = TrackServer(port=0, workers=2)
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.tmp_dir.cleanup()
+
+    def get(self, endpoint, **query):
+        """
+        (status, json body) of a request
+        """
+        url = (
+            f"http://127.0.0.1:{self.server.port}/{endpoint}?"
+            f"{urllib.parse.urlencode(query, doseq=True)}"
+        )
+        try:
+            with urllib.request.urlopen(url) as response:
+                return (response.status, json.load(response))
+        except urllib.error.HTTPError as error:
+            return (error.code, json.load(error))
+
+    def test_00(self):
+        """
+        each endpoint agrees with TrackData, and repeats come from the cache
+        """
+        os.makedirs(os.path.join(self.tmp_dir.name, "2023-07"))
+        track_file = track_analyzer.synthetic_gpx(
+            os.path.join(self.tmp_dir.name, "2023-07", "2023-07-17_10-52_Mon.gpx")
+        )
+        track = track_analyzer.TrackData()
+        track.slurp(track_file)
+
+        (status, summary) = self.get("summary", path=track_file)
+        self.assertEqual(status, 200)
+        self.assertEqual(summary["track_date"], "2023-07-17T10:52:00")
+        self.assertAlmostEqual(
+            summary["moving_distance"], track.summary()["moving_distance"]
+        )
+        (status, stats) = self.get("stats", path=track_file)
+        self.assertAlmostEqual(
+            stats["moving_time"], track.strava_stats()["moving_time"].total_seconds()
+        )
+        (status, efforts) = self.get(
+            "best_efforts", path=track_file, distance=[1000, 1796]
+        )
+        # 3 m a second: 1000 m takes 334 points, 1796 m the whole track
+        self.assertEqual(efforts["1000"]["moving_time"], 334)
+        self.assertAlmostEqual(efforts["1000"]["distance"], 1002, places=6)
+        self.assertEqual(efforts["1796"]["moving_time"], 599)
+        (status, splits) = self.get("splits", path=track_file, lap="mile")
+        self.assertEqual(len(splits), 2)
+        (status, bounds) = self.get("bounds", path=track_file)
+        self.assertAlmostEqual(bounds["north"], track.north_bound)
+        (status, tracks) = self.get(
+            "tracks", root=self.tmp_dir.name, start="2023-07-01", end="2023-07-31"
+        )
+        self.assertEqual(tracks, [track_file])
+        (status, error) = self.get("tracks", root=self.tmp_dir.name, start="2023-13-45")
+        self.assertEqual(status, 400)
+
+        computed = self.server.computed
+        (status, again) = self.get("summary", path=track_file)
+        self.assertEqual(again, summary)
+        self.assertEqual(self.server.computed, computed)
+        self.assertEqual(self.get("status")[1]["hits"], 1)
+
+        self.assertEqual(self.get("nonsense", path=track_file)[0], 404)
+        self.assertEqual(self.get("summary")[0], 400)
+        self.assertEqual(self.get("summary", path="missing.gpx")[0], 404)
+        self.assertEqual(self.get("splits", path=track_file, lap="lap")[0], 400)
+        with self.assertRaises(ValueError):
+            TrackServer(host="0.0.0.0")
+
+    def test_01(self):
+        """
+        identical requests arriving together are worked out once, and a
+        changed file is worked out again
+        """
+        track_file = track_analyzer.synthetic_gpx(
+            os.path.join(self.tmp_dir.name, "t.gpx"), points=3000
+        )
+        with concurrent.futures.ThreadPoolExecutor(6) as pool:
+            answers = list(
+                pool.map(lambda unused: self.get("summary", path=track_file), range(6))
+            )
+        self.assertTrue(all(answer == answers[0] for answer in answers))
+        self.assertEqual(self.server.computed, 1)
+        self.assertEqual(
+            self.server.coalesced + self.server.cache.hits, len(answers) - 1
+        )
+
+        track_analyzer.synthetic_gpx(track_file, points=1000)
+        os.utime(track_file, (1, 1))  # a different modification time for sure
+        (status, summary) = self.get("summary", path=track_file)
+        self.assertEqual(summary["points"], 1000)
+        self.assertEqual(self.server.computed, 2)
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    will serve track results on localhost, or run unit tests
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument(
+        "--host", help="loopback address to serve on", default="127.0.0.1"
+    )
+    parser.add_argument("--port", help="port to serve on", type=int, default=8765)
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument(
+        "--cache-size", help="number of results to keep", type=int, default=256
+    )
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    else:
+        logging.basicConfig(level=logging.INFO)
+        server = TrackServer(args.host, args.port, args.workers, args.cache_size)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)
@@ -0,0 +1,419 @@
+#! /usr/bin/env python3
+"""
+    track_watcher: notice new OSMAnd tracks as rclone shadows them from google
+    drive, and analyse them in the background so the results are waiting in
+    the track library before they're asked for
+"""
+__module__ = "track_watcher"
+
+import concurrent.futures
+import gzip
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import argparse
+
+import track_analyzer
+import track_library
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None  # fall back to polling the directory tree
+
+
+class TrackWatcher:
+    """
+    Watch an OSMAnd track directory, laid out as YYYY-MM/*.gpx, and hand new
+    or changed tracks to a bounded pool of workers.
+
+    A file is only processed once its size and modification time have stayed
+    the same for settle_time seconds, so tracks which rclone is still
+    writing are left alone.  Where inotify_simple is installed, file system
+    events wake the watcher and only the touched files are looked at,
+    otherwise the whole tree is polled every poll_interval seconds.  Either
+    way a file is only checked against the library, or tried again after
+    failing, once its size or modification time changes.
+    """
+
+    MONTH_DIR = track_analyzer.OSMAnd_Track_File.MONTH_DIR
+
+    def __init__(
+        self,
+        root,
+        library,
+        workers=2,
+        settle_time=5.0,
+        poll_interval=2.0,
+        splits="km",
+    ):
+        """
+        root: the OSMAnd tracks directory
+        library: a track_library.TrackLibrary to persist the summaries into
+        splits: the lap for the splits table stored with each summary, or None
+        """
+        self.root = root
+        self.library = library
+        self.workers = workers
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.splits = splits
+        self.pending = {}  # path -> ((size, mtime), time it was last seen to change)
+        self.in_flight = {}  # future -> path
+        self.fingerprints = {}  # path -> fingerprint of the tracks in flight
+        self.signatures = {}  # path -> (size, mtime) of the tracks in flight
+        self.seen = {}  # path -> (size, mtime) when found in the library
+        self.failed = {}  # path -> (size, mtime) when it failed
+        self.dirty = None  # None means look at every file on the next scan
+        self.watches = {}  # inotify watch descriptor -> directory
+        self.logger = logging.getLogger(__name__)
+
+    def candidate_files(self):
+        """
+        every track file (see track_analyzer.TRACK_SUFFIXES) in the YYYY-MM
+        directories under root
+        """
+        for month_dir in sorted(os.listdir(self.root)):
+            month_path = os.path.join(self.root, month_dir)
+            if not self.MONTH_DIR.match(month_dir) or not os.path.isdir(month_path):
+                continue
+            for file_name in sorted(os.listdir(month_path)):
+                if file_name.endswith(track_analyzer.TRACK_SUFFIXES):
+                    yield os.path.join(month_path, file_name)
+
+    def scan(self, now=None):
+        """
+        look for new or changed tracks, returning the ones which have settled
+        and are ready to be processed
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.dirty is None:
+            to_check = set(self.candidate_files())
+        else:
+            to_check = self.dirty
+        to_check = to_check.union(self.pending)
+        self.dirty = set()
+
+        busy = set(self.in_flight.values())
+        ready = []
+        for path in sorted(to_check):
+            if path in busy:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.pending.pop(path, None)
+                self.seen.pop(path, None)
+                self.failed.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if path not in self.pending:
+                if signature in (self.seen.get(path), self.failed.get(path)):
+                    continue  # unchanged since it was stored or failed
+                if self.library.is_current(path):
+                    self.seen[path] = signature
+                    continue
+                self.pending[path] = (signature, now)
+            elif self.pending[path][0] != signature:
+                self.pending[path] = (signature, now)  # still being written
+            elif now - self.pending[path][1] >= self.settle_time:
+                ready.append(path)
+        return ready
+
+    def submit(self, executor, ready):
+        """
+        queue settled tracks on the executor, never holding more than two
+        tracks per worker in flight.  Anything not submitted stays pending
+        and is picked up on a later scan.  Copies of tracks already in the
+        library are linked to the original rather than analysed again.
+        """
+        for path in ready:
+            if len(self.in_flight) >= 2 * self.workers:
+                break
+            (signature, unused_changed) = self.pending.pop(path)
+            try:
+                fingerprint = track_analyzer.track_fingerprint(path)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception(f"failed to fingerprint {path}")
+                self.failed[path] = signature
+                continue
+            original = self.library.find_duplicate(path, fingerprint)
+            if original is not None:
+                self.logger.info(f"{path} is a copy of {original}")
+                self.library.link_duplicate(path, original, fingerprint)
+                self.seen[path] = signature
+                continue
+            self.fingerprints[path] = fingerprint
+            self.signatures[path] = signature
+            self.logger.debug(f"submit() {path}")
+            future = executor.submit(
+                track_analyzer.summarise_track, path, splits=self.splits, sketches=True
+            )
+            self.in_flight[future] = path
+
+    def collect(self, timeout=0):
+        """
+        store the summaries of finished tracks in the library, returning
+        the paths which were stored.  Tracks which failed aren't tried again
+        until they change.
+        """
+        (done, unused_not_done) = concurrent.futures.wait(
+            self.in_flight, timeout=timeout
+        )
+        stored = []
+        for future in done:
+            path = self.in_flight.pop(future)
+            fingerprint = self.fingerprints.pop(path)
+            signature = self.signatures.pop(path)
+            try:
+                self.library.store(path, dict(future.result(), fingerprint=fingerprint))
+                stored.append(path)
+                self.seen[path] = signature
+            except Exception:  # pylint: disable=broad-except
+                # one bad track mustn't stop the watcher
+                self.logger.exception(f"failed to process {path}")
+                self.failed[path] = signature
+        return stored
+
+    def run_once(self, executor, now=None):
+        """
+        one turn of the watcher: scan, submit and collect
+        """
+        self.submit(executor, self.scan(now))
+        return self.collect()
+
+    def _watch_events(self, inotify, timeout):
+        """
+        wait up to timeout seconds for inotify events and turn them into files
+        to be looked at on the next scan, adding watches on month directories
+        as they appear
+        """
+        for event in inotify.read(timeout=int(timeout * 1000)):
+            parent = self.watches.get(event.wd)
+            if parent is None:
+                continue
+            path = os.path.join(parent, event.name)
+            if parent == self.root:
+                if self.MONTH_DIR.match(event.name) and os.path.isdir(path):
+                    self._add_watch(inotify, path)
+                    self.dirty = None  # pick up anything already in there
+            elif (
+                event.name.endswith(track_analyzer.TRACK_SUFFIXES)
+                and self.dirty is not None
+            ):
+                self.dirty.add(path)
+
+    def _add_watch(self, inotify, path):
+        """
+        watch a directory for files being written, created or moved in
+        """
+        flags = inotify_simple.flags
+        watch = inotify.add_watch(
+            path, flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MODIFY
+        )
+        self.watches[watch] = path
+
+    def run(self, stop_event=None):
+        """
+        watch until stop_event is set (or forever)
+        """
+        if stop_event is None:
+            stop_event = threading.Event()
+        inotify = None
+        if inotify_simple is not None:
+            inotify = inotify_simple.INotify()
+            self._add_watch(inotify, self.root)
+            for month_dir in os.listdir(self.root):
+                if self.MONTH_DIR.match(month_dir):
+                    self._add_watch(inotify, os.path.join(self.root, month_dir))
+        else:
+            self.logger.info("inotify_simple not installed, polling instead")
+
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            while not stop_event.is_set():
+                for path in self.run_once(executor):
+                    self.logger.info(f"processed {path}")
+                if inotify is None:
+                    stop_event.wait(self.poll_interval)
+                    self.dirty = None  # nothing says what changed, look at it all
+                elif self.pending or self.in_flight:
+                    # files are settling or being processed, so come back
+                    # and look at them soon whether or not there are events
+                    self._watch_events(inotify, min(1.0, self.poll_interval))
+                else:
+                    self._watch_events(inotify, self.poll_interval)
+            self.collect(timeout=None)
+
+
+class TestStuff(unittest.TestCase):
+    """
+    drive the watcher against a temporary OSMAnd shaped directory
+    """
+
+    def test_00(self):
+        """
+        a new track is only submitted once it has settled, and then lands in
+        the library
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "tracks")
+            os.makedirs(os.path.join(root, "2023-07"))
+            os.makedirs(os.path.join(root, "not-a-month"))
+            track_file = track_analyzer.synthetic_gpx(
+                os.path.join(root, "2023-07", "2023-07-17_10-52_Mon.gpx")
+            )
+            track_analyzer.synthetic_gpx(os.path.join(root, "not-a-month", "x.gpx"))
+            library = track_library.TrackLibrary(os.path.join(tmp_dir, "cache"))
+            watcher = TrackWatcher(root, library, workers=1, settle_time=5)
+
+            self.assertEqual(watcher.scan(now=100), [])
+            self.assertEqual(watcher.scan(now=102), [])
+            self.assertEqual(watcher.scan(now=105), [track_file])
+
+            with concurrent.futures.ThreadPoolExecutor(1) as executor:
+                watcher.submit(executor, [track_file])
+                self.assertEqual(watcher.collect(timeout=None), [track_file])
+            record = library.load(track_file)
+            self.assertEqual(record["activity_type"], "run")
+            self.assertEqual(len(record["splits"]), 2)
+            self.assertIn("speed", record["sketches"])
+            watcher.dirty = None
+            self.assertEqual(watcher.scan(now=200), [])
+
+            copy_file = os.path.join(root, "2023-07", "Titled_copy.gpx")
+            shutil.copy(track_file, copy_file)
+            watcher.dirty = None
+            self.assertEqual(watcher.scan(now=300), [])
+            self.assertEqual(watcher.scan(now=305), [copy_file])
+            watcher.submit(None, [copy_file])  # never reaches the executor
+            self.assertEqual(
+                library.load(copy_file)["duplicate_of"], os.path.abspath(track_file)
+            )
+
+    def test_01(self):
+        """
+        a file which keeps changing is not ready
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "2023-07"))
+            track_file = os.path.join(tmp_dir, "2023-07", "2023-07-17_10-52_Mon.gpx")
+            with open(track_file, "w", encoding="utf-8") as out:
+                out.write("<gpx>")
+            library = track_library.TrackLibrary(os.path.join(tmp_dir, "cache"))
+            watcher = TrackWatcher(tmp_dir, library, settle_time=5)
+            watcher.scan(now=100)
+            with open(track_file, "a", encoding="utf-8") as out:
+                out.write("<trk>")
+            self.assertEqual(watcher.scan(now=106), [])
+            self.assertEqual(watcher.scan(now=111), [track_file])
+
+            # it isn't a track, so fails, and isn't tried again until it changes
+            with concurrent.futures.ThreadPoolExecutor(1) as executor:
+                watcher.submit(executor, [track_file])
+                self.assertEqual(watcher.collect(timeout=None), [])
+            watcher.dirty = None
+            with unittest.mock.patch.object(library, "is_current") as is_current:
+                self.assertEqual(watcher.scan(now=120), [])
+                self.assertEqual(watcher.scan(now=130), [])
+                is_current.assert_not_called()
+            with open(track_file, "a", encoding="utf-8") as out:
+                out.write("</trk>")
+            watcher.dirty = None
+            watcher.scan(now=140)
+            self.assertEqual(watcher.scan(now=145), [track_file])
+
+            # a compressed track is picked up too, and once stored is left be
+            gz_file = os.path.join(tmp_dir, "2023-07", "2023-07-18_10-52_Tue.gpx.gz")
+            with open(gz_file, "wb") as out:
+                out.write(gzip.compress(b"<gpx/>"))
+            library.store(gz_file, {"activity_type": "run"})
+            watcher.dirty = None
+            self.assertEqual(watcher.scan(now=150), [track_file])
+            self.assertEqual(watcher.seen, {gz_file: watcher.seen[gz_file]})
+            with unittest.mock.patch.object(library, "is_current") as is_current:
+                watcher.dirty = None
+                watcher.scan(now=160)
+                is_current.assert_not_called()
+
+    def test_02(self):
+        """
+        when polling, a track added after the first scan is found without
+        anything marking it dirty
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "tracks")
+            os.makedirs(os.path.join(root, "2023-07"))
+            library = track_library.TrackLibrary(os.path.join(tmp_dir, "cache"))
+            watcher = TrackWatcher(root, library, settle_time=5, poll_interval=0.01)
+            stop_event = threading.Event()
+            track_file = os.path.join(root, "2023-07", "2023-07-17_10-52_Mon.gpx")
+
+            def add_track_later():
+                time.sleep(0.2)
+                track_analyzer.synthetic_gpx(track_file)
+
+            with unittest.mock.patch(f"{__name__}.inotify_simple", None):
+                # a zero settle time, so the track is taken as soon as seen
+                watcher.settle_time = 0
+                adder = threading.Thread(target=add_track_later)
+                adder.start()
+                runner = threading.Thread(target=watcher.run, args=(stop_event,))
+                runner.start()
+                deadline = time.monotonic() + 30
+                while library.load(track_file) is None and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                stop_event.set()
+                runner.join()
+                adder.join()
+            self.assertIsNotNone(library.load(track_file))
+
+
+def do_tests():
+    """
+    run some unit tests
+    """
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStuff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+def main():
+    """
+    called when not imported as a module
+    will watch an OSMAnd track directory, or run unit tests
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test", help="run the unit tests", action="store_true")
+    parser.add_argument("--workers", help="number of worker processes", type=int)
+    parser.add_argument(
+        "--settle", help="seconds a file must be unchanged", type=float, default=5.0
+    )
+    parser.add_argument("root", help="OSMAnd tracks directory", type=str, nargs="?")
+    parser.add_argument("cache", help="track library directory", type=str, nargs="?")
+    args = parser.parse_args()
+    if args.test:
+        print("running unit tests")
+        do_tests()
+    else:
+        logging.basicConfig(level=logging.INFO)
+        watcher = TrackWatcher(
+            args.root,
+            track_library.TrackLibrary(args.cache),
+            workers=args.workers or os.cpu_count(),
+            settle_time=args.settle,
+        )
+        watcher.run()
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
+else:
+    print(f"module {__module__} imported", file=sys.stderr)